@@ -0,0 +1,199 @@
+"""
+Async versions of the read-heavy shop and order endpoints, for ASGI servers.
+
+They are served under ``async/`` with the same query parameters and JSON as
+their counterparts in ecomm.views, and share their querysets, serializers,
+permission classes and catalog cache entries. DRF has no async views, so
+``async_api_view`` does the authentication (JWT, then session) and
+permission checks itself with the same classes.
+"""
+from functools import partial, wraps
+
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import exceptions, status
+from rest_framework.permissions import IsAuthenticated
+
+from .authentication import ClaimsJWTAuthentication
+from .catalog_cache import cached_catalog_view
+from .facets import ashop_facets, wants_facets
+from .fastpath import (
+    ITEM_FIELDS, ITEM_LIST_FIELDS, ORDER_FIELDS, aorder_rows, item_list_row, json_response, order_rows,
+)
+from .fieldsets import FieldsetError
+from .models import Category, inventory, Order
+from .pagination import PaginationError, apaginate, keyset_filter, parse_limit
+from .serializers import ItemListSerializer, ItemSerializer, OrderSerializer
+from .shop_filters import FILTERS as RANGE_FILTERS, FilterError
+from .snapshot import aget_snapshot, serves_list
+from .streaming import STREAM_CHUNK_SIZE, aserialize_iter, ndjson_response
+from .views import category_names, order_history, order_queryset, shop_item_queryset
+
+
+def error_response(exc):
+    headers = None
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        exc.status_code = status.HTTP_401_UNAUTHORIZED
+        headers = {'WWW-Authenticate': ClaimsJWTAuthentication().authenticate_header(None)}
+    detail = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+    return json_response(detail, exc.status_code, headers)
+
+
+async def authenticate(request):
+    """Return the request's user: a JWT bearer token first, then the session"""
+    result = await ClaimsJWTAuthentication().aauthenticate(request)
+    if result is not None:
+        return result[0]
+    user = await request.auser()
+    return user if user.is_authenticated else AnonymousUser()
+
+
+def async_api_view(permission_classes):
+    """The async counterpart of ``@api_view(['GET'])`` + ``@permission_classes``"""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return error_response(exceptions.MethodNotAllowed(request.method))
+            try:
+                request.user = await authenticate(request)
+                for permission_class in permission_classes:
+                    permission = permission_class()
+                    if not permission.has_permission(request, None):
+                        if not request.user.is_authenticated:
+                            raise exceptions.NotAuthenticated()
+                        raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+            except exceptions.APIException as exc:
+                return error_response(exc)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@async_api_view([IsAuthenticated])
+@cached_catalog_view('shop-item-list',
+                     params=('category', 'search', 'ordering', 'cursor', 'limit', 'fields', 'exclude',
+                             'facets', *RANGE_FILTERS))
+async def shop_item_list(request):
+    """
+    GET /async/shop/list - Cursor paginated shop items, see views.shop_item_list
+    """
+    try:
+        queryset, ordering, fast, fields = shop_item_queryset(request.GET)
+    except (FieldsetError, FilterError) as e:
+        return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    snapshot = await aget_snapshot() if serves_list(request.GET) else None
+    if snapshot is not None:
+        try:
+            data = snapshot.shop_list(request.GET, ordering, fields)
+        except PaginationError as e:
+            return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+        if wants_facets(request.GET):
+            data['facets'] = await ashop_facets(request.GET, queryset, snapshot)
+        return json_response(data)
+    build = ITEM_LIST_FIELDS.builder(fields, item_list_row)
+
+    cursor = request.GET.get('cursor')
+    try:
+        if request.GET.get('stream'):
+            queryset = keyset_filter(queryset, ordering, cursor)
+            if request.GET.get('limit'):
+                queryset = queryset[:parse_limit(request.GET.get('limit'))]
+            if fast:
+                rows = (build(row) async for row in queryset.aiterator(chunk_size=STREAM_CHUNK_SIZE))
+            else:
+                rows = aserialize_iter(queryset, ItemListSerializer, context={'request': request}, fields=fields)
+            return ndjson_response(rows)
+        limit = parse_limit(request.GET.get('limit'))
+        items, next_cursor = await apaginate(queryset, ordering, cursor, limit)
+    except PaginationError as e:
+        return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    if fast:
+        results = [build(row) for row in items]
+    else:
+        results = ItemListSerializer(items, many=True, context={'request': request}, fields=fields).data
+    data = {
+        'results': results,
+        'next_cursor': next_cursor,
+        'limit': limit,
+    }
+    if wants_facets(request.GET):
+        data['facets'] = await ashop_facets(request.GET, queryset)
+    return json_response(data)
+
+
+@async_api_view([IsAuthenticated])
+@cached_catalog_view('shop-item-detail', params=('fields', 'exclude'))
+async def shop_item_detail(request, item_id):
+    """
+    GET /async/shop/item/{id} - Detailed information about a specific item
+    """
+    try:
+        fields = ITEM_FIELDS.select(request.GET)
+    except FieldsetError as e:
+        return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    snapshot = await aget_snapshot()
+    if snapshot is not None:
+        data = snapshot.item(item_id, fields)
+        if data is None:
+            return json_response({'error': 'Item not found'}, status.HTTP_404_NOT_FOUND)
+        return json_response(data)
+    try:
+        item = await ITEM_FIELDS.only(inventory.objects.all(), fields).aget(id=item_id)
+    except inventory.DoesNotExist:
+        return json_response({'error': 'Item not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(ItemSerializer(item, context={'request': request}, fields=fields).data)
+
+
+@async_api_view([IsAuthenticated])
+@cached_catalog_view('shop-categories')
+async def shop_categories(request):
+    """
+    GET /async/shop/categories - List of all available categories
+    """
+    used_ids = {
+        category_id async for category_id in
+        inventory.objects.values_list('category', flat=True).distinct().order_by('category')
+    }
+    categories = [category async for category in Category.objects.all()]
+    return json_response({'categories': category_names(categories, used_ids)})
+
+
+@async_api_view([IsAuthenticated])
+async def order_list(request):
+    """
+    GET /async/orders/past - user's past orders, see views.order_list
+    """
+    try:
+        queryset, build = order_history(request.user, request.GET)
+        limit = parse_limit(request.GET.get('limit'))
+        orders, next_cursor = await apaginate(queryset, '-created_at', request.GET.get('cursor'), limit)
+    except (FieldsetError, PaginationError) as e:
+        return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    if isinstance(build, partial) and build.func is order_rows:
+        # the fast path, its lines query has to run async here
+        data = await aorder_rows(orders, *build.args, **build.keywords)
+    else:
+        data = build(orders)
+    return json_response({
+        'orders': data,
+        'count': len(data),
+        'next_cursor': next_cursor,
+        'limit': limit,
+    })
+
+
+@async_api_view([IsAuthenticated])
+async def order_detail(request, order_id):
+    """
+    GET /async/orders/{id} - Get specific order details
+    """
+    try:
+        fields = ORDER_FIELDS.select(request.GET)
+    except FieldsetError as e:
+        return json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+    try:
+        order = await order_queryset(Order.objects.all(), fields).aget(id=order_id, user_id=request.user.pk)
+    except Order.DoesNotExist:
+        return json_response({'error': 'Order not found'}, status.HTTP_404_NOT_FOUND)
+    return json_response(OrderSerializer(order, fields=fields).data)
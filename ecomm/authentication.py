@@ -0,0 +1,190 @@
+"""
+JWT authentication without a user query per request.
+
+Tokens issued by ``get_tokens_for_user`` carry the fields views need
+(``TOKEN_CLAIMS``). ``ClaimsJWTAuthentication`` builds a ``ClaimsUser`` from
+them instead of loading the ``User`` row.
+
+Role and active flag are authorization state, so they are not trusted from
+the token alone: they come from a bounded in-process cache of
+``user_id -> (role, is_active)`` that expires entries after a TTL. Saving or
+deleting a user evicts its entry in the process that made the change (see
+ecomm.signals); other processes pick the change up within the TTL.
+
+    ECOMM_AUTH_CACHE = {'MAX_ENTRIES': 10000, 'TTL': 60}
+
+Tokens issued before the claims existed still work, through the regular
+database lookup.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+TOKEN_CLAIMS = ('username', 'email', 'first_name', 'last_name', 'role')
+
+
+def add_user_claims(token, user):
+    for claim in TOKEN_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+class ClaimsUser(TokenUser):
+    """Request user built from token claims, ``role`` and ``is_active`` come from the user cache"""
+
+    def __init__(self, token, user_id, role, is_active):
+        super().__init__(token)
+        self.id = self.pk = user_id
+        self.role = role
+        self.is_active = is_active
+
+    @cached_property
+    def email(self):
+        return self.token.get('email', '')
+
+    @cached_property
+    def first_name(self):
+        return self.token.get('first_name', '')
+
+    @cached_property
+    def last_name(self):
+        return self.token.get('last_name', '')
+
+    def __str__(self):
+        return f"{self.username} - {self.role}"
+
+
+class UserStateCache:
+    """LRU of ``user_id -> (role, is_active)`` whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            expires, state = entry
+            if expires < time.monotonic():
+                del self._data[user_id]
+                return None
+            self._data.move_to_end(user_id)
+            return state
+
+    def set(self, user_id, state):
+        with self._lock:
+            self._data[user_id] = (time.monotonic() + self.ttl, state)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def evict(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_user_cache = None
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        config = getattr(settings, 'ECOMM_AUTH_CACHE', {})
+        _user_cache = UserStateCache(config.get('MAX_ENTRIES', 10000), config.get('TTL', 60))
+    return _user_cache
+
+
+@receiver(setting_changed)
+def _reset_user_cache(setting, **kwargs):
+    global _user_cache
+    if setting == 'ECOMM_AUTH_CACHE':
+        _user_cache = None
+
+
+def user_state(user_id):
+    """``(role, is_active)`` of ``user_id``, or None when the user does not exist"""
+    cache = get_user_cache()
+    state = cache.get(user_id)
+    if state is None:
+        state = get_user_model().objects.filter(pk=user_id).values_list('role', 'is_active').first()
+        if state is None:
+            return None
+        cache.set(user_id, state)
+    return state
+
+
+async def auser_state(user_id):
+    """Async version of user_state()"""
+    cache = get_user_cache()
+    state = cache.get(user_id)
+    if state is None:
+        state = await get_user_model().objects.filter(pk=user_id).values_list('role', 'is_active').afirst()
+        if state is None:
+            return None
+        cache.set(user_id, state)
+    return state
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication returning a ClaimsUser, no query once the user's state is cached"""
+
+    def _claims_user_id(self, validated_token):
+        if 'role' not in validated_token:
+            # issued before tokens carried claims
+            return None
+        try:
+            # the claim holds a string, cache entries are keyed by the real pk
+            return get_user_model()._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except (KeyError, ValidationError):
+            return None
+
+    def _claims_user(self, validated_token, user_id, state):
+        if state is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        role, is_active = state
+        if not is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return ClaimsUser(validated_token, user_id, role, is_active)
+
+    def get_user(self, validated_token):
+        user_id = self._claims_user_id(validated_token)
+        if user_id is None:
+            return super().get_user(validated_token)
+        return self._claims_user(validated_token, user_id, user_state(user_id))
+
+    async def aauthenticate(self, request):
+        """Async version of authenticate(), for views outside DRF (ecomm.async_views)"""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+
+        user_id = self._claims_user_id(validated_token)
+        if user_id is None:
+            user = await sync_to_async(super().get_user)(validated_token)
+        else:
+            user = self._claims_user(validated_token, user_id, await auser_state(user_id))
+        return user, validated_token
@@ -0,0 +1,228 @@
+"""
+Shared helpers for the bench_* management commands.
+
+Benchmarks never touch the project database: they run against a scratch
+copy created the same way the test runner creates its test database.
+"""
+import json
+import math
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.db import connection
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+
+
+@contextmanager
+def scratch_database(verbosity=0, name=None):
+    """
+    Run the block against a fresh test database.
+
+    ``name`` overrides the test database name, e.g. a file for SQLite when
+    the dataset does not fit in memory.
+    """
+    if name:
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = name
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity, interactive=False, aliases={'default'})
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+
+
+def throughput(fn, iterations):
+    """Call ``fn(i)`` ``iterations`` times and return calls per second"""
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return iterations / (time.perf_counter() - start)
+
+
+class QueryCounter:
+    """
+    Count queries run on ``connection`` inside the block, and the seconds
+    spent running them.
+
+    Unlike CaptureQueriesContext it survives the query log reset that the
+    test client triggers on every request.
+    """
+
+    def __init__(self, using=None):
+        self.connection = using or connection
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        began = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - began
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+SEED_PASSWORD = 'bench-pass'
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """Let bulk inserts set ``auto_now`` / ``auto_now_add`` fields themselves"""
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def seed_dataset(rows, seed=0, batch_size=5000, log=None):
+    """
+    Insert a deterministic dataset of about ``rows`` rows.
+
+    10% are products, 30% orders and 60% order items, spread over the last
+    365 days. Every user (and the ``bench-keeper`` shopkeeper) has the
+    password ``SEED_PASSWORD``. Rollups are rebuilt at the end, the search
+    index is kept up to date by its triggers.
+    """
+    from django.contrib.auth.hashers import make_password
+    from . import rollups
+    from .models import User, Category, inventory, Order, OrderItem
+
+    rng = random.Random(seed)
+    now = time.time()
+    products = max(rows // 10, 10)
+    orders = max(rows * 3 // 10, 1)
+    items = max(rows - products - orders, orders)
+    users = max(orders // 20, 10)
+
+    password = make_password(SEED_PASSWORD)
+    User.objects.bulk_create(
+        [User(username='bench-keeper', password=password, role='shopkeeper')]
+        + [User(username=f'bench-user-{i}', password=password) for i in range(users)],
+        batch_size=batch_size,
+    )
+    user_ids = list(User.objects.filter(role='user').values_list('id', flat=True))
+    categories = Category.objects.bulk_create(
+        [Category(name=f'category {i}', description=f'bench category {i}') for i in range(20)]
+    )
+
+    def moment():
+        return datetime.fromtimestamp(now - rng.uniform(0, 365 * 86400), tz=timezone.utc)
+
+    with explicit_timestamps(inventory._meta.get_field('created_at'),
+                             Order._meta.get_field('created_at'),
+                             Order._meta.get_field('updated_at')):
+        for start in range(0, products, batch_size):
+            inventory.objects.bulk_create([
+                inventory(
+                    name=f'item {i}', description=f'bench item {i % 997}',
+                    category=rng.choice(categories),
+                    price=Decimal(rng.randrange(100, 100000)) / 100,
+                    quantity=10 ** 9, created_at=moment(),
+                )
+                for i in range(start, min(start + batch_size, products))
+            ])
+            if log:
+                log(f'products {min(start + batch_size, products)}/{products}')
+        prices = dict(inventory.objects.values_list('id', 'price'))
+        product_ids = list(prices)
+
+        per_order = items / orders
+        created = 0
+        for start in range(0, orders, batch_size):
+            batch, lines = [], []
+            for i in range(start, min(start + batch_size, orders)):
+                count = max(1, int(per_order) + (rng.random() < per_order % 1))
+                order_lines = [(pid, rng.randint(1, 5)) for pid in rng.sample(product_ids, count)]
+                created_at = moment()
+                batch.append(Order(
+                    user_id=rng.choice(user_ids),
+                    total_amount=float(sum(prices[pid] * q for pid, q in order_lines)),
+                    status=rng.choice(rollups.STATUSES),
+                    shipping_address=f'{i} Bench Street', phone_number='5550000000',
+                    created_at=created_at, updated_at=created_at,
+                ))
+                lines.append(order_lines)
+            Order.objects.bulk_create(batch)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=pid, quantity=quantity, price=prices[pid])
+                for order, order_lines in zip(batch, lines)
+                for pid, quantity in order_lines
+            ], batch_size=batch_size)
+            created += len(batch)
+            if log:
+                log(f'orders {created}/{orders}')
+
+    rollups.rebuild()
+    return {'products': products, 'orders': orders, 'users': users,
+            'order_items': OrderItem.objects.count()}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies, elapsed):
+    """p50/p95/p99/mean in milliseconds and requests per second"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Return ``[(endpoint, metric, baseline, current, change_pct)]`` for every
+    regression worse than ``threshold`` percent. Query counts regress on
+    any increase.
+    """
+    regressions = []
+    for endpoint, now in sorted(current.items()):
+        before = baseline.get(endpoint)
+        if before is None:
+            continue
+        for metric, higher_is_worse in (('p50_ms', True), ('p95_ms', True), ('p99_ms', True),
+                                        ('throughput_rps', False)):
+            old, new = before.get(metric), now.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append((endpoint, metric, old, new, round(change, 1)))
+        if now.get('queries', 0) > before.get('queries', 0):
+            old, new = before['queries'], now['queries']
+            regressions.append((endpoint, 'queries', old, new,
+                                round((new - old) / old * 100, 1) if old else None))
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,277 @@
+"""
+Bulk inventory upsert from CSV or JSONL uploads.
+
+Every row describes one product with the columns ``id``, ``name``,
+``description``, ``category`` (id or name), ``price`` and ``quantity``.
+A row with an ``id`` updates that product, blank or missing columns keep
+their current value; a row without one creates a product and needs every
+column except ``description``.
+
+The upload is read as a stream and handled ``BATCH_SIZE`` rows at a time,
+each batch in its own transaction: one query loads (and, where the database
+has row locks, locks) the products it updates, then one upsert per set of
+columns the rows change and one ``bulk_create`` for the new rows. An update
+writes only the columns its row sets, so a price change never writes back a
+quantity that orders or restocks changed meanwhile. Invalid rows are
+skipped and reported, they never abort the rest of the import.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import Category, inventory
+from .streaming import chunked
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+COLUMNS = ('name', 'description', 'category', 'price', 'quantity')
+REQUIRED_ON_CREATE = ('name', 'category', 'price', 'quantity')
+FORMATS = ('csv', 'jsonl')
+
+
+class BulkImportError(ValueError):
+    """The upload as a whole cannot be read"""
+
+
+def detect_format(upload, requested=None):
+    fmt = (requested or '').lower()
+    if not fmt:
+        name = (upload.name or '').lower()
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv'
+    if fmt not in FORMATS:
+        raise BulkImportError(f'format must be one of: {", ".join(FORMATS)}')
+    return fmt
+
+
+def read_rows(upload, fmt):
+    """Yield ``(row_number, dict_or_None, error)`` for every record in the upload"""
+    text = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            if not reader.fieldnames:
+                return
+            unknown = set(reader.fieldnames) - {'id', *COLUMNS}
+            if unknown:
+                raise BulkImportError(f'Unknown columns: {", ".join(sorted(unknown))}')
+            for number, row in enumerate(reader, start=1):
+                yield number, row, None
+        else:
+            number = 0
+            for line in text:
+                if not line.strip():
+                    continue
+                number += 1
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield number, None, {'row': 'Invalid JSON'}
+                    continue
+                if not isinstance(row, dict):
+                    yield number, None, {'row': 'Each line must be a JSON object'}
+                    continue
+                yield number, row, None
+    except UnicodeDecodeError:
+        raise BulkImportError('Upload must be UTF-8 encoded')
+    finally:
+        text.detach()
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _clean_text(value, max_length):
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise ValueError(f'Ensure this field has no more than {max_length} characters.')
+    return value
+
+
+def _clean_name(value):
+    return _clean_text(value, inventory._meta.get_field('name').max_length)
+
+
+def _clean_description(value):
+    return _clean_text(value, inventory._meta.get_field('description').max_length)
+
+
+def _clean_price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError('A valid number is required.')
+    if not price.is_finite():
+        raise ValueError('A valid number is required.')
+    if price <= 0:
+        raise ValueError('Price must be greater than 0')
+    if price.as_tuple().exponent < -2:
+        raise ValueError('Ensure that there are no more than 2 decimal places.')
+    if price >= Decimal('1e8'):
+        raise ValueError('Ensure that there are no more than 10 digits in total.')
+    return price
+
+
+def _clean_quantity(value):
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise ValueError('A valid integer is required.')
+    if quantity < 0:
+        raise ValueError('Quantity cannot be negative')
+    return quantity
+
+
+class CategoryLookup:
+    """Resolves the ``category`` column (id or case-insensitive name), one query per import"""
+
+    def __init__(self):
+        self.by_id = {}
+        self.by_name = {}
+        for category_id, name in Category.objects.values_list('id', 'name'):
+            self.by_id[category_id] = category_id
+            self.by_name[name.lower()] = category_id
+
+    def __call__(self, value):
+        value = str(value).strip()
+        category_id = self.by_id.get(int(value)) if value.isascii() and value.isdigit() else None
+        if category_id is None:
+            category_id = self.by_name.get(value.lower())
+        if category_id is None:
+            raise ValueError(f'Category "{value}" does not exist.')
+        return category_id
+
+
+def clean_row(row, categories):
+    """Return ``(product_id, values, errors)`` for one raw row"""
+    cleaners = {
+        'name': _clean_name,
+        'description': _clean_description,
+        'category': categories,
+        'price': _clean_price,
+        'quantity': _clean_quantity,
+    }
+    errors = {}
+    product_id = None
+    is_update = not _blank(row.get('id'))
+    if is_update:
+        try:
+            product_id = int(str(row['id']).strip())
+        except ValueError:
+            errors['id'] = 'A valid integer is required.'
+
+    values = {}
+    for column in COLUMNS:
+        value = row.get(column)
+        if _blank(value):
+            if not is_update and column in REQUIRED_ON_CREATE:
+                errors[column] = 'This field is required.'
+            continue
+        try:
+            values[column] = cleaners[column](value)
+        except ValueError as e:
+            errors[column] = str(e)
+    return product_id, values, errors
+
+
+class ImportReport:
+    """Counts of created / updated / failed rows and the first MAX_REPORTED_ERRORS errors"""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': number, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda error: error['row']),
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _bulk_update(products, fields):
+    if connection.features.supports_update_conflicts_with_target:
+        # INSERT ... ON CONFLICT (id) DO UPDATE, far cheaper than bulk_update's CASE per field
+        inventory.objects.bulk_create(
+            products, batch_size=BATCH_SIZE,
+            update_conflicts=True, unique_fields=['id'], update_fields=fields,
+        )
+    else:
+        inventory.objects.bulk_update(products, fields, batch_size=BATCH_SIZE)
+
+
+def _write_batch(batch, report, dry_run):
+    """Upsert one batch of cleaned ``(row_number, product_id, values)``"""
+    with transaction.atomic():
+        existing = inventory.objects.select_for_update().in_bulk(
+            [product_id for _, product_id, _ in batch if product_id is not None]
+        )
+        now = timezone.now()
+        # {updated columns: products}, each upsert writes only its rows' own columns
+        to_update, to_create = {}, []
+        for number, product_id, values in batch:
+            if product_id is None:
+                if 'description' not in values:
+                    values['description'] = ''
+                values['category_id'] = values.pop('category')
+                to_create.append(inventory(**values))
+                continue
+            product = existing.get(product_id)
+            if product is None:
+                report.error(number, {'id': f'Product {product_id} not found.'})
+                continue
+            for field, value in values.items():
+                setattr(product, 'category_id' if field == 'category' else field, value)
+            product.restocked_at = now
+            to_update.setdefault(tuple(sorted({'restocked_at', *values})), []).append(product)
+
+        if not dry_run:
+            for fields, products in to_update.items():
+                _bulk_update(products, list(fields))
+            if to_create:
+                inventory.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+            if to_update or to_create:
+                # bulk writes skip the post_save signal
+                created = [product.pk for product in to_create]
+                bump_catalog_version(None if None in created else [*existing, *created])
+    report.updated += sum(len(products) for products in to_update.values())
+    report.created += len(to_create)
+
+
+def import_inventory(upload, fmt=None, dry_run=False):
+    """Upsert every valid row of ``upload`` and return an ImportReport"""
+    fmt = detect_format(upload, fmt)
+    categories = CategoryLookup()
+    report = ImportReport()
+    seen_ids = set()
+
+    for chunk in chunked(read_rows(upload, fmt), BATCH_SIZE):
+        batch = []
+        for number, row, errors in chunk:
+            if errors is None:
+                product_id, values, errors = clean_row(row, categories)
+                if not errors and product_id is not None:
+                    if product_id in seen_ids:
+                        errors = {'id': f'Product {product_id} appears more than once.'}
+                    seen_ids.add(product_id)
+            if errors:
+                report.error(number, errors)
+            else:
+                batch.append((number, product_id, values))
+        if batch:
+            _write_batch(batch, report, dry_run)
+    return report
@@ -0,0 +1,100 @@
+"""
+Server-side shopping carts on ``CartItem``.
+
+A cart holds one row per product (``unique_together = user, item``), so every
+change is an upsert:
+
+- ``add`` increments the existing row's quantity, or inserts the row when
+  there is none,
+- ``set_quantities`` upserts many lines with one ``INSERT ... ON CONFLICT``
+  and deletes the lines set to 0,
+- ``remove`` deletes lines in bulk.
+
+``contents`` reads a cart with one indexed query joined to inventory, as
+``.values()`` rows with no model instances, so it can run on every page
+view. The cart is turned into an order by ``ecomm.checkout.checkout_cart``.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .fastpath import decimal_str
+from .models import CartItem, inventory
+
+CART_COLUMNS = ('item_id', 'quantity', 'item__name', 'item__price', 'item__quantity', 'item__reserved_quantity')
+
+
+class CartError(Exception):
+    """Raised for an invalid cart change, ``message`` is safe to return to clients"""
+
+    def __init__(self, message, item_id=None):
+        super().__init__(message)
+        self.message = message
+        self.item_id = item_id
+
+
+def _check_products(product_ids):
+    found = set(inventory.objects.filter(id__in=product_ids).values_list('id', flat=True))
+    for product_id in product_ids:
+        if product_id not in found:
+            raise CartError(f'Invalid item_id: {product_id}', product_id)
+
+
+def contents(user):
+    """The lines of ``user``'s cart and their total, prices as of now"""
+    items, total = [], Decimal('0')
+    rows = CartItem.objects.filter(user_id=user.pk).order_by('id').values_list(*CART_COLUMNS)
+    for item_id, quantity, name, price, stock, reserved in rows:
+        subtotal = price * quantity
+        total += subtotal
+        items.append({
+            'item_id': item_id,
+            'name': name,
+            'price': decimal_str(price),
+            'quantity': quantity,
+            'subtotal': decimal_str(subtotal),
+            'available': max(stock - reserved, 0),
+        })
+    return {'items': items, 'count': len(items), 'total': decimal_str(total)}
+
+
+def add(user, product_id, quantity):
+    """Add ``quantity`` units of a product to ``user``'s cart, return the line's new quantity"""
+    _check_products([product_id])
+    line = CartItem.objects.filter(user_id=user.pk, item_id=product_id)
+    with transaction.atomic():
+        if not line.update(quantity=F('quantity') + quantity):
+            try:
+                with transaction.atomic():
+                    CartItem.objects.create(user_id=user.pk, item_id=product_id, quantity=quantity)
+                return quantity
+            except IntegrityError:
+                # inserted by a concurrent request of the same user
+                line.update(quantity=F('quantity') + quantity)
+        return line.values_list('quantity', flat=True).get()
+
+
+def set_quantities(user, lines):
+    """Set ``{product_id: quantity}`` in ``user``'s cart, 0 removes the line"""
+    keep = {product_id: quantity for product_id, quantity in lines.items() if quantity > 0}
+    _check_products(list(keep))
+    with transaction.atomic():
+        rows = [CartItem(user_id=user.pk, item_id=product_id, quantity=quantity)
+                for product_id, quantity in keep.items()]
+        if connection.features.supports_update_conflicts_with_target:
+            CartItem.objects.bulk_create(rows, update_conflicts=True, unique_fields=['user', 'item'],
+                                         update_fields=['quantity'])
+        else:
+            for row in rows:
+                CartItem.objects.update_or_create(user_id=user.pk, item_id=row.item_id,
+                                                  defaults={'quantity': row.quantity})
+        dropped = [product_id for product_id in lines if product_id not in keep]
+        if dropped:
+            remove(user, dropped)
+
+
+def remove(user, product_ids):
+    """Remove products from ``user``'s cart, return the number of lines removed"""
+    deleted, _ = CartItem.objects.filter(user_id=user.pk, item_id__in=product_ids).delete()
+    return deleted
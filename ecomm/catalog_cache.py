@@ -0,0 +1,298 @@
+"""
+Response cache for the read-only shop catalog endpoints.
+
+Responses are cached under the normalized query parameters plus a catalog
+version. Any inventory or category write bumps the version (see
+ecomm.signals and the checkout engine), which invalidates every cached
+response at once. The ETag sent to clients is derived from the same key,
+so an ``If-None-Match`` revalidation is answered with 304 before the view
+(and the ORM) runs.
+
+The version lives in the primary database, so every worker process sees
+the same one. Each write inserts a ``CatalogChange`` row in its own
+transaction, holding the products it touched. Writers take no lock: ids
+are handed out at INSERT but may commit out of order, so the version is
+the count and the id range of the committed rows, and a write that commits
+behind a newer one still changes it. ecomm.snapshot reads the rows between
+two versions to patch the products they changed, and keeps the ids missing
+below the newest one to read again, as their writes may not have committed
+yet. An id that is still missing ``MAX_CHANGES`` writes later is taken as
+rolled back.
+
+Each thread remembers the version it read for ``POLL_SECONDS`` and then
+reads it again, one aggregate over the logged rows. A write makes its own
+thread read it again once it commits; other threads and processes follow
+within ``POLL_SECONDS``. The responses themselves go to the backend picked
+by ``settings.ECOMM_CATALOG_CACHE``:
+
+    ECOMM_CATALOG_CACHE = {'BACKEND': 'lru', 'MAX_ENTRIES': 1024, 'POLL_SECONDS': 1.0}
+    ECOMM_CATALOG_CACHE = {'BACKEND': 'django', 'ALIAS': 'default', 'TIMEOUT': 300}
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, Max, Min, Q
+from django.dispatch import receiver
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .fastpath import json_response
+
+# the most changes patched, an older snapshot is rebuilt in full; older log rows are deleted
+MAX_CHANGES = 1000
+
+
+class LRUCacheBackend:
+    """In-process cache holding at most ``max_entries`` responses"""
+
+    def __init__(self, max_entries=1024, **kwargs):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoCacheBackend:
+    """Stores responses in one of the CACHES aliases"""
+
+    def __init__(self, alias='default', timeout=300, **kwargs):
+        self.alias = alias
+        self.timeout = timeout
+
+    def get(self, key):
+        return caches[self.alias].get(key)
+
+    def set(self, key, value):
+        caches[self.alias].set(key, value, self.timeout)
+
+    def clear(self):
+        caches[self.alias].clear()
+
+
+BACKENDS = {'lru': LRUCacheBackend, 'django': DjangoCacheBackend}
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'ECOMM_CATALOG_CACHE', {})
+        backend_class = BACKENDS[config.get('BACKEND', 'lru')]
+        _backend = backend_class(
+            max_entries=config.get('MAX_ENTRIES', 1024),
+            alias=config.get('ALIAS', 'default'),
+            timeout=config.get('TIMEOUT', 300),
+        )
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting in ('ECOMM_CATALOG_CACHE', 'CACHES'):
+        _backend = None
+
+
+_seen = threading.local()
+
+
+def _read_state():
+    from .models import CatalogChange
+    state = CatalogChange.objects.using(DEFAULT_DB_ALIAS).aggregate(
+        first=Min('id'), last=Max('id'), count=Count('id'))
+    if not state['count']:
+        return 0, ''
+    return state['last'], f"{state['last']}.{state['count']}.{state['first']}"
+
+
+def catalog_state(refresh=False):
+    """``(sequence, version)`` of the committed catalog changes, as last read by this thread"""
+    poll_seconds = getattr(settings, 'ECOMM_CATALOG_CACHE', {}).get('POLL_SECONDS', 1.0)
+    state = getattr(_seen, 'state', None)
+    if refresh or state is None or time.monotonic() - _seen.checked_at >= poll_seconds:
+        state = _seen.state = _read_state()
+        _seen.checked_at = time.monotonic()
+    return state
+
+
+acatalog_state = sync_to_async(catalog_state)
+
+
+def catalog_version():
+    return catalog_state()[1]
+
+
+async def acatalog_version():
+    """Async version of catalog_version(), the lookup runs in the thread that owns the connection"""
+    return (await acatalog_state())[1]
+
+
+def forget_catalog_state():
+    """Make this thread read the version again on its next request"""
+    _seen.state = None
+
+
+def catalog_pending(sequence):
+    """
+    Ids up to change ``sequence`` that are not committed (yet), counted from
+    the oldest of the last MAX_CHANGES logged changes
+    """
+    from .models import CatalogChange
+    if not sequence:
+        return frozenset()
+    logged = set(CatalogChange.objects.using(DEFAULT_DB_ALIAS)
+                 .filter(id__gt=sequence - MAX_CHANGES, id__lte=sequence).values_list('id', flat=True))
+    return frozenset(number for number in range(min(logged, default=sequence), sequence)
+                     if number not in logged)
+
+
+def catalog_changes(since, pending, until):
+    """
+    Return ``(product ids, pending ids)`` for the changes committed after
+    change ``since`` up to change ``until``, counting the ``pending`` ids
+    that were not committed at ``since``. None when a change touched
+    unknown rows or is no longer logged.
+    """
+    from .models import CatalogChange
+    if not since or not 0 <= until - since <= MAX_CHANGES:
+        return None
+    rows = dict(CatalogChange.objects.using(DEFAULT_DB_ALIAS)
+                .filter(Q(id__range=(since, until)) | Q(id__in=pending))
+                .values_list('id', 'product_ids'))
+    if since not in rows:
+        # pruned, and every change before it
+        return None
+    changed = set()
+    for number, product_ids in rows.items():
+        if number != since:
+            if product_ids is None:
+                return None
+            changed.update(product_ids)
+    horizon = until - MAX_CHANGES
+    pending = frozenset(number for number in (*pending, *range(since + 1, until + 1))
+                        if number > horizon and number not in rows)
+    return changed, pending
+
+
+def bump_catalog_version(product_ids=None):
+    """
+    Invalidate every cached catalog response.
+
+    Logs a change in the current transaction without taking a lock: other
+    workers see the new version when it commits, this thread reads it again
+    then. ``product_ids`` are the products the write changed, None when
+    unknown (bulk writes, categories).
+    """
+    from .models import CatalogChange
+    changes = CatalogChange.objects.using(DEFAULT_DB_ALIAS)
+    change = changes.create(product_ids=None if product_ids is None else list(product_ids))
+    if change.id % MAX_CHANGES == 0:
+        # rows other writes have not committed yet are not deleted
+        changes.filter(id__lte=change.id - MAX_CHANGES).delete()
+    # nothing is remembered for a write that may still roll back
+    forget_catalog_state()
+    transaction.on_commit(forget_catalog_state, using=DEFAULT_DB_ALIAS)
+
+
+def normalize_params(query_params, names):
+    """Canonical form of the query parameters a cached view depends on"""
+    normalized = []
+    for name in names:
+        value = ' '.join(query_params.get(name, '').split())
+        if name in ('category', 'search'):
+            value = value.lower()
+        if value:
+            normalized.append((name, value))
+    return normalized
+
+
+def _cache_key(name, request, kwargs, params, version):
+    """Return ``(key, response headers)`` for a catalog request at catalog ``version``"""
+    key_parts = [name, version, sorted(kwargs.items()),
+                 normalize_params(request.GET, params)]
+    key = 'ecomm:catalog:' + hashlib.sha1(repr(key_parts).encode()).hexdigest()
+    etag = f'"{key[-24:]}"'
+    return key, {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+
+def _not_modified(request, headers):
+    return headers['ETag'] in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+
+def cached_catalog_view(name, params=()):
+    """
+    Cache a catalog view's successful GET responses per parameters and version.
+
+    Goes below ``@api_view`` so authentication and permissions still run.
+    Streamed responses are never cached. Async views (ecomm.async_views)
+    return their data on ``response.data`` too and share the same entries.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != 'GET' or request.GET.get('stream'):
+                    return await view(request, *args, **kwargs)
+
+                key, headers = _cache_key(name, request, kwargs, params, await acatalog_version())
+                if _not_modified(request, headers):
+                    return json_response(None, status.HTTP_304_NOT_MODIFIED, headers)
+
+                backend = get_backend()
+                data = backend.get(key)
+                if data is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK or not hasattr(response, 'data'):
+                        return response
+                    data = response.data
+                    backend.set(key, data)
+                return json_response(data, headers=headers)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.GET.get('stream'):
+                return view(request, *args, **kwargs)
+
+            key, headers = _cache_key(name, request, kwargs, params, catalog_version())
+            if _not_modified(request, headers):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            backend = get_backend()
+            data = backend.get(key)
+            if data is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK or not isinstance(response, Response):
+                    return response
+                data = response.data
+                backend.set(key, data)
+            return Response(data, headers=headers)
+        return wrapper
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Order placement engine.
+
+An order costs the same number of queries whatever its size:
+
+1. one SELECT for every requested product,
+2. one conditional UPDATE that decrements all of their stock at once,
+3. one INSERT for the order and one bulk INSERT for its lines,
+4. one INSERT queueing the order's follow-up work (ecomm.jobs),
+5. one INSERT logging the stock change for the catalog (ecomm.catalog_cache).
+
+The UPDATE only matches rows that still have enough stock that is not held
+by a reservation (``quantity - reserved_quantity >= requested``). If fewer
+rows are updated than requested, another buyer got there first and the
+whole transaction is rolled back. Overselling is impossible without holding
+row locks.
+
+An order can also confirm a reservation taken earlier (see
+ecomm.reservations). The held units are then sold instead of free stock.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+
+from .catalog_cache import bump_catalog_version
+from .jobs import enqueue
+from .models import CartItem, inventory, Order, OrderItem, User
+from .reservations import ReservationError, consume, sweep
+from .stock import per_product
+
+
+class CheckoutError(Exception):
+    """Raised when an order cannot be placed, ``message`` is safe to return to clients"""
+
+    def __init__(self, message, item_id=None):
+        super().__init__(message)
+        self.message = message
+        self.item_id = item_id
+
+
+def normalize_lines(items):
+    """Merge ``[{'item_id', 'quantity'}]`` into ``{product_id: quantity}``"""
+    lines = {}
+    for item_data in items:
+        product_id = int(item_data['item_id'])
+        lines[product_id] = lines.get(product_id, 0) + int(item_data['quantity'])
+    return lines
+
+
+def decrement_stock(lines, products=None):
+    """
+    Load and decrement stock for ``{product_id: quantity}``, return the products.
+
+    ``products`` (``{product_id: inventory}``) skips the load when the caller
+    already has them. Must run inside a transaction, raises CheckoutError
+    (rolling it back) when a product is missing or short on stock.
+    """
+    if products is None:
+        products = inventory.objects.in_bulk(list(lines))
+    for product_id, quantity in lines.items():
+        product = products.get(product_id)
+        if product is None:
+            raise CheckoutError(f'Invalid item_id: {product_id}', product_id)
+        if product.available_quantity < quantity and not sweep(product_ids=[product_id]):
+            raise CheckoutError(f'Insufficient stock for {product.name}', product_id)
+
+    requested = per_product(lines)
+    updated = inventory.objects.filter(
+        id__in=list(lines), quantity__gte=F('reserved_quantity') + requested
+    ).update(quantity=F('quantity') - requested)
+    if updated != len(lines):
+        # stock changed after the SELECT, report the first line that lost out
+        remaining = dict(
+            inventory.objects.filter(id__in=list(lines))
+            .values_list('id', F('quantity') - F('reserved_quantity'))
+        )
+        for product_id, quantity in lines.items():
+            if remaining.get(product_id, 0) < quantity:
+                raise CheckoutError(f'Insufficient stock for {products[product_id].name}', product_id)
+        raise CheckoutError('Stock changed during checkout, please retry')
+    # stock is part of the cached shop item detail
+    bump_catalog_version(lines)
+    return products
+
+
+def place_order(user, items, shipping_address, phone_number, reservation=None):
+    """
+    Create an order atomically and return it with its lines prefetched.
+
+    The order is for ``items``, or for the lines of the hold ``reservation``
+    of ``user`` when one is given.
+    """
+    lines = normalize_lines(items) if reservation is None else None
+    if lines is not None and not lines:
+        raise CheckoutError('At least one item is required')
+
+    with transaction.atomic():
+        if reservation is None:
+            products = decrement_stock(lines)
+        else:
+            try:
+                lines = consume(reservation, user)
+            except ReservationError as e:
+                raise CheckoutError(e.message, e.item_id) from e
+            products = inventory.objects.in_bulk(list(lines))
+        order = create_order(user, lines, products, shipping_address, phone_number)
+
+    prefetch_related_objects([order], 'items__product')
+    return order
+
+
+def checkout_cart(user, shipping_address, phone_number):
+    """
+    Turn ``user``'s whole cart into an order and empty the cart.
+
+    One SELECT reads the cart lines with their products' prices and stock,
+    then the order is placed like any other and the checked-out lines are
+    deleted with one DELETE. Lines added meanwhile stay in the cart.
+    """
+    with transaction.atomic():
+        cart = list(CartItem.objects.filter(user_id=user.pk).select_related('item'))
+        if not cart:
+            raise CheckoutError('Your cart is empty')
+        lines = {line.item_id: line.quantity for line in cart}
+        products = decrement_stock(lines, {line.item_id: line.item for line in cart})
+        order = create_order(user, lines, products, shipping_address, phone_number)
+        CartItem.objects.filter(id__in=[line.id for line in cart]).delete()
+
+    prefetch_related_objects([order], 'items__product')
+    return order
+
+
+def create_order(user, lines, products, shipping_address, phone_number):
+    """Insert the order and its lines for stock already taken, prices from ``products``"""
+    total_amount = sum(
+        (products[product_id].price * quantity for product_id, quantity in lines.items()),
+        Decimal('0'),
+    )
+    order = Order.objects.create(
+        user_id=user.pk,
+        total_amount=total_amount,
+        shipping_address=shipping_address,
+        phone_number=phone_number,
+    )
+    if isinstance(user, User):
+        # spares OrderSerializer a query, token users are not model instances
+        order.user = user
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            product=products[product_id],
+            quantity=quantity,
+            price=products[product_id].price,
+        )
+        for product_id, quantity in lines.items()
+    ])
+    # logged and checked for low stock by a worker, committed with the order
+    enqueue('order-placed', {'order_id': order.id})
+    return order
@@ -0,0 +1,142 @@
+"""
+Facet counts for the shop/list filter sidebar.
+
+``?facets=1`` adds the number of matching products per category, per price
+bucket and in stock versus out of stock to a shop/list response. The counts
+cover every product matching the active filters (category, search, price
+and stock), not only the page. They come from one grouped query:
+
+    SELECT category_id, category.name, <price bucket>, <in stock>, COUNT(id)
+    ... WHERE <filters> GROUP BY 1, 2, 3, 4
+
+When the catalog snapshot (ecomm.snapshot) answers the request, the counts
+come instead from the totals it keeps per category. Facets depend only on
+the filters, not on the ordering or the page. They are cached in the
+catalog response cache per filter combination and catalog version, so
+paging through a list computes them once.
+
+``settings.ECOMM_PRICE_BUCKETS`` holds the bucket bounds. A bucket includes
+its lower bound and excludes its upper bound.
+
+    ECOMM_PRICE_BUCKETS = [10, 25, 50, 100, 250]  # <10, 10-25, ..., 250+
+"""
+import hashlib
+from bisect import bisect_right
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import BooleanField, Case, Count, F, IntegerField, Value, When
+
+from .catalog_cache import acatalog_version, catalog_version, get_backend, normalize_params
+from .fastpath import decimal_str
+from .shop_filters import FILTERS as RANGE_FILTERS
+
+FILTERS = ('category', 'search', *RANGE_FILTERS)
+DEFAULT_PRICE_BUCKETS = (10, 25, 50, 100, 250)
+
+
+def wants_facets(params):
+    return params.get('facets') in ('1', 'true')
+
+
+def price_bounds():
+    return [Decimal(str(bound)) for bound in getattr(settings, 'ECOMM_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)]
+
+
+def price_bucket(price, bounds):
+    """Index of the bucket of ``price``, in the units of ``bounds``"""
+    return bisect_right(bounds, price)
+
+
+def _bucket_expression(bounds):
+    return Case(
+        *(When(price__lt=bound, then=Value(index)) for index, bound in enumerate(bounds)),
+        default=Value(len(bounds)), output_field=IntegerField(),
+    )
+
+
+IN_STOCK = Case(When(quantity__gt=F('reserved_quantity'), then=Value(True)),
+                default=Value(False), output_field=BooleanField())
+
+
+def _grouped(queryset, bounds):
+    return queryset.order_by().values(
+        'category_id', 'category__name', bucket=_bucket_expression(bounds), in_stock=IN_STOCK,
+    ).annotate(count=Count('id'))
+
+
+def _collect(rows):
+    counts, names = Counter(), {}
+    for row in rows:
+        counts[row['category_id'], row['bucket'], bool(row['in_stock'])] += row['count']
+        names[row['category_id']] = row['category__name']
+    return counts, names
+
+
+def count_facets(queryset, bounds=None):
+    """
+    ``(counts, names)`` of the products in ``queryset``: ``counts`` maps
+    ``(category_id, bucket, in_stock)`` to a product count, ``names`` the
+    category ids to their names. One query.
+    """
+    return _collect(_grouped(queryset, bounds or price_bounds()))
+
+
+async def acount_facets(queryset, bounds=None):
+    """Async version of count_facets()"""
+    return _collect([row async for row in _grouped(queryset, bounds or price_bounds())])
+
+
+def facets(counts, names, bounds=None):
+    """The ``facets`` of a shop/list response from count_facets() counts"""
+    bounds = bounds or price_bounds()
+    categories, buckets, stock = Counter(), [0] * (len(bounds) + 1), Counter()
+    for (category_id, bucket, in_stock), count in counts.items():
+        categories[category_id] += count
+        buckets[bucket] += count
+        stock[in_stock] += count
+    edges = [None, *bounds, None]
+    return {
+        'categories': [
+            {'id': category_id, 'name': names[category_id], 'count': count}
+            for category_id, count in sorted(categories.items(), key=lambda item: names[item[0]])
+            if count
+        ],
+        'price': [
+            {'min': edges[index] and decimal_str(edges[index]),
+             'max': edges[index + 1] and decimal_str(edges[index + 1]), 'count': count}
+            for index, count in enumerate(buckets)
+        ],
+        'stock': {'in_stock': stock[True], 'out_of_stock': stock[False]},
+    }
+
+
+def _key(params, version):
+    key_parts = ['shop-facets', version, normalize_params(params, FILTERS), price_bounds()]
+    return 'ecomm:catalog:' + hashlib.sha1(repr(key_parts).encode()).hexdigest()
+
+
+def shop_facets(params, queryset, snapshot=None):
+    """
+    Facets of the shop/list filter ``params``: counted in the ``snapshot``
+    when there is one, else over the filtered ``queryset``
+    """
+    backend, key = get_backend(), _key(params, catalog_version())
+    data = backend.get(key)
+    if data is None:
+        counts, names = snapshot.facet_counts(params) if snapshot is not None else count_facets(queryset)
+        data = facets(counts, names)
+        backend.set(key, data)
+    return data
+
+
+async def ashop_facets(params, queryset, snapshot=None):
+    """Async version of shop_facets()"""
+    backend, key = get_backend(), _key(params, await acatalog_version())
+    data = backend.get(key)
+    if data is None:
+        counts, names = snapshot.facet_counts(params) if snapshot is not None else await acount_facets(queryset)
+        data = facets(counts, names)
+        backend.set(key, data)
+    return data
@@ -0,0 +1,269 @@
+"""
+Serializer-free fast path for the list endpoints.
+
+The row builders here turn ``.values()`` dicts straight into the exact JSON
+shape produced by ``ItemListSerializer``, ``ProductListSerializer`` and
+``OrderSerializer``, skipping DRF field objects entirely. ``FastJSONRenderer``
+renders with orjson when it is installed and produces the same bytes as
+DRF's ``JSONRenderer`` (ecomm.tests checks both against the serializers).
+
+A view opts in by using ``@renderer_classes(FAST_RENDERERS)`` and the row
+builders; ``settings.ECOMM_FAST_PATH_VIEWS`` switches individual views back to
+the regular serializers.
+
+The ``*_FIELDS`` fieldsets build the same rows field by field, for requests
+that ask for a subset of the fields (ecomm.fieldsets). The full rows keep
+their own builders; they are the hot path.
+"""
+from decimal import Decimal
+from operator import itemgetter
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .fieldsets import Fieldset
+from .metrics import serializing
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+CENTS = Decimal('0.01')
+
+
+def fast_path_enabled(view_name):
+    return view_name in getattr(settings, 'ECOMM_FAST_PATH_VIEWS', ())
+
+
+def decimal_str(value, exp=CENTS):
+    """Same output as a DRF DecimalField(decimal_places=2)"""
+    if value is None:
+        return ''
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return f'{value.quantize(exp):f}'
+
+
+def datetime_str(value):
+    """Same output as a DRF DateTimeField with the default ISO 8601 format"""
+    if not value:
+        return None
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """DRF's JSONRenderer, rendering counted as serializer time in ecomm.metrics"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serializing():
+            return self.encode(data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    """JSONRenderer backed by orjson, byte-for-byte compatible with the default one"""
+
+    _default = JSONEncoder().default
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().encode(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        try:
+            ret = orjson.dumps(
+                data, default=self._default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        except TypeError:
+            # big ints, float edge cases, ... take the slow but exact route
+            return super().encode(data, accepted_media_type, renderer_context)
+        if self.ensure_ascii or b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            return super().encode(data, accepted_media_type, renderer_context)
+        return ret
+
+
+FAST_RENDERERS = [FastJSONRenderer, BrowsableAPIRenderer]
+
+
+def json_response(data, status=200, headers=None):
+    """Rendered JSON HttpResponse for views outside DRF, ``data`` stays on ``response.data``"""
+    content = FastJSONRenderer().render(data)
+    response = HttpResponse(
+        content, status=status, headers=headers,
+        content_type=None if data is None else 'application/json',
+    )
+    response.data = data
+    return response
+
+
+# ItemListSerializer
+ITEM_LIST_COLUMNS = ('id', 'name', 'category_id', 'price')
+
+
+def item_list_row(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'category': row['category_id'],
+        'price': decimal_str(row['price']),
+    }
+
+
+ITEM_LIST_FIELDS = Fieldset({
+    'id': (('id',), itemgetter('id')),
+    'name': (('name',), itemgetter('name')),
+    'category': (('category_id',), itemgetter('category_id')),
+    'price': (('price',), lambda row: decimal_str(row['price'])),
+})
+
+
+# ItemSerializer, served by the serializer only
+ITEM_FIELDS = Fieldset({
+    'id': (('id',), itemgetter('id')),
+    'name': (('name',), itemgetter('name')),
+    'description': (('description',), itemgetter('description')),
+    'category': (('category_id',), itemgetter('category_id')),
+    'price': (('price',), lambda row: decimal_str(row['price'])),
+    'quantity': (('quantity', 'reserved_quantity'), lambda row: max(row['quantity'] - row['reserved_quantity'], 0)),
+    'in_stock': (('quantity', 'reserved_quantity'), lambda row: row['quantity'] > row['reserved_quantity']),
+    'created_at': (('created_at',), lambda row: datetime_str(row['created_at'])),
+})
+
+
+# ProductListSerializer
+PRODUCT_LIST_COLUMNS = ('id', 'name', 'category__name', 'quantity', 'price', 'created_at')
+
+
+def product_list_row(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'category_name': row['category__name'],
+        'quantity': row['quantity'],
+        'price': decimal_str(row['price']),
+        'created_at': datetime_str(row['created_at']),
+    }
+
+
+PRODUCT_LIST_FIELDS = Fieldset({
+    'id': (('id',), itemgetter('id')),
+    'name': (('name',), itemgetter('name')),
+    'category_name': (('category__name',), itemgetter('category__name')),
+    'quantity': (('quantity',), itemgetter('quantity')),
+    'price': (('price',), lambda row: decimal_str(row['price'])),
+    'created_at': (('created_at',), lambda row: datetime_str(row['created_at'])),
+})
+
+
+# OrderSerializer
+ORDER_COLUMNS = (
+    'id', 'user_id', 'user__username', 'user__email', 'user__first_name', 'user__last_name',
+    'total_amount', 'status', 'shipping_address', 'phone_number', 'created_at', 'updated_at',
+)
+ORDER_ITEM_COLUMNS = ('id', 'order_id', 'product__name', 'quantity', 'price')
+
+
+def order_item_row(row):
+    return {
+        'id': row['id'],
+        'product_name': row['product__name'],
+        'quantity': row['quantity'],
+        'price': decimal_str(row['price']),
+        'subtotal': decimal_str(row['quantity'] * row['price']),
+    }
+
+
+def user_info(row):
+    return {
+        'id': row['user_id'],
+        'username': row['user__username'],
+        'email': row['user__email'],
+        'first_name': row['user__first_name'],
+        'last_name': row['user__last_name'],
+    }
+
+
+def order_row(row, items):
+    return {
+        'id': row['id'],
+        'user_info': user_info(row),
+        'total_amount': float(row['total_amount']),
+        'status': row['status'],
+        'shipping_address': row['shipping_address'],
+        'phone_number': row['phone_number'],
+        'created_at': datetime_str(row['created_at']),
+        'updated_at': datetime_str(row['updated_at']),
+        'items': items,
+    }
+
+
+ORDER_FIELDS = Fieldset({
+    'id': (('id',), itemgetter('id')),
+    'user_info': (('user_id', 'user__username', 'user__email', 'user__first_name', 'user__last_name'), user_info),
+    'total_amount': (('total_amount',), lambda row: float(row['total_amount'])),
+    'status': (('status',), itemgetter('status')),
+    'shipping_address': (('shipping_address',), itemgetter('shipping_address')),
+    'phone_number': (('phone_number',), itemgetter('phone_number')),
+    'created_at': (('created_at',), lambda row: datetime_str(row['created_at'])),
+    'updated_at': (('updated_at',), lambda row: datetime_str(row['updated_at'])),
+    # the order lines, one more query (order_rows puts them on the row)
+    'items': ((), itemgetter('items')),
+})
+
+
+def order_summary_row(row):
+    """GET /orders/past?summary=1 row of an ``ecomm.views.order_summaries`` dict"""
+    return {
+        'id': row['id'],
+        'status': row['status'],
+        'total_amount': float(row['total_amount']),
+        'item_count': row['item_count'],
+    }
+
+
+def _order_items(order_ids):
+    from .models import OrderItem
+    return OrderItem.objects.filter(order_id__in=order_ids).order_by('id').values(*ORDER_ITEM_COLUMNS)
+
+
+def _build_orders(orders, items, fields):
+    if fields is None:
+        return [order_row(order, items[order['id']]) for order in orders]
+    if 'items' in fields:
+        for order in orders:
+            order['items'] = items[order['id']]
+    build = ORDER_FIELDS.builder(fields, None)
+    return [build(order) for order in orders]
+
+
+def order_rows(orders, fields=None):
+    """
+    Build OrderSerializer rows, or their ``fields``, for an iterable of
+    ``ORDER_FIELDS.columns(fields)`` dicts, two queries in total
+    """
+    orders = list(orders)
+    items = {order['id']: [] for order in orders}
+    if items and (fields is None or 'items' in fields):
+        for row in _order_items(list(items)):
+            items[row['order_id']].append(order_item_row(row))
+    return _build_orders(orders, items, fields)
+
+
+async def aorder_rows(orders, fields=None):
+    """Async version of order_rows(), ``orders`` is a list or a ``.values()`` queryset"""
+    orders = [order async for order in orders] if hasattr(orders, '__aiter__') else list(orders)
+    items = {order['id']: [] for order in orders}
+    if items and (fields is None or 'items' in fields):
+        async for row in _order_items(list(items)):
+            items[row['order_id']].append(order_item_row(row))
+    return _build_orders(orders, items, fields)
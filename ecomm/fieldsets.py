@@ -0,0 +1,81 @@
+"""
+Sparse fieldsets: the ``fields`` and ``exclude`` query parameters.
+
+``?fields=id,name,price`` returns only those fields of every row and
+``?exclude=description`` all but those. Both trim the SQL as well as the JSON.
+The serializer path loads the objects with ``.only()`` and joins only the
+relations the chosen fields read. The fast path asks ``.values()`` for just
+the needed columns. A field backed by another query, such as an order's
+``items``, costs that query only when it is returned.
+
+A ``Fieldset`` describes the fields of one serializer. For each field it
+lists the ``.values()`` columns the field is built from, and a function that
+builds the field from such a row. The specs live next to the fast path row
+builders in ecomm.fastpath. The serializers drop the unwanted fields through
+``ecomm.serializers.SparseFieldsMixin``.
+"""
+
+
+class FieldsetError(ValueError):
+    """Raised for an unknown or empty ``fields``/``exclude`` selection"""
+
+
+class Fieldset:
+    """The fields of one response row, see the module docstring"""
+
+    def __init__(self, fields):
+        # {name: (columns, build)}, in the serializer's field order
+        self.fields = fields
+
+    def _names(self, value, param):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise FieldsetError(f'Unknown {param}: {", ".join(unknown)}. '
+                                f'Available: {", ".join(self.fields)}')
+        return names
+
+    def select(self, params):
+        """
+        The field names picked by the ``fields`` and ``exclude`` query
+        ``params``, in serializer order, or None for every field
+        """
+        fields, exclude = params.get('fields'), params.get('exclude')
+        if not fields and not exclude:
+            return None
+        picked = set(self._names(fields, 'fields') if fields else self.fields)
+        if exclude:
+            picked -= set(self._names(exclude, 'exclude'))
+        if not picked:
+            raise FieldsetError('At least one field must be returned')
+        return tuple(name for name in self.fields if name in picked)
+
+    def columns(self, fields=None, *extra):
+        """
+        The columns ``fields`` (all by default) and ``extra`` are built from.
+        The id always comes first, rows are keyed and paged by it.
+        """
+        names = self.fields if fields is None else fields
+        columns = ['id', *(column for name in names for column in self.fields[name][0]), *extra]
+        return tuple(dict.fromkeys(columns))
+
+    def only(self, queryset, fields, *extra):
+        """
+        ``queryset`` loading only the columns of ``fields`` and ``extra``,
+        joined to the relations those read. Unchanged for every field.
+        """
+        if fields is None:
+            return queryset
+        columns = self.columns(fields, *extra)
+        related = dict.fromkeys(column.split('__', 1)[0] for column in columns if '__' in column)
+        queryset = queryset.select_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset.only(*columns)
+
+    def builder(self, fields, full):
+        """``full`` for every field, else a function building ``fields`` from a ``.values()`` row"""
+        if fields is None:
+            return full
+        builds = [(name, self.fields[name][1]) for name in fields]
+        return lambda row: {name: build(row) for name, build in builds}
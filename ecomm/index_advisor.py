@@ -0,0 +1,282 @@
+"""
+Index recommendations from SQLite query plans.
+
+``explain`` runs ``EXPLAIN QUERY PLAN`` on a captured statement and
+``plan_issues`` picks out the steps an index could remove: full table scans
+and temporary B-trees built for ORDER BY, GROUP BY or DISTINCT.
+
+For each problem ``advise`` builds candidate indexes from the statement.
+The equality columns of its WHERE clause come first, followed by either its
+ORDER BY columns or one range column. Each candidate is created for real,
+the statement is explained again, and the candidate is dropped. The
+smallest candidate that removes the most issues is recommended, if it
+removes any. That way only indexes the planner actually uses are suggested.
+
+The SQL is parsed with regular expressions that understand the SQL Django
+generates for SQLite (quoted identifiers, ``U0``/``T3`` aliases). Anything
+they do not recognise gets no candidates; nothing wrong is suggested.
+"""
+import itertools
+import re
+from dataclasses import dataclass, field
+
+from django.apps import apps
+from django.db import models
+
+SCAN = re.compile(r'^SCAN (\w+)(?: USING (COVERING )?INDEX (\w+))?$')
+SEARCH = re.compile(r'^SEARCH (\w+)')
+TEMP_BTREE = re.compile(r'^USE TEMP B-TREE FOR (.+)$')
+TABLE_REF = re.compile(r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?([A-Z]\d+)\b)?')
+COLUMN_REF = r'(?:"(?P<table>\w+)"|(?P<alias>\b[A-Z]\d+))\."(?P<column>\w+)"'
+CONDITION = re.compile(COLUMN_REF + r'\s*(?P<op>=|IN\b|IS\b|>=|<=|>|<|BETWEEN\b)', re.IGNORECASE)
+COLUMN_REF_AT_START = re.compile(COLUMN_REF)
+CLAUSE_END = re.compile(r'\s(?:GROUP BY|ORDER BY|LIMIT|HAVING)\s')
+
+
+@dataclass(frozen=True)
+class PlanIssue:
+    kind: str  # 'full scan' or 'temp b-tree'
+    table: str
+    detail: str
+
+
+@dataclass
+class Recommendation:
+    table: str
+    columns: tuple
+    sql: str
+    fixed: list = field(default_factory=list)
+
+    @property
+    def model(self):
+        return model_for_table(self.table)
+
+    def as_index(self):
+        """The recommendation as a named ``models.Index`` of its model"""
+        model = self.model
+        by_column = {f.column: f.name for f in model._meta.concrete_fields}
+        index = models.Index(fields=[by_column[column] for column in self.columns])
+        index.set_name_with_model(model)
+        return index
+
+
+def model_for_table(table):
+    for model in apps.get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+_statement_number = itertools.count()
+
+
+def explain(connection, sql, params=()):
+    with connection.cursor() as cursor:
+        # a new statement text every time, the sqlite3 statement cache can
+        # keep a plan from before an index was created or dropped
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql} /* {next(_statement_number)} */', params)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def table_aliases(sql):
+    """``{name or alias: table}`` of the tables in the FROM and JOIN clauses"""
+    aliases = {}
+    for table, alias in TABLE_REF.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def plan_issues(plan, sql):
+    """The full scans and temp B-trees of the ``explain`` result of ``sql``"""
+    aliases = table_aliases(sql)
+    order_tables = {table for table, _ in order_columns(sql, aliases)}
+    issues = []
+    first_table = None
+    for detail in plan:
+        step = SCAN.match(detail) or SEARCH.match(detail)
+        table = aliases.get(step.group(1)) if step else None
+        if table and first_table is None:
+            first_table = table
+        if step and table and step.re is SCAN and not step.group(3):
+            issues.append(PlanIssue('full scan', table, detail))
+        elif TEMP_BTREE.match(detail) and first_table:
+            # the sort is of the result, an index on the table the order
+            # comes from can supply it
+            table = order_tables.pop() if len(order_tables) == 1 else first_table
+            issues.append(PlanIssue('temp b-tree', table, detail))
+    return issues
+
+
+def _split_top_level(text):
+    """Split on the commas outside parentheses"""
+    parts, depth, start = [], 0, 0
+    for position, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:position])
+            start = position + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts]
+
+
+def _select_list(sql):
+    _, _, rest = sql.partition('SELECT ')
+    depth = 0
+    for position in range(len(rest)):
+        depth += {'(': 1, ')': -1}.get(rest[position], 0)
+        if depth == 0 and rest.startswith(' FROM ', position):
+            return _split_top_level(rest[:position])
+    return []
+
+
+def _where_clause(sql):
+    _, found, rest = sql.partition(' WHERE ')
+    if not found:
+        return ''
+    end = CLAUSE_END.search(rest)
+    return rest[:end.start()] if end else rest
+
+
+def _order_clause(sql):
+    _, found, rest = sql.rpartition(' ORDER BY ')
+    if not found:
+        return ''
+    return re.split(r'\sLIMIT\s', rest)[0]
+
+
+def _column(ref, aliases):
+    match = COLUMN_REF_AT_START.match(ref)
+    if not match:
+        return None
+    table = aliases.get(match.group('table') or match.group('alias'))
+    return (table, match.group('column')) if table else None
+
+
+def order_columns(sql, aliases):
+    """
+    ``[(table, column)]`` of the ORDER BY clause, positional terms (``ORDER
+    BY 5 DESC``) resolved through the select list. Empty when a term is not
+    a plain column.
+    """
+    columns = []
+    select = None
+    for term in _split_top_level(_order_clause(sql)):
+        if not term:
+            return []
+        ref = re.sub(r'\s+(?:ASC|DESC)$', '', term, flags=re.IGNORECASE)
+        if ref.isdigit():
+            select = select if select is not None else _select_list(sql)
+            if int(ref) > len(select):
+                return []
+            ref = select[int(ref) - 1]
+        column = _column(ref, aliases)
+        if column is None:
+            return []
+        columns.append(column)
+    return columns
+
+
+def candidates(sql, table):
+    """Candidate column tuples for an index on ``table`` serving ``sql``"""
+    aliases = table_aliases(sql)
+    equality, ranges = [], []
+    for match in CONDITION.finditer(_where_clause(sql)):
+        if aliases.get(match.group('table') or match.group('alias')) != table:
+            continue
+        target = equality if match.group('op').upper() in ('=', 'IN', 'IS') else ranges
+        if match.group('column') not in target:
+            target.append(match.group('column'))
+    ranges = [column for column in ranges if column not in equality]
+
+    ordering = order_columns(sql, aliases)
+    order = []
+    if ordering and all(order_table == table for order_table, _ in ordering):
+        order = [column for _, column in ordering]
+        # the index carries the rowid, a trailing id tie-breaker comes for free
+        while order and order[-1] == 'id':
+            order.pop()
+        order = [column for column in order if column not in equality]
+
+    options = [equality + order, equality + ranges[:1], equality, order, ranges[:1]]
+    seen = []
+    for columns in options:
+        if columns and tuple(columns) not in seen:
+            seen.append(tuple(columns))
+    return seen
+
+
+def _evaluate(connection, sql, table):
+    """``(issues, constrained columns)`` of the plan of ``sql`` for ``table``"""
+    plan = explain(connection, sql)
+    aliases = table_aliases(sql)
+    issues = sum(1 for issue in plan_issues(plan, sql) if issue.table == table)
+    constrained = 0
+    for detail in plan:
+        step = SEARCH.match(detail)
+        if step and aliases.get(step.group(1)) == table:
+            # "SEARCH t USING INDEX i (status=? AND created_at>?)"
+            constrained += detail.count('?')
+    return issues, constrained
+
+
+def advise(connection, sql, issue):
+    """
+    The best candidate index fixing ``issue`` of ``sql`` as a Recommendation,
+    or None. Fewer remaining issues win, then the plan that constrains more
+    index columns (fewer rows read), then the shorter index.
+    """
+    before, _ = _evaluate(connection, sql, issue.table)
+    best = None
+    for number, columns in enumerate(candidates(sql, issue.table)):
+        name = f'index_advisor_candidate_{number}'
+        quoted = ', '.join(connection.ops.quote_name(column) for column in columns)
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE INDEX {name} ON {connection.ops.quote_name(issue.table)} ({quoted})')
+            try:
+                after, constrained = _evaluate(connection, sql, issue.table)
+            finally:
+                cursor.execute(f'DROP INDEX {name}')
+        score = (after, -constrained, len(columns))
+        if after < before and (best is None or score < best[0]):
+            best = (score, columns)
+    if best is None:
+        return None
+    return Recommendation(issue.table, best[1], sql)
+
+
+def existing_indexes(connection, table):
+    """Column tuples of the indexes ``table`` already has"""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return {tuple(c['columns']) for c in constraints.values() if c['index'] or c['unique']}
+
+
+def merge(recommendations, connection):
+    """
+    Drop duplicates, recommendations that are a prefix of another one on the
+    same table and those an existing index already covers.
+    """
+    merged = {}
+    for rec in recommendations:
+        key = (rec.table, rec.columns)
+        if key in merged:
+            merged[key].fixed.extend(rec.fixed)
+        else:
+            merged[key] = rec
+    result = []
+    for (table, columns), rec in merged.items():
+        longer = [
+            other for (other_table, other_columns), other in merged.items()
+            if other_table == table and len(other_columns) > len(columns)
+            and other_columns[:len(columns)] == columns
+        ]
+        if longer:
+            longer[0].fixed.extend(rec.fixed)
+        elif not any(index[:len(columns)] == columns for index in existing_indexes(connection, table)):
+            result.append(rec)
+    return sorted(result, key=lambda rec: (rec.table, rec.columns))
@@ -0,0 +1,224 @@
+"""
+Background job queue stored in the project's own database.
+
+Requests queue side effects that need not delay the response (order logs,
+stock alerts) as ``Job`` rows with ``enqueue``. Inside a transaction the job
+commits or rolls back with the order that caused it. ``manage.py
+run_workers`` runs them:
+
+- a worker claims a batch of due jobs in one short transaction. Backends
+  with ``SELECT ... FOR UPDATE SKIP LOCKED`` (PostgreSQL, MySQL 8) skip rows
+  other workers are claiming. On SQLite the claim is a conditional UPDATE
+  of jobs that are still claimable; with the production profile's
+  ``BEGIN IMMEDIATE`` (ecomm.sqlite) claims are serialized by the write lock.
+- a claimed job is leased to its worker for ``LEASE_SECONDS``. A finished
+  job is deleted; a job whose worker died is claimed again once its lease
+  has run out. Delivery is at least once, so handlers must be idempotent.
+- a failed job is retried after an exponential backoff with jitter, until
+  it has run ``max_attempts`` times. It then stays as ``failed`` with its
+  last error.
+- ``CONCURRENCY`` caps the jobs of a kind running at once across every
+  worker. Workers read the running count and claim in one transaction, so
+  the cap is exact on SQLite; elsewhere two concurrent claims can overshoot
+  it by a batch.
+
+Handlers are registered per kind with ``@handler`` (see ecomm.tasks) and
+called with the job's payload as keyword arguments.
+
+``/metrics/`` reports the queue depth per kind and status and the lag of
+the oldest due job, read from the table on every scrape. Job runs and
+durations are counted per worker process.
+
+    ECOMM_JOBS = {'BATCH_SIZE': 10, 'LEASE_SECONDS': 300, 'MAX_ATTEMPTS': 5,
+                  'RETRY_DELAY': 2.0, 'MAX_RETRY_DELAY': 600,
+                  'CONCURRENCY': {'order-placed': 4}}
+"""
+import logging
+import random
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the handler of ``kind`` jobs"""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def _config():
+    return getattr(settings, 'ECOMM_JOBS', {})
+
+
+def enqueue(kind, payload=None, delay=0, max_attempts=None):
+    """
+    Queue a ``kind`` job to run with ``payload`` in ``delay`` seconds and
+    return it. Raises ValueError for a kind without a handler.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or _config().get('MAX_ATTEMPTS', 5),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds before retrying a job that failed its ``attempts``-th run"""
+    config = _config()
+    delay = min(config.get('RETRY_DELAY', 2.0) * 2 ** (attempts - 1), config.get('MAX_RETRY_DELAY', 600))
+    # spread the retries of jobs that failed together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _claimable(now):
+    # due, or leased to a worker that did not finish in time
+    return (Q(status=Job.QUEUED, run_at__lte=now)
+            | Q(status=Job.RUNNING, locked_until__lt=now, attempts__lt=F('max_attempts')))
+
+
+def _free_slots(now):
+    """``{kind: jobs that may still start}`` of the kinds with a CONCURRENCY limit"""
+    limits = _config().get('CONCURRENCY', {})
+    if not limits:
+        return {}
+    running = dict(
+        Job.objects.filter(kind__in=list(limits), status=Job.RUNNING, locked_until__gte=now)
+        .values_list('kind').annotate(count=Count('id')).order_by()
+    )
+    return {kind: max(limit - running.get(kind, 0), 0) for kind, limit in limits.items()}
+
+
+def claim(batch_size=None, kinds=None):
+    """Lease up to ``batch_size`` due jobs (of ``kinds``, default all) and return them"""
+    batch_size = batch_size or _config().get('BATCH_SIZE', 10)
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        # jobs whose workers died on every attempt
+        Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, locked_until=None, last_error='Lease expired on the last attempt',
+        )
+        slots = _free_slots(now)
+        candidates = Job.objects.filter(_claimable(now)).order_by('run_at', 'id')
+        if kinds:
+            candidates = candidates.filter(kind__in=kinds)
+        full = [kind for kind, free in slots.items() if not free]
+        if full:
+            candidates = candidates.exclude(kind__in=full)
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        chosen = []
+        for job_id, kind in candidates.values_list('id', 'kind')[:batch_size]:
+            if kind in slots:
+                if not slots[kind]:
+                    continue
+                slots[kind] -= 1
+            chosen.append(job_id)
+        if not chosen:
+            return []
+        # still claimable: without SKIP LOCKED another worker may have taken some
+        Job.objects.filter(_claimable(now), id__in=chosen).update(
+            status=Job.RUNNING,
+            locked_by=token,
+            locked_until=now + timedelta(seconds=_config().get('LEASE_SECONDS', 300)),
+            attempts=F('attempts') + 1,
+        )
+    return list(Job.objects.filter(locked_by=token, status=Job.RUNNING).order_by('run_at', 'id'))
+
+
+def _finish(job, **changes):
+    # a job whose lease ran out may belong to another worker by now
+    return Job.objects.filter(id=job.id, locked_by=job.locked_by, status=Job.RUNNING).update(**changes)
+
+
+def run_job(job):
+    """Run a claimed job, then delete it or schedule its retry. Returns whether it succeeded."""
+    began = time.perf_counter()
+    try:
+        function = HANDLERS.get(job.kind)
+        if function is None:
+            raise LookupError(f'No handler for job kind {job.kind}')
+        function(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            outcome = 'failed'
+            _finish(job, status=Job.FAILED, locked_until=None, last_error=error)
+            logger.error('Job %s #%s failed for good after %s attempts', job.kind, job.id, job.attempts)
+        else:
+            outcome = 'retried'
+            _finish(job, status=Job.QUEUED, locked_by='', locked_until=None, last_error=error,
+                    run_at=timezone.now() + timedelta(seconds=retry_delay(job.attempts)))
+            logger.warning('Job %s #%s failed (attempt %s of %s), retrying', job.kind, job.id,
+                           job.attempts, job.max_attempts)
+    else:
+        outcome = 'done'
+        Job.objects.filter(id=job.id, locked_by=job.locked_by).delete()
+    metrics.JOBS_RUN.inc((job.kind, outcome))
+    metrics.JOB_DURATION.observe((job.kind,), time.perf_counter() - began)
+    return outcome == 'done'
+
+
+def run_batch(batch_size=None, kinds=None):
+    """Claim and run one batch, return the number of jobs run"""
+    jobs = claim(batch_size, kinds)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
+
+
+def work(stop, batch_size=None, kinds=None, poll_interval=1.0):
+    """Run batches until the ``stop`` event is set, waiting ``poll_interval`` when the queue is empty"""
+    try:
+        while not stop.is_set():
+            try:
+                ran = run_batch(batch_size, kinds)
+            except Exception:
+                # e.g. the database is locked, the jobs are claimed again later
+                logger.exception('Claiming jobs failed')
+                ran = 0
+            if not ran:
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def queue_stats(now=None):
+    """``{kind: {'queued', 'running', 'failed', 'lag'}}``, ``lag`` is how long the oldest due job has waited"""
+    now = now or timezone.now()
+    stats = {}
+    rows = Job.objects.values_list('kind', 'status').annotate(count=Count('id'), oldest=Min('run_at')).order_by()
+    for kind, status, count, oldest in rows:
+        entry = stats.setdefault(kind, {Job.QUEUED: 0, Job.RUNNING: 0, Job.FAILED: 0, 'lag': 0.0})
+        entry[status] = count
+        if status == Job.QUEUED:
+            entry['lag'] = max((now - oldest).total_seconds(), 0.0)
+    return stats
+
+
+def observe_queue():
+    """Set the queue depth and lag gauges from the table"""
+    metrics.JOB_QUEUE_DEPTH.reset()
+    metrics.JOB_QUEUE_LAG.reset()
+    for kind, entry in queue_stats().items():
+        for status in (Job.QUEUED, Job.RUNNING, Job.FAILED):
+            metrics.JOB_QUEUE_DEPTH.set((kind, status), entry[status])
+        metrics.JOB_QUEUE_LAG.set((kind,), entry['lag'])
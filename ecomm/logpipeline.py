@@ -0,0 +1,186 @@
+"""
+Non-blocking logging for the request path.
+
+``pipeline_handler`` returns a ``BoundedQueueHandler``. The handler only puts
+records on a bounded in-memory queue. A ``QueueListener`` thread then writes
+them as JSON lines to a ``RotatingJSONFileHandler``, and to the console when
+asked. The file rotates when it reaches ``max_bytes`` or every
+``rotate_interval`` seconds, whichever comes first, and keeps
+``backup_count`` old files (``auth.log.1`` ...).
+
+When the writer falls behind and the queue is full, new records are dropped
+instead of blocking the request. Every drop is counted in
+``ecomm_log_records_dropped_total``. ``SamplingFilter`` keeps only a fraction
+of the INFO and DEBUG records of chosen loggers and counts the rest in
+``ecomm_log_records_sampled_out_total``. Both counters are served by
+``/metrics/``.
+
+    LOGGING['handlers']['pipeline'] = {
+        '()': 'ecomm.logpipeline.pipeline_handler',
+        'filename': 'auth.log', 'max_bytes': 10 * 1024 * 1024, 'backup_count': 5,
+        'rotate_interval': 86400, 'queue_size': 10000, 'console': True,
+        'filters': ['sampling'],
+    }
+    LOGGING['filters']['sampling'] = {
+        '()': 'ecomm.logpipeline.SamplingFilter', 'rates': {'ecomm.views': 0.1},
+    }
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from . import metrics
+
+# attributes every LogRecord has, anything else came in through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, location and ``extra`` fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RotatingJSONFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that also rolls over every ``rotate_interval`` seconds"""
+
+    def __init__(self, filename, max_bytes=0, backup_count=0, rotate_interval=None,
+                 encoding='utf-8', delay=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding=encoding, delay=delay)
+        self.rotate_interval = rotate_interval
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self):
+        return time.time() + self.rotate_interval if self.rotate_interval else None
+
+    def shouldRollover(self, record):
+        if (self.rollover_at is not None and time.time() >= self.rollover_at
+                and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename)):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in ``1 / rate`` INFO and DEBUG records of each logger in
+    ``rates`` (a logger name also covers its children). Warnings and errors
+    always pass.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._every = {}
+        self._counters = {}
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return name
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        name = self._rate(record.name)
+        if name is None or self.rates[name] >= 1:
+            return True
+        counter = self._counters.get(name)
+        if counter is None:
+            self._every[name] = max(round(1 / self.rates[name]), 1) if self.rates[name] > 0 else 0
+            counter = self._counters.setdefault(name, itertools.count())
+        every = self._every[name]
+        # next() on itertools.count is atomic, no lock needed on the hot path
+        if every and next(counter) % every == 0:
+            return True
+        metrics.LOG_RECORDS_SAMPLED_OUT.inc((record.name,))
+        return False
+
+
+_traceback_formatter = logging.Formatter()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops (and counts) records once ``queue_size`` are
+    waiting. The queue is a lock-free ``SimpleQueue``; the size check is not
+    atomic, so concurrent threads can overshoot the bound by a few records.
+    """
+
+    def __init__(self, queue_size=10000):
+        super().__init__(queue.SimpleQueue())
+        self.queue_size = queue_size
+        self.listener = None
+
+    def prepare(self, record):
+        # format the message and traceback here, the listener only gets plain
+        # data; the record is not copied, the changes keep what other handlers
+        # would render the same
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.queue_size:
+            metrics.LOG_RECORDS_DROPPED.inc((record.name, record.levelname))
+            return
+        self.queue.put_nowait(record)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+def pipeline_handler(filename, max_bytes=10 * 1024 * 1024, backup_count=5, rotate_interval=None,
+                     queue_size=10000, console=False):
+    """A started BoundedQueueHandler writing JSON lines to ``filename`` and optionally the console"""
+    file_handler = RotatingJSONFileHandler(filename, max_bytes, backup_count, rotate_interval)
+    file_handler.setFormatter(JSONFormatter())
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(logging.Formatter('%(levelname)s %(name)s %(message)s'))
+        handlers.append(console_handler)
+
+    handler = BoundedQueueHandler(queue_size)
+    handler.listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    # logging.shutdown() closes the handler at exit, which drains the queue
+    handler.listener.start()
+    return handler
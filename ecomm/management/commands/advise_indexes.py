@@ -0,0 +1,112 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations import Migration
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.operations import AddIndex
+from django.db.migrations.writer import MigrationWriter
+from django.test.utils import CaptureQueriesContext
+
+from ecomm.bench import SCALES, scratch_database, seed_dataset
+from ecomm.index_advisor import advise, explain, merge, plan_issues
+
+from .benchmark import ENDPOINTS, Clients, Context, send
+
+STATEMENTS = re.compile(r'^\s*(SELECT|UPDATE|DELETE)\b', re.IGNORECASE)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class Command(BaseCommand):
+    help = ('Capture the SQL of every endpoint on a seeded scratch database, report full scans '
+            'and temp B-tree sorts from EXPLAIN QUERY PLAN and recommend composite indexes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='10k',
+                            help=f'Rows of the seeded dataset: {", ".join(SCALES)} or a number')
+        parser.add_argument('--only', nargs='+', default=[], help='Endpoint names containing any of these')
+        parser.add_argument('--write-migration', action='store_true',
+                            help='Write an ecomm migration adding the recommended indexes')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The index advisor reads SQLite query plans, the default database is '
+                               f'{connection.vendor}')
+        rows = SCALES.get(options['scale'].lower()) or int(options['scale'])
+        with scratch_database():
+            seed_dataset(rows)
+            statements = self.capture(options['only'])
+            recommendations = self.analyse(statements)
+        if not recommendations:
+            self.stdout.write(self.style.SUCCESS('No index recommendations'))
+            return
+
+        self.stdout.write('\nRecommended indexes:')
+        by_model = {}
+        for rec in recommendations:
+            index = rec.as_index()
+            by_model.setdefault(rec.model, []).append(index)
+            endpoints = ', '.join(sorted({endpoint for endpoint, _ in rec.fixed}))
+            self.stdout.write(f'  {rec.model.__name__}({", ".join(index.fields)})  fixes: {endpoints}')
+        self.stdout.write('\nAdd to the Meta of each model:')
+        for model, indexes in by_model.items():
+            self.stdout.write(f'  {model.__name__}.Meta.indexes = [')
+            for index in indexes:
+                self.stdout.write(f'      models.Index(fields={index.fields!r}, name={index.name!r}),')
+            self.stdout.write('  ]')
+        if options['write_migration']:
+            self.write_migration(by_model)
+
+    def capture(self, only):
+        """``{normalized sql: (sql, endpoint)}`` of the statements every endpoint runs"""
+        from ecomm.catalog_cache import get_backend
+
+        ctx = Context()
+        clients = Clients()
+        statements = {}
+        for number, endpoint in enumerate(ENDPOINTS):
+            if only and not any(part in endpoint.name for part in only):
+                continue
+            url, data = endpoint.prepare(ctx, number)
+            get_backend().clear()
+            with CaptureQueriesContext(connection) as queries:
+                send(clients.get(endpoint), ctx, endpoint, url, data)
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if STATEMENTS.match(sql):
+                    statements.setdefault(LITERALS.sub('?', sql), (sql, endpoint.name))
+        return statements
+
+    def analyse(self, statements):
+        recommendations = []
+        for sql, endpoint in statements.values():
+            issues = plan_issues(explain(connection, sql), sql)
+            if not issues:
+                continue
+            self.stdout.write(f'\n{endpoint}: {sql[:200]}{"..." if len(sql) > 200 else ""}')
+            for issue in issues:
+                rec = advise(connection, sql, issue)
+                suggestion = f'-> index on {issue.table}({", ".join(rec.columns)})' if rec else '(no index helps)'
+                self.stdout.write(f'    {issue.kind:<12} {issue.detail}  {suggestion}')
+                if rec:
+                    rec.fixed.append((endpoint, issue))
+                    recommendations.append(rec)
+        return merge(recommendations, connection)
+
+    def write_migration(self, by_model):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        leaf = loader.graph.leaf_nodes('ecomm')[0]
+        number = int(leaf[1].split('_')[0]) + 1
+        migration = Migration(f'{number:04d}_advised_indexes', 'ecomm')
+        migration.dependencies = [leaf]
+        migration.operations = [
+            AddIndex(model_name=model._meta.model_name, index=index)
+            for model, indexes in by_model.items() for index in indexes
+        ]
+        writer = MigrationWriter(migration)
+        with open(writer.path, 'w') as f:
+            f.write(writer.as_string())
+        self.stdout.write(self.style.SUCCESS(
+            f'\nWrote {writer.path}; add the indexes to the models\' Meta as above as well, '
+            'otherwise makemigrations will want to remove them again'
+        ))
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+from django.urls import reverse
+
+from ecomm.bench import scratch_database
+
+
+class Command(BaseCommand):
+    help = ('Compare concurrent-request throughput of the sync views through the WSGI handler '
+            '(one thread per client) and of ecomm.async_views through the ASGI handler')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, nargs='+', default=[100, 1000],
+                            help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=5, help='Requests per client')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['clients'], options['requests'])
+
+    def run(self, client_counts, requests):
+        from ecomm.checkout import place_order
+        from ecomm.models import User, Category, inventory
+        from ecomm.views import get_tokens_for_user
+
+        user = User.objects.create_user(username='bench-buyer', password='bench-pass')
+        category = Category.objects.create(name='bench')
+        inventory.objects.bulk_create([
+            inventory(name=f'bench {i}', category=category, price=Decimal('9.99'),
+                      quantity=1000, description='bench')
+            for i in range(50)
+        ])
+        product_ids = list(inventory.objects.values_list('id', flat=True))
+        for i in range(10):
+            place_order(user, [{'item_id': pid, 'quantity': 1} for pid in product_ids[i:i + 3]],
+                        shipping_address='bench', phone_number='5550000000')
+        headers = {'Authorization': f"Bearer {get_tokens_for_user(user)['access']}"}
+
+        endpoints = [
+            ('shop/item (cached)', 'shop-item-detail', [product_ids[0]]),
+            ('shop/list', 'shop-item-list', []),
+            ('orders/past', 'order-list', []),
+        ]
+        self.stdout.write(f'{"endpoint":<20} {"clients":>8} {"WSGI req/s":>11} {"ASGI req/s":>11}')
+        for label, name, args in endpoints:
+            for clients in client_counts:
+                params = {'limit': 20} if name == 'shop-item-list' else {}
+                wsgi = self.wsgi_rate(reverse(name, args=args), params, headers, clients, requests)
+                asgi = self.asgi_rate(reverse(f'async-{name}', args=args), params, headers, clients, requests)
+                self.stdout.write(f'{label:<20} {clients:>8} {wsgi:>11.1f} {asgi:>11.1f}')
+
+    def wsgi_rate(self, url, params, headers, clients, requests):
+        def client_session(_):
+            client = Client()
+            try:
+                for _ in range(requests):
+                    response = client.get(url, params, headers=headers)
+                    assert response.status_code == 200, response.content
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            list(pool.map(client_session, range(clients)))
+        return clients * requests / (time.perf_counter() - start)
+
+    def asgi_rate(self, url, params, headers, clients, requests):
+        async def client_session():
+            client = AsyncClient()
+            for _ in range(requests):
+                response = await client.get(url, params, headers=headers)
+                assert response.status_code == 200, response.content
+
+        async def main():
+            await asyncio.gather(*(client_session() for _ in range(clients)))
+
+        start = time.perf_counter()
+        asyncio.run(main())
+        return clients * requests / (time.perf_counter() - start)
@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from ecomm.bench import QueryCounter, scratch_database, throughput
+
+
+class Command(BaseCommand):
+    help = 'Compare queries and throughput per JWT request with JWTAuthentication and ClaimsJWTAuthentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and class')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['requests'])
+
+    def run(self, requests):
+        from ecomm import views
+        from ecomm.authentication import ClaimsJWTAuthentication
+        from ecomm.models import User, Category, inventory
+
+        user = User.objects.create_user(username='bench-buyer', password='bench-pass')
+        category = Category.objects.create(name='bench')
+        inventory.objects.bulk_create([
+            inventory(name=f'bench {i}', category=category, price=Decimal('9.99'),
+                      quantity=10, description='bench')
+            for i in range(50)
+        ])
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {views.get_tokens_for_user(user)['access']}")
+
+        endpoints = [
+            ('shop/list (cached)', views.shop_item_list, reverse('shop-item-list')),
+            ('shop/item (cached)', views.shop_item_detail,
+             reverse('shop-item-detail', args=[inventory.objects.first().id])),
+            ('orders/past', views.order_list, reverse('order-list')),
+        ]
+        self.stdout.write(f'{"endpoint":<20} {"authentication":<24} {"req/s":>8} {"queries/req":>12}')
+        for label, view, url in endpoints:
+            original = view.cls.authentication_classes
+            try:
+                for auth_class in (JWTAuthentication, ClaimsJWTAuthentication):
+                    view.cls.authentication_classes = [auth_class, SessionAuthentication]
+
+                    def get(_):
+                        response = client.get(url)
+                        assert response.status_code == 200, response.content
+
+                    get(0)  # warm the catalog and user caches
+                    with QueryCounter() as queries:
+                        get(0)
+                    rate = throughput(get, requests)
+                    self.stdout.write(
+                        f'{label:<20} {auth_class.__name__:<24} {rate:>8.1f} {queries.count:>12}'
+                    )
+            finally:
+                view.cls.authentication_classes = original
@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecomm.bench import QueryCounter, scratch_database, throughput
+
+
+class Command(BaseCommand):
+    help = 'Benchmark orders/new/ throughput for orders of 1, 10 and 100 lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200, help='Orders placed per order size')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100])
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            self.run(options['orders'], options['sizes'])
+
+    def run(self, orders, sizes):
+        from ecomm.models import User, Category, inventory
+
+        user = User.objects.create_user(username='bench-buyer', password='bench-pass')
+        category = Category.objects.create(name='bench')
+        inventory.objects.bulk_create([
+            inventory(name=f'bench {i}', category=category, price=Decimal('9.99'),
+                      quantity=10 ** 9, description='bench')
+            for i in range(max(sizes))
+        ])
+        product_ids = list(inventory.objects.values_list('id', flat=True))
+
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse('create-order')
+
+        self.stdout.write(f'{"lines":>6} {"orders/s":>10} {"queries/order":>14}')
+        for size in sizes:
+            payload = {
+                'items': [{'item_id': str(pid), 'quantity': '1'} for pid in product_ids[:size]],
+                'shipping_address': 'bench',
+                'phone_number': '5550000000',
+            }
+
+            def place(_):
+                response = client.post(url, payload, format='json')
+                assert response.status_code == 201, response.content
+
+            with QueryCounter() as queries:
+                place(0)
+            rate = throughput(place, orders)
+            self.stdout.write(f'{size:>6} {rate:>10.1f} {queries.count:>14}')
@@ -0,0 +1,135 @@
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from ecomm.bench import explicit_timestamps, latency_summary, scratch_database
+
+# no response caching, every request is answered by the snapshot or the database
+NO_RESPONSE_CACHE = {'BACKEND': 'lru', 'MAX_ENTRIES': 0}
+
+
+class Command(BaseCommand):
+    help = ('Build the in-memory catalog snapshot over a seeded catalog and report its memory, build time '
+            'and lookup latency, then shop/list and shop/item latency with and without it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--lookups', type=int, default=20_000, help='Timed snapshot lookups of each kind')
+        parser.add_argument('--requests', type=int, default=500, help='Timed requests of each kind and mode')
+        parser.add_argument('--db-file', help='SQLite file for the scratch database instead of memory')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with scratch_database(name=options['db_file']):
+            self.seed(options)
+            self.run(options)
+
+    def seed(self, options):
+        from ecomm.models import User, Category, inventory
+
+        rng = random.Random(options['seed'])
+        now = time.time()
+        categories = Category.objects.bulk_create(
+            [Category(name=f'category {i}') for i in range(options['categories'])]
+        )
+        with explicit_timestamps(inventory._meta.get_field('created_at')):
+            for start in range(0, options['products'], 5000):
+                inventory.objects.bulk_create([
+                    inventory(
+                        name=f'item {i}', description=f'bench item {i % 997}',
+                        category=rng.choice(categories), price=Decimal(rng.randrange(100, 100000)) / 100,
+                        quantity=rng.randrange(0, 100),
+                        created_at=datetime.fromtimestamp(now - rng.uniform(0, 365 * 86400), tz=timezone.utc),
+                    )
+                    for i in range(start, min(start + 5000, options['products']))
+                ])
+        User.objects.create_user(username='bench-buyer', password='bench-pass')
+
+    def run(self, options):
+        from ecomm.models import User, Category, inventory
+        from ecomm.shop_filters import RangeFilters
+        from ecomm.snapshot import CatalogSnapshot
+
+        began = time.perf_counter()
+        CatalogSnapshot.build('bench')
+        build_seconds = time.perf_counter() - began
+        # built again for its size, tracing slows the build down
+        tracemalloc.start()
+        snapshot = CatalogSnapshot.build('bench')
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_100k = size / len(snapshot) * 100_000
+        self.stdout.write(f'snapshot of {len(snapshot)} products: {size / 2 ** 20:.1f} MiB '
+                          f'({per_100k / 2 ** 20:.1f} MiB per 100k products), built in {build_seconds:.2f}s')
+
+        rng = random.Random(options['seed'])
+        product_ids = list(inventory.objects.values_list('id', flat=True))
+        category_ids = [str(pk) for pk in Category.objects.values_list('id', flat=True)]
+        deep_cursor = snapshot.page('price', None, None, len(snapshot) // 2)[1]
+
+        def price_range():
+            low = rng.randrange(100, 90000)
+            return RangeFilters(Decimal(low) / 100, Decimal(low + rng.randrange(100, 10000)) / 100)
+
+        lookups = {
+            'item': lambda: snapshot.item(rng.choice(product_ids)),
+            'list newest': lambda: snapshot.shop_list({}, '-created_at'),
+            'list category/price': lambda: snapshot.shop_list({'category': rng.choice(category_ids)}, 'price'),
+            'list deep cursor': lambda: snapshot.shop_list({'cursor': deep_cursor}, 'price'),
+            'facets category': lambda: snapshot.facet_counts({'category': rng.choice(category_ids)}),
+            'range price': lambda: snapshot.page('price', None, None, 50, price_range()),
+            'range category/price': lambda: snapshot.page('-price', int(rng.choice(category_ids)), None, 50,
+                                                          price_range()),
+            'range newest in stock': lambda: snapshot.page('-created_at', None, None, 50,
+                                                           price_range()._replace(min_quantity=1)),
+            'patch 10 products': lambda: snapshot.patched('bench', snapshot.sequence, rng.sample(product_ids, 10)),
+        }
+        self.stdout.write(f'{"lookup":<22} {"p50 us":>9} {"p99 us":>9}')
+        for name, lookup in lookups.items():
+            timings = []
+            for _ in range(options['lookups']):
+                began = time.perf_counter()
+                lookup()
+                timings.append(time.perf_counter() - began)
+            result = latency_summary(timings, 1)
+            self.stdout.write(f'{name:<22} {result["p50_ms"] * 1000:>9.1f} {result["p99_ms"] * 1000:>9.1f}')
+
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='bench-buyer'))
+        requests = {
+            'shop/item': lambda: (reverse('shop-item-detail', args=[rng.choice(product_ids)]), {}),
+            'shop/list': lambda: (reverse('shop-item-list'), {'limit': 50}),
+            'shop/list?category': lambda: (reverse('shop-item-list'),
+                                           {'category': rng.choice(category_ids), 'ordering': 'price'}),
+            'shop/list?facets': lambda: (reverse('shop-item-list'),
+                                         {'category': rng.choice(category_ids), 'facets': 1}),
+            'shop/list?min_price': lambda: (reverse('shop-item-list'),
+                                            {'category': rng.choice(category_ids), 'ordering': 'price',
+                                             'min_price': rng.randrange(1, 900), 'in_stock': 1}),
+        }
+        self.stdout.write(f'{"request":<22} {"mode":<9} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8}')
+        for name, request in requests.items():
+            for mode, enabled in (('database', False), ('snapshot', True)):
+                config = {'ENABLED': enabled, 'MIN_REBUILD_SECONDS': 0}
+                with override_settings(ECOMM_CATALOG_SNAPSHOT=config, ECOMM_CATALOG_CACHE=NO_RESPONSE_CACHE):
+                    # the first snapshot read builds it
+                    client.get(*request())
+                    timings = []
+                    began = time.perf_counter()
+                    for _ in range(options['requests']):
+                        url, params = request()
+                        started = time.perf_counter()
+                        response = client.get(url, params)
+                        timings.append(time.perf_counter() - started)
+                        assert response.status_code == 200, response.content
+                    result = latency_summary(timings, time.perf_counter() - began)
+                self.stdout.write(f'{name:<22} {mode:<9} {result["p50_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+                                  f'{result["throughput_rps"]:>8.1f}')
@@ -0,0 +1,118 @@
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connections
+
+from ecomm.bench import SCALES, latency_summary, scratch_database, seed_dataset
+from ecomm.sqlite import PROFILES, database_settings
+
+from .benchmark import ENDPOINTS, Clients, Context, send
+
+READS = ['shop/item', 'shop/list', 'shop/list?category']
+WRITE = 'orders/new'
+
+
+class Command(BaseCommand):
+    help = ('Run concurrent catalog reads and orders/new/ writes against a file database once per '
+            'SQLite profile and report throughput and "database is locked" errors')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['django', 'production'], choices=list(PROFILES))
+        parser.add_argument('--scale', default='10k',
+                            help=f'Rows of the seeded dataset: {", ".join(SCALES)} or a number')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per profile')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of requests that place an order')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        db = connections.settings['default']
+        if db['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError(f'The default database is {db["ENGINE"]}, not SQLite')
+        rows = SCALES.get(options['scale'].lower()) or int(options['scale'])
+
+        self.stdout.write(f'{"profile":<12} {"req/s":>8} {"reads/s":>8} {"writes/s":>9} {"locked":>7} '
+                          f'{"errors":>7} {"write p50":>10} {"write p99":>10}')
+        original = dict(db)
+        for profile in options['profiles']:
+            path = os.path.join(tempfile.gettempdir(), f'ecomm-bench-sqlite-{profile}.sqlite3')
+            connections.close_all()
+            # every thread builds its connection from this dict; the
+            # environment is ignored so the profiles are compared as defined
+            db.update({key: value for key, value in database_settings(path, profile, environ={}).items()
+                       if key != 'NAME'})
+            try:
+                with scratch_database(name=path):
+                    seed_dataset(rows, seed=options['seed'])
+                    result = self.run(options)
+            finally:
+                connections.close_all()
+                db.clear()
+                db.update(original)
+            self.stdout.write(
+                f'{profile:<12} {result["throughput_rps"]:>8.1f} {result["reads_rps"]:>8.1f} '
+                f'{result["writes_rps"]:>9.1f} {result["locked"]:>7} {result["errors"]:>7} '
+                f'{result["write_p50_ms"]:>10.2f} {result["write_p99_ms"]:>10.2f}'
+            )
+
+    def run(self, options):
+        from ecomm.models import inventory
+
+        # enough stock that no order fails for lack of it
+        inventory.objects.update(quantity=10 ** 9)
+        ctx = Context()
+        endpoints = {endpoint.name: endpoint for endpoint in ENDPOINTS}
+        reads = [endpoints[name] for name in READS]
+        clients = Clients()
+        threads = options['threads']
+
+        def worker(thread):
+            rng = random.Random(options['seed'] * 1000 + thread)
+            done = {'read': [], 'write': []}
+            locked = errors = 0
+            try:
+                for i in range(thread, options['requests'], threads):
+                    kind = 'write' if rng.random() < options['write_ratio'] else 'read'
+                    endpoint = endpoints[WRITE] if kind == 'write' else rng.choice(reads)
+                    url, data = endpoint.prepare(ctx, i)
+                    began = time.perf_counter()
+                    try:
+                        response = send(clients.get(endpoint), ctx, endpoint, url, data)
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        locked += 1
+                        continue
+                    finally:
+                        # the test client skips the request_finished handler
+                        # that closes or keeps the connection
+                        close_old_connections()
+                    if response.status_code == endpoint.expect:
+                        done[kind].append(time.perf_counter() - began)
+                    else:
+                        errors += 1
+                return done, locked, errors
+            finally:
+                connections.close_all()
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            outcomes = list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - began
+
+        read_times = [t for done, _, _ in outcomes for t in done['read']]
+        write_times = [t for done, _, _ in outcomes for t in done['write']]
+        writes = latency_summary(write_times, elapsed)
+        return {
+            'throughput_rps': (len(read_times) + len(write_times)) / elapsed,
+            'reads_rps': len(read_times) / elapsed,
+            'writes_rps': writes['throughput_rps'],
+            'locked': sum(locked for _, locked, _ in outcomes),
+            'errors': sum(errors for _, _, errors in outcomes),
+            'write_p50_ms': writes['p50_ms'],
+            'write_p99_ms': writes['p99_ms'],
+        }
@@ -0,0 +1,301 @@
+import json
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import django
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ecomm.bench import (
+    SCALES, SEED_PASSWORD, QueryCounter, compare_results, latency_summary, load_results,
+    scratch_database, seed_dataset,
+)
+
+
+class Endpoint:
+    """
+    One benchmarked request.
+
+    ``path`` and ``data`` may be callables taking ``(ctx, i)`` so every
+    iteration can target different rows; they run outside the timed part.
+    """
+
+    def __init__(self, name, url_name, method='get', role='buyer', path=None, data=None,
+                 expect=200, writes=False, asgi=False, multipart=False):
+        self.name = name
+        self.url_name = url_name
+        self.method = method
+        self.role = role
+        self.path = path
+        self.data = data
+        self.expect = expect
+        self.writes = writes
+        self.asgi = asgi
+        self.multipart = multipart
+
+    def prepare(self, ctx, i):
+        args = self.path(ctx, i) if self.path else []
+        data = self.data(ctx, i) if callable(self.data) else (self.data or {})
+        return reverse(self.url_name, args=args), data
+
+
+def product(ctx, i):
+    return [ctx.product_ids[i % len(ctx.product_ids)]]
+
+
+def order(ctx, i):
+    return [ctx.order_ids[i % len(ctx.order_ids)]]
+
+
+def order_payload(ctx, i):
+    pids = [ctx.product_ids[(i * 7 + k) % len(ctx.product_ids)] for k in range(3)]
+    return {'items': [{'item_id': pid, 'quantity': 1} for pid in pids],
+            'shipping_address': 'bench', 'phone_number': '5550000000'}
+
+
+def bulk_file(ctx, i):
+    rows = ''.join(f'{ctx.product_ids[(i * 100 + k) % len(ctx.product_ids)]},,{k + 1}\n' for k in range(100))
+    return {'file': SimpleUploadedFile('bench.csv', f'id,name,quantity\n{rows}'.encode())}
+
+
+ENDPOINTS = [
+    Endpoint('auth/user/signup', 'user_signup', 'post', role=None, expect=201, writes=True,
+             data=lambda ctx, i: {'username': f'bench-signup-{ctx.run}-{i}', 'email': 'b@example.com',
+                                  'password': 'Bench-pass-2024!', 'password_confirm': 'Bench-pass-2024!'}),
+    Endpoint('auth/user/login', 'user_login', 'post', role=None,
+             data={'username': 'bench-user-0', 'password': SEED_PASSWORD}),
+    Endpoint('auth/admin/login', 'admin_login', 'post', role=None,
+             data={'username': 'bench-keeper', 'password': SEED_PASSWORD}),
+    Endpoint('auth/logout', 'logout', 'post', writes=True,
+             data=lambda ctx, i: {'refresh': ctx.refresh_token()}),
+    Endpoint('auth/profile', 'user_profile'),
+    Endpoint('shop/list', 'shop-item-list', data={'limit': 50}),
+    Endpoint('shop/list?search', 'shop-item-list',
+             data=lambda ctx, i: {'search': f'item {i % 100}', 'limit': 50}),
+    Endpoint('shop/list?category', 'shop-item-list',
+             data=lambda ctx, i: {'category': ctx.category_ids[i % len(ctx.category_ids)],
+                                  'ordering': 'price', 'limit': 50}),
+    Endpoint('shop/list?fields', 'shop-item-list', data={'limit': 50, 'fields': 'id,name,price'}),
+    Endpoint('shop/item', 'shop-item-detail', path=product),
+    Endpoint('shop/categories', 'shop-categories'),
+    Endpoint('categories', 'list_categories', role='keeper'),
+    Endpoint('orders/past', 'order-list'),
+    Endpoint('orders/past?fields', 'order-list', data={'fields': 'id,status,total_amount,created_at'}),
+    Endpoint('orders/new', 'create-order', 'post', expect=201, writes=True, data=order_payload),
+    Endpoint('orders/<id>', 'order-detail', path=order),
+    Endpoint('cart', 'cart'),
+    Endpoint('cart/add', 'cart-add', 'post', writes=True,
+             data=lambda ctx, i: {'item_id': product(ctx, i % 20)[0], 'quantity': 1}),
+    Endpoint('inventory/list', 'inventory_list', role='keeper'),
+    Endpoint('inventory/list?fields', 'inventory_list', role='keeper', data={'fields': 'id,name,quantity'}),
+    Endpoint('inventory/new', 'create_item', 'post', role='keeper', expect=201, writes=True,
+             data=lambda ctx, i: {'name': f'new {i}', 'description': 'bench', 'price': '9.99',
+                                  'quantity': 5, 'category': ctx.category_ids[0]}),
+    Endpoint('inventory/update', 'update_item', 'post', role='keeper', writes=True,
+             data=lambda ctx, i: {'product_id': product(ctx, i)[0], 'price': f'{1 + i % 50}.99'}),
+    Endpoint('inventory/bulk', 'bulk_upsert_items', 'post', role='keeper', writes=True,
+             multipart=True, data=bulk_file),
+    Endpoint('inventory/restock', 'restock_item', 'post', role='keeper', writes=True,
+             data=lambda ctx, i: {'product_id': product(ctx, i)[0], 'quantity': 1}),
+    Endpoint('inventory/restock/batch', 'restock_batch', 'post', role='keeper', writes=True,
+             data=lambda ctx, i: {'items': [{'product_id': product(ctx, i * 10 + k)[0], 'quantity': 1}
+                                            for k in range(10)]}),
+    Endpoint('inventory/orders', 'view_orders', role='keeper',
+             data=lambda ctx, i: {'created_after': ctx.week_ago}),
+    Endpoint('inventory/orders?status', 'view_orders', role='keeper',
+             data=lambda ctx, i: {'status': 'shipped', 'created_after': ctx.month_ago}),
+    Endpoint('inventory/revenue', 'revenue_stats', role='keeper'),
+    Endpoint('async/shop/list', 'async-shop-item-list', data={'limit': 50}, asgi=True),
+    Endpoint('async/shop/item', 'async-shop-item-detail', path=product, asgi=True),
+    Endpoint('async/shop/categories', 'async-shop-categories', asgi=True),
+    Endpoint('async/orders/past', 'async-order-list', asgi=True),
+    Endpoint('async/orders/<id>', 'async-order-detail', path=order, asgi=True),
+]
+
+
+class Context:
+    """Ids and credentials the endpoints draw their requests from"""
+
+    def __init__(self):
+        from ecomm.models import User, Category, inventory, Order
+        from ecomm.views import get_tokens_for_user
+
+        self.run = int(time.time())
+        self.buyer = User.objects.get(username='bench-user-0')
+        self.keeper = User.objects.get(username='bench-keeper')
+        self.tokens = {
+            'buyer': get_tokens_for_user(self.buyer)['access'],
+            'keeper': get_tokens_for_user(self.keeper)['access'],
+        }
+        self.product_ids = list(inventory.objects.order_by('id').values_list('id', flat=True)[:1000])
+        self.order_ids = list(Order.objects.filter(user=self.buyer).order_by('id').values_list('id', flat=True))
+        self.category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+        self.week_ago = (timezone.now() - timedelta(days=7)).isoformat()
+        self.month_ago = (timezone.now() - timedelta(days=30)).isoformat()
+
+    def refresh_token(self):
+        from ecomm.views import get_tokens_for_user
+        return get_tokens_for_user(self.buyer)['refresh']
+
+
+class Clients(threading.local):
+    """One WSGI and one ASGI client per thread"""
+
+    def get(self, endpoint):
+        clients = self.__dict__.setdefault('clients', {})
+        if endpoint.asgi not in clients:
+            clients[endpoint.asgi] = AsyncClient() if endpoint.asgi else APIClient()
+        return clients[endpoint.asgi]
+
+
+def send(client, ctx, endpoint, url, data):
+    """Send one request and read its body, the body's length in bytes is on ``response.size``"""
+    headers = {'Authorization': f'Bearer {ctx.tokens[endpoint.role]}'} if endpoint.role else {}
+    if endpoint.asgi:
+        async def request():
+            response = await getattr(client, endpoint.method)(url, data, headers=headers)
+            if response.streaming:
+                response.size = len(b''.join([chunk async for chunk in response.streaming_content]))
+            else:
+                response.size = len(response.content)
+            return response
+        return async_to_sync(request)()
+    if endpoint.method == 'get':
+        response = client.get(url, data, headers=headers)
+    else:
+        response = client.post(url, data, headers=headers,
+                               format='multipart' if endpoint.multipart else 'json')
+    if response.streaming:
+        response.size = len(b''.join(response.streaming_content))
+    else:
+        response.size = len(response.content)
+    return response
+
+
+class Command(BaseCommand):
+    help = ('Seed a deterministic dataset and record p50/p95/p99 latency, throughput and query '
+            'count for every endpoint; --compare flags regressions against a saved baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='10k',
+                            help=f'Rows across inventory, orders and order items: {", ".join(SCALES)} or a number')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+        parser.add_argument('--only', nargs='+', default=[], help='Endpoint names containing any of these')
+        parser.add_argument('--db-file', help='SQLite file for the scratch database instead of memory')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Baseline JSON to compare against')
+        parser.add_argument('--current', help='Compare this results file instead of running')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Percent change that counts as a regression')
+
+    def handle(self, *args, **options):
+        if options['current']:
+            results = load_results(options['current'])
+        else:
+            rows = SCALES.get(options['scale'].lower()) or int(options['scale'])
+            with scratch_database(name=options['db_file']):
+                results = self.run(rows, options)
+            if options['output']:
+                with open(options['output'], 'w') as f:
+                    json.dump(results, f, indent=2, sort_keys=True)
+                self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['compare']:
+            regressions = compare_results(load_results(options['compare'])['endpoints'],
+                                          results['endpoints'], options['threshold'])
+            if regressions:
+                for endpoint, metric, old, new, change in regressions:
+                    self.stdout.write(self.style.ERROR(
+                        f'REGRESSION {endpoint} {metric}: {old} -> {new} ({change}%)'
+                    ))
+                raise CommandError(f'{len(regressions)} regressions beyond {options["threshold"]}%')
+            self.stdout.write(self.style.SUCCESS(f'No regressions beyond {options["threshold"]}%'))
+
+    def run(self, rows, options):
+        start = time.perf_counter()
+        counts = seed_dataset(rows, seed=options['seed'], log=lambda msg: self.stderr.write(f'seeding: {msg}'))
+        self.stdout.write(f'Seeded {counts} in {time.perf_counter() - start:.1f}s')
+
+        ctx = Context()
+        endpoints = [e for e in ENDPOINTS
+                     if not options['only'] or any(part in e.name for part in options['only'])]
+        # shared in-memory SQLite reports lock conflicts instead of waiting
+        serial_writes = connection.vendor == 'sqlite' and connection.is_in_memory_db()
+
+        self.stdout.write(f'{"endpoint":<26} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+                          f'{"req/s":>8} {"queries":>8} {"sql ms":>7} {"bytes":>9} {"errors":>7}')
+        results = {}
+        for endpoint in endpoints:
+            concurrency = 1 if endpoint.writes and serial_writes else options['concurrency']
+            result = self.measure(ctx, endpoint, options['requests'], options['warmup'], concurrency)
+            results[endpoint.name] = result
+            self.stdout.write(
+                f'{endpoint.name:<26} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+                f'{result["p99_ms"]:>8.2f} {result["throughput_rps"]:>8.1f} {result["queries"]:>8} '
+                f'{result["query_ms"]:>7.2f} {result["bytes"]:>9} {result["errors"]:>7}'
+            )
+
+        return {
+            'meta': {
+                'scale_rows': rows, 'seed': options['seed'], 'dataset': counts,
+                'requests': options['requests'], 'concurrency': options['concurrency'],
+                'database': connection.vendor, 'django': django.get_version(),
+                'python': platform.python_version(), 'recorded_at': timezone.now().isoformat(),
+            },
+            'endpoints': results,
+        }
+
+    def measure(self, ctx, endpoint, requests, warmup, concurrency):
+        clients = Clients()
+        errors = []
+
+        def call(i):
+            url, data = endpoint.prepare(ctx, i)
+            began = time.perf_counter()
+            response = send(clients.get(endpoint), ctx, endpoint, url, data)
+            elapsed = time.perf_counter() - began
+            if response.status_code != endpoint.expect:
+                errors.append(response.status_code)
+            return elapsed
+
+        for i in range(warmup):
+            call(i)
+        # queries and body size of one request, on this thread's connection
+        url, data = endpoint.prepare(ctx, warmup)
+        with QueryCounter() as queries:
+            response = send(clients.get(endpoint), ctx, endpoint, url, data)
+        errors.clear()
+
+        def worker(indexes):
+            try:
+                return [call(i) for i in indexes]
+            finally:
+                connections.close_all()
+
+        offset = warmup + 1
+        shares = [range(offset + k, offset + requests, concurrency) for k in range(concurrency)]
+        began = time.perf_counter()
+        if concurrency == 1:
+            latencies = [call(i) for i in shares[0]]
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = [t for part in pool.map(worker, shares) for t in part]
+        result = latency_summary(latencies, time.perf_counter() - began)
+        result['queries'] = queries.count
+        result['query_ms'] = round(queries.time * 1000, 3)
+        result['bytes'] = response.size
+        result['errors'] = len(errors)
+        result['concurrency'] = concurrency
+        return result
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecomm import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily revenue rollups from raw orders and verify them against live data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only compare the rollups with the orders table, do not rebuild',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            days = rollups.rebuild()
+            self.stdout.write(f'Rebuilt revenue rollups for {days} days')
+
+        mismatches = rollups.compare()
+        for day, field, stored, live in mismatches:
+            self.stdout.write(self.style.ERROR(f'{day} {field}: rollup={stored} orders={live}'))
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} rollup values differ from the orders table')
+        self.stdout.write(self.style.SUCCESS('Revenue rollups match the orders table'))
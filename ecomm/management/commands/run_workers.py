@@ -0,0 +1,55 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from ecomm import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs queued in the database (ecomm/jobs.py) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads, each claims its own batches')
+        parser.add_argument('--batch-size', type=int, help='Jobs claimed at once, default ECOMM_JOBS BATCH_SIZE')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds a worker waits when there is nothing to run')
+        parser.add_argument('--kinds', nargs='+', help='Only run these job kinds')
+        parser.add_argument('--once', action='store_true', help='Run the jobs due now and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            ran = 0
+            while True:
+                batch = jobs.run_batch(options['batch_size'], options['kinds'])
+                if not batch:
+                    break
+                ran += batch
+            self.stdout.write(f'Ran {ran} jobs')
+            self.report()
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+        workers = [
+            threading.Thread(target=jobs.work, name=f'job-worker-{number}', args=(stop,), kwargs={
+                'batch_size': options['batch_size'], 'kinds': options['kinds'],
+                'poll_interval': options['poll_interval'],
+            })
+            for number in range(options['threads'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {len(workers)} workers, stop with Ctrl-C')
+        # the main thread only waits, signals are delivered to it
+        while not stop.wait(1.0):
+            pass
+        for worker in workers:
+            worker.join()
+        self.report()
+
+    def report(self):
+        for kind, entry in sorted(jobs.queue_stats().items()):
+            self.stdout.write(f'{kind}: {entry["queued"]} queued, {entry["running"]} running, '
+                              f'{entry["failed"]} failed, oldest due job waited {entry["lag"]:.1f}s')
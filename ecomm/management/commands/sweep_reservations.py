@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecomm import reservations
+
+
+class Command(BaseCommand):
+    help = 'Release the stock of expired checkout reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep sweeping every this many seconds instead of once')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Also recompute reserved quantities from the reservation rows')
+
+    def handle(self, *args, **options):
+        while True:
+            released = reservations.sweep()
+            self.stdout.write(f'Released {released} expired reservation lines')
+            if options['rebuild']:
+                changed = reservations.rebuild_reserved()
+                self.stdout.write(f'Corrected the reserved quantity of {changed} products')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ecomm.catalog_cache import bump_catalog_version
+from ecomm.sqlite import copy_database
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into the read replicas of ECOMM_DATABASE_REPLICAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', nargs='+', default=[], help='Replica aliases, default all')
+        parser.add_argument('--interval', type=float,
+                            help='Keep copying every this many seconds instead of once')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or settings.ECOMM_DATABASE_REPLICAS
+        if not aliases:
+            raise CommandError('No read replicas configured, see ECOMM_SQLITE_REPLICAS in the settings')
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            if alias not in settings.ECOMM_DATABASE_REPLICAS:
+                raise CommandError(f'{alias!r} is not a read replica')
+            if connections[alias].vendor != 'sqlite' or primary.vendor != 'sqlite':
+                raise CommandError(f'{alias!r} is not a SQLite replica of a SQLite primary')
+            if connections[alias].settings_dict['NAME'] == primary.settings_dict['NAME']:
+                raise CommandError(f'{alias!r} is the primary database')
+
+        while True:
+            for alias in aliases:
+                start = time.perf_counter()
+                copy_database(primary, connections[alias])
+                self.stdout.write(f'Synced {alias} in {time.perf_counter() - start:.2f}s')
+            # catalog responses cached from the lagging replicas are stale now
+            bump_catalog_version()
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,289 @@
+"""
+Per-request cost instrumentation.
+
+``ecomm.middleware.RequestMetricsMiddleware`` opens a ``RequestStats`` for
+every request. While it is open, each SQL statement run on any connection
+adds to its query count and SQL time, and serializer work adds to its
+serializer time: ``to_representation()`` of the ecomm.serializers classes
+and JSON rendering by the ecomm.fastpath renderers, which the REST_FRAMEWORK
+settings make the default. The per-request state lives in a
+context variable, so it follows the request into ``sync_to_async`` threads
+of the async views.
+
+When the response is ready the totals are observed into the histograms
+below, labelled by URL name. ``render()`` writes them in the Prometheus text
+format for the ``/metrics/`` endpoint. The histograms are per process; every
+worker exposes its own.
+
+The body of a streaming response is produced after the middleware returns,
+so its latency covers the time to the first byte only.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in pairs) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}_total{_format_labels(self.labels, labels)} {_format_number(value)}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative bucket histogram per label set, like a Prometheus client histogram"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # one count per bucket plus +Inf, then the sum
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, labels=()):
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def sum(self, labels=()):
+        series = self._values.get(labels)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(series)) for labels, series in self._values.items())
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), series):
+                cumulative += count
+                le = (('le', _format_number(bound)),)
+                yield f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_number(series[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labels, labels)} {cumulative}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """Current value per label set"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[tuple(labels)] = value
+
+    def value(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(self.labels, labels)} {_format_number(value)}'
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+REQUESTS = Counter('ecomm_http_requests', 'HTTP requests by URL name, method and status',
+                   labels=('view', 'method', 'status'))
+REQUEST_LATENCY = Histogram('ecomm_http_request_duration_seconds', 'Time spent handling a request',
+                            labels=('view',))
+QUERY_COUNT = Histogram('ecomm_db_queries_per_request', 'SQL statements run by a request',
+                        labels=('view',), buckets=QUERY_BUCKETS)
+SQL_TIME = Histogram('ecomm_db_query_duration_seconds', 'Time a request spent in SQL',
+                     labels=('view',))
+SERIALIZER_TIME = Histogram('ecomm_serializer_duration_seconds',
+                            'Time a request spent serializing and rendering its response',
+                            labels=('view',))
+LOG_RECORDS_DROPPED = Counter('ecomm_log_records_dropped',
+                              'Log records dropped because the logging queue was full',
+                              labels=('logger', 'level'))
+LOG_RECORDS_SAMPLED_OUT = Counter('ecomm_log_records_sampled_out',
+                                  'INFO and DEBUG log records skipped by sampling', labels=('logger',))
+DB_ROUTES = Counter('ecomm_db_routes', 'Database the reads of replica-eligible requests went to, and why',
+                    labels=('view', 'decision', 'database'))
+JOBS_RUN = Counter('ecomm_jobs_run', 'Background jobs run by this process, by kind and outcome',
+                   labels=('kind', 'outcome'))
+JOB_DURATION = Histogram('ecomm_job_duration_seconds', 'Time a background job took to run', labels=('kind',))
+JOB_QUEUE_DEPTH = Gauge('ecomm_job_queue_depth', 'Background jobs in the queue by kind and status',
+                        labels=('kind', 'status'))
+JOB_QUEUE_LAG = Gauge('ecomm_job_queue_lag_seconds', 'How long the oldest due job of a kind has waited',
+                      labels=('kind',))
+
+REGISTRY = [REQUESTS, REQUEST_LATENCY, QUERY_COUNT, SQL_TIME, SERIALIZER_TIME,
+            LOG_RECORDS_DROPPED, LOG_RECORDS_SAMPLED_OUT, DB_ROUTES,
+            JOBS_RUN, JOB_DURATION, JOB_QUEUE_DEPTH, JOB_QUEUE_LAG]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    for metric in REGISTRY:
+        metric.reset()
+
+
+class RequestStats:
+    """Running totals of one request"""
+
+    __slots__ = ('started', 'queries', 'sql_time', 'serializer_time', '_serializing')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self._serializing = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+_current = ContextVar('ecomm_request_stats', default=None)
+
+
+@contextmanager
+def collect(stats=None):
+    """
+    Collect the stats of the code run inside the block, yields the
+    RequestStats. ``stats`` continues the totals of an earlier block.
+    """
+    if stats is None:
+        stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def serializing():
+    """Count the block as serializer time, nested blocks are counted once"""
+    stats = _current.get()
+    if stats is None or stats._serializing:
+        yield
+        return
+    stats._serializing += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - start
+        stats._serializing -= 1
+
+
+def observe(view, method, status, stats):
+    labels = (view,)
+    REQUESTS.inc((view, method, str(status)))
+    REQUEST_LATENCY.observe(labels, stats.elapsed())
+    QUERY_COUNT.observe(labels, stats.queries)
+    SQL_TIME.observe(labels, stats.sql_time)
+    SERIALIZER_TIME.observe(labels, stats.serializer_time)
+
+
+def server_timing(stats):
+    """``Server-Timing`` header value for ``stats``, durations in milliseconds"""
+    return (
+        f'db;dur={stats.sql_time * 1000:.2f};desc="{stats.queries} queries", '
+        f'ser;dur={stats.serializer_time * 1000:.2f}, '
+        f'total;dur={stats.elapsed() * 1000:.2f}'
+    )
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.sql_time += time.perf_counter() - start
+        stats.queries += 1
+
+
+@receiver(connection_created)
+def _instrument_connection(sender, connection, **kwargs):
+    # the wrapper object outlives reconnects, only add the hook once
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _execute_wrapper)
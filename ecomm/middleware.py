@@ -0,0 +1,137 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics, routing
+
+UNRESOLVED = '<unresolved>'
+
+
+def stream_within(response, resume, done):
+    """
+    Run each step of ``response``'s streamed body inside a ``resume()``
+    block and call ``done()`` when the body is finished or closed. Its
+    queries run after the middleware has returned.
+    """
+    body = response.streaming_content
+
+    if response.is_async:
+        async def content():
+            try:
+                while True:
+                    with resume():
+                        try:
+                            chunk = await anext(body)
+                        except StopAsyncIteration:
+                            return
+                    yield chunk
+            finally:
+                done()
+    else:
+        def content():
+            try:
+                while True:
+                    with resume():
+                        chunk = next(body, None)
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                done()
+    response.streaming_content = content()
+
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, SQL time, serializer time and latency of every
+    request in ecomm.metrics, labelled by URL name, and send them as a
+    ``Server-Timing`` header unless ``settings.ECOMM_SERVER_TIMING`` is False.
+    A streamed response is recorded once its body has been sent.
+
+    Goes first in ``MIDDLEWARE`` so the other middleware is included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with metrics.collect() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        with metrics.collect() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        match = getattr(request, 'resolver_match', None)
+        # unmatched paths share one label so scanners cannot grow the series
+        view = (match.url_name or match.view_name) if match else UNRESOLVED
+        if getattr(settings, 'ECOMM_SERVER_TIMING', True):
+            # a streamed body is still to come, the header has what ran before it
+            response['Server-Timing'] = metrics.server_timing(stats)
+        if response.streaming:
+            stream_within(response, lambda: metrics.collect(stats),
+                          lambda: metrics.observe(view, request.method, response.status_code, stats))
+        else:
+            metrics.observe(view, request.method, response.status_code, stats)
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the reads of each request with ecomm.routing, pin users who wrote
+    to the primary and count the routing decision in ecomm.metrics. The
+    reads of a streamed body are routed like the view's.
+
+    Goes after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with routing.routing(request) as route:
+            response = self.get_response(request)
+        return self.finish(request, response, route)
+
+    async def __acall__(self, request):
+        with routing.routing(request) as route:
+            response = await self.get_response(request)
+        return self.finish(request, response, route)
+
+    def finish(self, request, response, route):
+        if response.streaming:
+            stream_within(response, lambda: routing.routing(request, route),
+                          lambda: self.record(request, response, route))
+        else:
+            self.record(request, response, route)
+        return response
+
+    def record(self, request, response, route):
+        # writes through raw SQL do not pass the router, count every
+        # successful unsafe request as a write as well
+        wrote = route.wrote or (request.method not in ('GET', 'HEAD', 'OPTIONS')
+                                and response.status_code < 400)
+        user = routing.request_user(request)
+        if wrote and user is not None and user.is_authenticated:
+            routing.pin(user.pk)
+        if route.decision:
+            match = request.resolver_match
+            metrics.DB_ROUTES.inc((match.url_name, route.decision, route.database))
@@ -0,0 +1,38 @@
+# Written by hand: the full-text index is created by ecomm.search per database vendor.
+
+import django.db.models.deletion
+import ecomm.models
+from django.db import migrations, models
+
+from ecomm.search import backend_for_vendor
+
+
+def install_search_index(apps, schema_editor):
+    backend_for_vendor(schema_editor.connection.vendor).install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    backend_for_vendor(schema_editor.connection.vendor).uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomm', '0005_alter_cartitem_item_delete_item'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='ecomm.inventory')),
+                ('name', ecomm.models.SearchDocumentField()),
+                ('description', ecomm.models.SearchDocumentField()),
+            ],
+            options={
+                'db_table': 'ecomm_inventory_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
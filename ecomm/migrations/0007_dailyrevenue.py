@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+from ecomm import rollups
+
+
+def populate_rollups(apps, schema_editor):
+    rollups.rebuild(apps.get_model('ecomm', 'Order'), apps.get_model('ecomm', 'DailyRevenue'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomm', '0006_inventory_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('revenue', models.FloatField(default=0)),
+                ('order_count', models.IntegerField(default=0)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('processing_count', models.IntegerField(default=0)),
+                ('shipped_count', models.IntegerField(default=0)),
+                ('delivered_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['day'],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomm', '0007_dailyrevenue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['category', 'price'], name='ecomm_inven_categor_301e04_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['created_at'], name='ecomm_inven_created_837d1c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='ecomm_order_created_f09935_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='ecomm_order_status_4f46e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='ecomm_order_user_id_09e62b_idx'),
+        ),
+    ]
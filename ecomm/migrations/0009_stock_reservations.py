@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from ecomm.search import backend_for_vendor
+
+
+def reinstall_search_index(apps, schema_editor):
+    # SQLite adds the column by rebuilding ecomm_inventory, which drops the
+    # triggers that keep the search index up to date
+    backend_for_vendor(schema_editor.connection.vendor).install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomm', '0008_advised_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='reserved_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(db_index=True)),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='ecomm.inventory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
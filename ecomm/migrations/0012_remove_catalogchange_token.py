@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:54
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecomm', '0011_catalog_changes'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='catalogchange',
+            name='token',
+        ),
+    ]
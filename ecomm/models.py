@@ -2,7 +2,8 @@ from django.db import models
 
 # Create your models here.
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Lookup
 
 class User(AbstractUser):
     ROLE_CHOICES = [
@@ -28,14 +29,57 @@ class inventory(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     price=models.DecimalField(max_digits=10,decimal_places=2)
     quantity=models.IntegerField()
+    # held by unexpired checkout reservations, see ecomm.reservations
+    reserved_quantity = models.IntegerField(default=0)
     description=models.CharField(max_length=20)
     created_at = models.DateTimeField(auto_now_add=True)
     restocked_at = models.DateTimeField(auto_now=True)
     class Meta:
         ordering = ['-created_at']
+        # from manage.py advise_indexes: shop/list by category and price, newest first
+        indexes = [
+            models.Index(fields=['category', 'price'], name='ecomm_inven_categor_301e04_idx'),
+            models.Index(fields=['created_at'], name='ecomm_inven_created_837d1c_idx'),
+        ]
     def __str__(self):
         return self.name
 
+    @property
+    def available_quantity(self):
+        """Stock buyers can still order, reserved units excluded"""
+        return max(self.quantity - self.reserved_quantity, 0)
+
+    @property
+    def in_stock(self):
+        return self.available_quantity > 0
+
+class SearchDocumentField(models.TextField):
+    """Column of a full-text index table, supports the ``match`` lookup"""
+
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        rhs, params = self.process_rhs(compiler, connection)
+        # FTS5 matches against the whole table, not a single column
+        table = compiler.quote_name_unless_alias(self.lhs.alias)
+        return f'{table} MATCH {rhs}', params
+
+
+class InventorySearchIndex(models.Model):
+    """SQLite FTS5 index over inventory name/description, see ecomm.search"""
+    product = models.OneToOneField(
+        inventory, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_index',
+    )
+    name = SearchDocumentField()
+    description = SearchDocumentField()
+    class Meta:
+        managed = False
+        db_table = 'ecomm_inventory_fts'
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('processing', 'Processing'),
@@ -53,10 +97,28 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     class Meta:
         ordering = ['-created_at']
+        # from manage.py advise_indexes: order history, shopkeeper listing by date and status
+        indexes = [
+            models.Index(fields=['created_at'], name='ecomm_order_created_f09935_idx'),
+            models.Index(fields=['status', 'created_at'], name='ecomm_order_status_4f46e8_idx'),
+            models.Index(fields=['user', 'created_at'], name='ecomm_order_user_id_09e62b_idx'),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        # keep the daily revenue rollups in the same transaction as the order
+        from .rollups import record_order_change
+        with transaction.atomic(savepoint=False):
+            before = None
+            if not self._state.adding:
+                before = Order.objects.filter(pk=self.pk).values_list(
+                    'created_at', 'status', 'total_amount'
+                ).first()
+            super().save(*args, **kwargs)
+            record_order_change(before, (self.created_at, self.status, self.total_amount))
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(inventory, on_delete=models.CASCADE)
@@ -69,9 +131,34 @@ class OrderItem(models.Model):
     def subtotal(self):
         return self.quantity * self.price
 
-<<<<<<< HEAD
+class StockReservation(models.Model):
+    """Units of a product held for a checkout until ``expires_at``, see ecomm.reservations"""
+    token = models.UUIDField(db_index=True)  # shared by the lines of one reservation
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(inventory, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} until {self.expires_at}"
+
+class DailyRevenue(models.Model):
+    """Per-day order rollup maintained by Order.save() and deletes, see ecomm.rollups"""
+    day = models.DateField(unique=True)
+    revenue = models.FloatField(default=0)  # excludes cancelled orders
+    order_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    processing_count = models.IntegerField(default=0)
+    shipped_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    class Meta:
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.day}: {self.revenue}"
 
-=======
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
     item = models.ForeignKey(inventory, on_delete=models.CASCADE)
@@ -83,5 +170,39 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.quantity}x {self.item.name}"
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-    
+
+class Job(models.Model):
+    """Background work for ``run_workers``, see ecomm.jobs"""
+    QUEUED, RUNNING, FAILED = 'queued', 'running', 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),  # out of attempts, kept for inspection
+    ]
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()  # due time, pushed back by retries
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease of a running job
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # due jobs in order, per kind for the concurrency limits
+            models.Index(fields=['status', 'run_at'], name='ecomm_job_status_run_at_idx'),
+            models.Index(fields=['kind', 'status', 'locked_until'], name='ecomm_job_kind_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+class CatalogChange(models.Model):
+    """A logged catalog write; the committed rows make the catalog version, see ecomm.catalog_cache"""
+    product_ids = models.JSONField(null=True)  # None when unknown: bulk writes, categories
+
+    def __str__(self):
+        return f"Catalog change #{self.id}"
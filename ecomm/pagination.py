@@ -0,0 +1,123 @@
+"""
+Keyset (cursor) pagination.
+
+A cursor remembers the ordering value and id of the last row of a page, so
+the next page is fetched with a ``WHERE (field, id) > (value, id)`` filter
+instead of an OFFSET. Every page costs the same no matter how deep it is and
+rows inserted in the meantime never shift or duplicate results.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class PaginationError(ValueError):
+    """Raised for a malformed cursor or limit"""
+
+
+def parse_limit(raw, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    if raw in (None, ''):
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be greater than 0')
+    return min(limit, maximum)
+
+
+def _split(ordering):
+    if ordering.startswith('-'):
+        return ordering[1:], True
+    return ordering, False
+
+
+def _to_python(model, field_name, value):
+    try:
+        field = model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        # annotations (e.g. search rank) are stored as plain JSON values
+        return value
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        raise PaginationError('Invalid cursor')
+
+
+def _row_value(row, field_name):
+    if isinstance(row, dict):
+        return row[field_name]
+    return getattr(row, field_name)
+
+
+def encode_cursor(ordering, row):
+    field_name, _ = _split(ordering)
+    value = _row_value(row, field_name)
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    elif not isinstance(value, (int, float, str)) and value is not None:
+        value = str(value)
+    payload = json.dumps([ordering, value, _row_value(row, 'id')], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering, model):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_ordering, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        raise PaginationError('Invalid cursor')
+    if cursor_ordering != ordering:
+        raise PaginationError('Cursor does not match the requested ordering')
+    field_name, _ = _split(ordering)
+    return _to_python(model, field_name, value), last_id
+
+
+def keyset_filter(queryset, ordering, cursor):
+    """Restrict ``queryset`` to the rows after ``cursor`` and order it by ``(ordering, id)``"""
+    field_name, descending = _split(ordering)
+    if descending:
+        queryset = queryset.order_by(f'-{field_name}', '-id')
+    else:
+        queryset = queryset.order_by(field_name, 'id')
+    if not cursor:
+        return queryset
+
+    value, last_id = decode_cursor(cursor, ordering, queryset.model)
+    op = 'lt' if descending else 'gt'
+    return queryset.filter(
+        Q(**{f'{field_name}__{op}': value}) |
+        Q(**{field_name: value, f'id__{op}': last_id})
+    )
+
+
+def paginate(queryset, ordering, cursor=None, limit=DEFAULT_LIMIT):
+    """
+    Return ``(rows, next_cursor)`` for one page.
+
+    One extra row is fetched to find out whether another page exists, so a
+    page never needs a COUNT query.
+    """
+    rows = list(keyset_filter(queryset, ordering, cursor)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(ordering, rows[-1])
+    return rows, next_cursor
+
+
+async def apaginate(queryset, ordering, cursor=None, limit=DEFAULT_LIMIT):
+    """Async version of paginate()"""
+    rows = [row async for row in keyset_filter(queryset, ordering, cursor)[:limit + 1]]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(ordering, rows[-1])
+    return rows, next_cursor
@@ -0,0 +1,206 @@
+"""
+Stock reservations for two-step checkout.
+
+``reserve`` holds units of each product for ``settings.ECOMM_RESERVATION_TTL``
+seconds. It raises ``inventory.reserved_quantity`` with one conditional
+UPDATE that only matches rows where ``quantity - reserved_quantity`` still
+covers the request. It also inserts one ``StockReservation`` row per line,
+all sharing a token. The transaction is over as soon as the hold is taken.
+Buyers of the same product therefore only contend for the duration of that
+single UPDATE, never for the length of a checkout.
+
+``consume`` turns a hold into sold stock inside the order's transaction.
+``release`` gives it back. ``sweep`` releases expired holds in bulk. It runs
+from ``manage.py sweep_reservations`` and, for the products involved, when a
+reservation finds too little stock.
+
+No row locks are taken. A hold is claimed by deleting its rows, and the
+delete count shows whether another transaction (a sweep or a second
+confirmation) got there first.
+"""
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_version
+from .models import inventory, StockReservation
+from .stock import per_product
+
+Hold = namedtuple('Hold', 'token expires_at lines products')
+
+
+class ReservationError(Exception):
+    """Raised when stock cannot be reserved or a hold is gone, ``message`` is safe to return to clients"""
+
+    def __init__(self, message, item_id=None):
+        super().__init__(message)
+        self.message = message
+        self.item_id = item_id
+
+
+class _Short(Exception):
+    pass
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'ECOMM_RESERVATION_TTL', 600))
+
+
+def _take(user, lines, expires_at):
+    token = uuid.uuid4()
+    requested = per_product(lines)
+    with transaction.atomic():
+        updated = inventory.objects.filter(
+            id__in=list(lines), quantity__gte=F('reserved_quantity') + requested,
+        ).update(reserved_quantity=F('reserved_quantity') + requested)
+        if updated != len(lines):
+            raise _Short()
+        StockReservation.objects.bulk_create([
+            StockReservation(token=token, user_id=user.pk, product_id=product_id,
+                             quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in lines.items()
+        ])
+        # available stock is part of the cached shop item detail
+        bump_catalog_version(lines)
+    return token
+
+
+def reserve(user, lines, ttl=None):
+    """
+    Hold ``{product_id: quantity}`` for ``user`` and return the Hold.
+
+    All lines are held or none. When stock is short the expired holds of
+    those products are swept and the reservation is tried once more.
+    """
+    if not lines:
+        raise ReservationError('At least one item is required')
+    products = inventory.objects.in_bulk(list(lines))
+    for product_id in lines:
+        if product_id not in products:
+            raise ReservationError(f'Invalid item_id: {product_id}', product_id)
+    expires_at = timezone.now() + (ttl or reservation_ttl())
+    try:
+        token = _take(user, lines, expires_at)
+    except _Short:
+        if not sweep(product_ids=list(lines)):
+            raise _shortage(lines, products) from None
+        try:
+            token = _take(user, lines, expires_at)
+        except _Short:
+            raise _shortage(lines, products) from None
+    return Hold(token, expires_at, lines, products)
+
+
+def _shortage(lines, products):
+    available = dict(
+        inventory.objects.filter(id__in=list(lines))
+        .values_list('id', F('quantity') - F('reserved_quantity'))
+    )
+    for product_id, quantity in lines.items():
+        if available.get(product_id, 0) < quantity:
+            return ReservationError(f'Insufficient stock for {products[product_id].name}', product_id)
+    return ReservationError('Stock changed during checkout, please retry')
+
+
+def _claim(token, user=None, live_only=True):
+    """
+    Delete the rows of the hold ``token`` and return its ``{product_id:
+    quantity}``, or None. Must run inside a transaction, rolled back when
+    only part of the hold could be claimed.
+    """
+    holds = StockReservation.objects.filter(token=token)
+    if user is not None:
+        holds = holds.filter(user_id=user.pk)
+    if live_only:
+        holds = holds.filter(expires_at__gt=timezone.now())
+    rows = list(holds.values_list('id', 'product_id', 'quantity'))
+    if not rows:
+        return None
+    deleted, _ = StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    if deleted != len(rows):
+        # swept or claimed concurrently: put back what was deleted here, the
+        # rows are left for whoever claims them next to release
+        transaction.set_rollback(True)
+        return None
+    return {product_id: quantity for _, product_id, quantity in rows}
+
+
+def consume(token, user):
+    """
+    Convert the hold ``token`` of ``user`` into sold stock and return its
+    ``{product_id: quantity}``.
+
+    Must run inside the transaction that records the sale. Raises
+    ReservationError when the hold has expired, was already used, or the
+    shopkeeper has since cut stock below it.
+    """
+    lines = _claim(token, user)
+    if lines is None:
+        raise ReservationError('Reservation not found or expired')
+    held = per_product(lines)
+    updated = inventory.objects.filter(id__in=list(lines), quantity__gte=held).update(
+        quantity=F('quantity') - held,
+        reserved_quantity=F('reserved_quantity') - held,
+    )
+    if updated != len(lines):
+        raise ReservationError('Reserved stock is no longer available')
+    bump_catalog_version(lines)
+    return lines
+
+
+def release(token, user=None):
+    """Give the stock of the hold ``token`` back, return whether there was one"""
+    with transaction.atomic():
+        lines = _claim(token, user, live_only=False)
+        if lines is None:
+            return False
+        held = per_product(lines)
+        inventory.objects.filter(id__in=list(lines)).update(reserved_quantity=F('reserved_quantity') - held)
+        bump_catalog_version(lines)
+    return True
+
+
+def sweep(now=None, product_ids=None, batch_size=1000):
+    """Release every hold that expired by ``now``, return the number of lines released"""
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now)
+    if product_ids is not None:
+        expired = expired.filter(product_id__in=product_ids)
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(expired.values_list('id', 'product_id', 'quantity')[:batch_size])
+            if not rows:
+                break
+            deleted, _ = StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+            if deleted != len(rows):
+                # some were confirmed or released meanwhile, read the batch again
+                transaction.set_rollback(True)
+                continue
+            lines = {}
+            for _, product_id, quantity in rows:
+                lines[product_id] = lines.get(product_id, 0) + quantity
+            held = per_product(lines)
+            inventory.objects.filter(id__in=list(lines)).update(reserved_quantity=F('reserved_quantity') - held)
+            bump_catalog_version(lines)
+        released += len(rows)
+    return released
+
+
+def rebuild_reserved():
+    """Recompute ``reserved_quantity`` from the reservation rows, return the products changed"""
+    held = (StockReservation.objects.filter(product=OuterRef('pk')).order_by()
+            .values('product').annotate(total=Sum('quantity')).values('total'))
+    with transaction.atomic():
+        changed = inventory.objects.exclude(
+            reserved_quantity=Coalesce(Subquery(held), Value(0))
+        ).update(reserved_quantity=Coalesce(Subquery(held), Value(0)))
+        if changed:
+            bump_catalog_version()
+    return changed
@@ -0,0 +1,156 @@
+"""
+Per-day revenue rollups.
+
+``DailyRevenue`` keeps, for every day that has orders, the revenue of its
+non-cancelled orders, the number of orders and the number of orders in each
+status. ``Order.save()`` and the ``post_delete`` signal (ecomm.signals,
+sent for instance and queryset deletes and for cascades such as deleting a
+user) apply the change of a single order as a delta inside the writing
+transaction, so reports read O(days) rows instead of scanning every order.
+
+``Order.objects.update()``, ``bulk_create()`` and raw SQL send no signals
+and are not tracked; ``manage.py rebuild_revenue_rollups --check`` reports
+such drift and ``manage.py rebuild_revenue_rollups`` repairs it.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+STATUSES = ['pending', 'processing', 'shipped', 'delivered', 'cancelled']
+COUNTER_FIELDS = ['revenue', 'order_count'] + [f'{s}_count' for s in STATUSES]
+TOLERANCE = 0.005
+
+
+def day_of(created_at):
+    return timezone.localtime(created_at).date()
+
+
+def contribution(status, total_amount):
+    """Counters a single order adds to the rollup of its day"""
+    counters = {
+        'revenue': 0.0 if status == 'cancelled' else float(total_amount),
+        'order_count': 1,
+    }
+    if status in STATUSES:
+        counters[f'{status}_count'] = 1
+    return counters
+
+
+def apply_delta(day, delta):
+    """Add ``delta`` (counter -> amount) to the rollup row of ``day``"""
+    from .models import DailyRevenue
+
+    delta = {field: amount for field, amount in delta.items() if amount}
+    if not delta:
+        return
+    updates = {field: F(field) + amount for field, amount in delta.items()}
+    if DailyRevenue.objects.filter(day=day).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            DailyRevenue.objects.create(day=day, **delta)
+    except IntegrityError:
+        # another transaction created the row first
+        DailyRevenue.objects.filter(day=day).update(**updates)
+
+
+def record_order_change(before, after):
+    """
+    Move an order's contribution from ``before`` to ``after``.
+
+    Both are ``(created_at, status, total_amount)`` tuples or None for a
+    created / deleted order.
+    """
+    deltas = {}
+    for state, sign in ((before, -1), (after, 1)):
+        if state is None:
+            continue
+        created_at, status, total_amount = state
+        day_delta = deltas.setdefault(day_of(created_at), {})
+        for field, amount in contribution(status, total_amount).items():
+            day_delta[field] = day_delta.get(field, 0) + sign * amount
+    for day, delta in deltas.items():
+        apply_delta(day, delta)
+
+
+def compute_from_orders(order_model=None):
+    """Aggregate the rollups straight from the orders table, keyed by day"""
+    if order_model is None:
+        from .models import Order as order_model
+
+    rows = (
+        order_model.objects.order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('day', 'status')
+        .annotate(orders=Count('id'), amount=Sum('total_amount'))
+    )
+    rollups = {}
+    for row in rows:
+        counters = rollups.setdefault(row['day'], dict.fromkeys(COUNTER_FIELDS, 0))
+        counters['order_count'] += row['orders']
+        if row['status'] in STATUSES:
+            counters[f"{row['status']}_count"] += row['orders']
+        if row['status'] != 'cancelled':
+            counters['revenue'] += row['amount'] or 0.0
+    return rollups
+
+
+def rebuild(order_model=None, rollup_model=None):
+    """Replace every rollup row with values computed from raw orders"""
+    if rollup_model is None:
+        from .models import DailyRevenue as rollup_model
+
+    rollups = compute_from_orders(order_model)
+    with transaction.atomic():
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(
+            [rollup_model(day=day, **counters) for day, counters in rollups.items()],
+            batch_size=500,
+        )
+    return len(rollups)
+
+
+def compare():
+    """Return ``[(day, field, stored, live)]`` for every rollup value that drifted"""
+    from .models import DailyRevenue
+
+    live = compute_from_orders()
+    stored = {row['day']: row for row in DailyRevenue.objects.values('day', *COUNTER_FIELDS)}
+    mismatches = []
+    for day in sorted(set(live) | set(stored)):
+        expected = live.get(day, dict.fromkeys(COUNTER_FIELDS, 0))
+        actual = stored.get(day, dict.fromkeys(COUNTER_FIELDS, 0))
+        for field in COUNTER_FIELDS:
+            if abs((actual[field] or 0) - (expected[field] or 0)) > TOLERANCE:
+                mismatches.append((day, field, actual[field], expected[field]))
+    return mismatches
+
+
+def revenue_summary():
+    """Revenue statistics for the whole history, this month and this year in one query"""
+    from .models import DailyRevenue
+
+    today = timezone.localdate()
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    totals = DailyRevenue.objects.aggregate(
+        total_revenue=Sum('revenue'),
+        order_count=Sum('order_count'),
+        cancelled=Sum('cancelled_count'),
+        pending=Sum('pending_count'),
+        delivered=Sum('delivered_count'),
+        revenue_this_month=Sum('revenue', filter=Q(day__gte=month_start)),
+        revenue_this_year=Sum('revenue', filter=Q(day__gte=year_start)),
+    )
+    total_revenue = totals['total_revenue'] or 0
+    total_orders = (totals['order_count'] or 0) - (totals['cancelled'] or 0)
+    return {
+        'total_revenue': total_revenue,
+        'total_orders': total_orders,
+        'pending_orders': totals['pending'] or 0,
+        'completed_orders': totals['delivered'] or 0,
+        'average_order_value': round(total_revenue / total_orders, 2) if total_orders else 0,
+        'revenue_this_month': totals['revenue_this_month'] or 0,
+        'revenue_this_year': totals['revenue_this_year'] or 0,
+    }
@@ -0,0 +1,139 @@
+"""
+Read/write splitting between the primary database and its read replicas.
+
+``ReplicaRouter`` sends every write to the primary (``default``). Reads go to
+a replica only inside a GET or HEAD request to a view listed by URL name in
+``settings.ECOMM_REPLICA_VIEWS`` (the catalog, order history and the
+reports). Everything else reads from the primary, including management
+commands and reads inside the same request after a write.
+
+A request picks one replica from ``settings.ECOMM_DATABASE_REPLICAS`` and
+reads only from it. Replicas lag behind the primary. To let users read
+their own writes, a request that writes pins its user to the primary for
+``settings.ECOMM_REPLICA_PIN_SECONDS``. The pin is kept in Django's default
+cache, so all workers see it when that cache is shared.
+
+``ReplicaRoutingMiddleware`` sets up the routing state of each request and
+counts the decision in ``ecomm_db_routes_total`` on ``/metrics/``. The
+decision is 'replica', 'pinned' (to the primary after a write) or 'primary'
+(no replica configured).
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import LazyObject, empty
+
+PRIMARY = DEFAULT_DB_ALIAS
+PIN_KEY = 'ecomm:replica-pin:{}'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def replica_aliases():
+    """
+    The configured replicas. Test mirrors point at the primary's database
+    and are left out; reading through them gains nothing.
+    """
+    primary = connections[PRIMARY].settings_dict['NAME']
+    return [alias for alias in getattr(settings, 'ECOMM_DATABASE_REPLICAS', ())
+            if connections[alias].settings_dict['NAME'] != primary]
+
+
+def pin(user_id):
+    """Read from the primary for the next ``ECOMM_REPLICA_PIN_SECONDS`` requests of ``user_id``"""
+    cache.set(PIN_KEY.format(user_id), True, getattr(settings, 'ECOMM_REPLICA_PIN_SECONDS', 5))
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY.format(user_id)) is not None
+
+
+def request_user(request):
+    """The authenticated user of ``request``, None while authentication has not run yet"""
+    user = request.__dict__.get('user')
+    if user is None or (isinstance(user, LazyObject) and user._wrapped is empty):
+        return None
+    return user
+
+
+class Route:
+    """Routing state of one request"""
+
+    __slots__ = ('request', 'database', 'decision', 'wrote')
+
+    def __init__(self, request):
+        self.request = request
+        self.database = None
+        self.decision = None
+        self.wrote = False
+
+    def read_database(self):
+        if self.wrote:
+            return PRIMARY
+        if self.database is None:
+            self._decide()
+        return self.database or PRIMARY
+
+    def _decide(self):
+        request = self.request
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            # middleware before the URL is resolved, e.g. the session lookup
+            return
+        if request.method not in READ_METHODS or match.url_name not in settings.ECOMM_REPLICA_VIEWS:
+            self.database = PRIMARY
+            return
+        user = request_user(request)
+        if user is None:
+            # the view is still authenticating, decide once the user is known
+            return
+        replicas = replica_aliases()
+        if user.is_authenticated and is_pinned(user.pk):
+            self.database, self.decision = PRIMARY, 'pinned'
+        elif replicas:
+            self.database, self.decision = random.choice(replicas), 'replica'
+        else:
+            self.database, self.decision = PRIMARY, 'primary'
+
+
+_current = ContextVar('ecomm_db_route', default=None)
+
+
+@contextmanager
+def routing(request, route=None):
+    """
+    Route the queries run inside the block for ``request``, yields the
+    Route. ``route`` continues the routing of an earlier block.
+    """
+    if route is None:
+        route = Route(request)
+    token = _current.set(route)
+    try:
+        yield route
+    finally:
+        _current.reset(token)
+
+
+class ReplicaRouter:
+    """``DATABASE_ROUTERS`` entry, see the module docstring"""
+
+    def db_for_read(self, model, **hints):
+        route = _current.get()
+        return route.read_database() if route is not None else None
+
+    def db_for_write(self, model, **hints):
+        route = _current.get()
+        if route is not None:
+            route.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas are copies of the primary, rows relate across them
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema with the data from sync_replicas
+        return db not in getattr(settings, 'ECOMM_DATABASE_REPLICAS', ())
@@ -0,0 +1,136 @@
+"""
+Full-text search over the inventory catalog.
+
+Views only talk to ``get_search_backend()``. A backend narrows an inventory
+queryset to the products matching a query and annotates each row with a
+``search_rank`` (lower is more relevant) so results can be ordered and keyset
+paginated like any other column.
+
+``SQLiteFTSBackend`` keeps an FTS5 external-content table in sync through
+triggers on ``ecomm_inventory``, so creates, updates, restocks and bulk
+writes never need to touch the index from Python. Other databases fall back
+to ``BasicSearchBackend`` until they get a native implementation (a Postgres
+backend would annotate ``SearchRank`` over a GIN-indexed ``SearchVector``).
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q, Value, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchBackend:
+    """Interface every search backend implements"""
+
+    @staticmethod
+    def empty(queryset):
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+
+    def install(self, connection):
+        """Create whatever index structures the backend needs"""
+
+    def uninstall(self, connection):
+        """Drop the structures created by ``install``"""
+
+    def rebuild(self):
+        """Rebuild the index from scratch and return the number of indexed rows"""
+        raise NotImplementedError
+
+    def filter(self, queryset, query):
+        """Return ``queryset`` narrowed to ``query`` and annotated with ``search_rank``"""
+        raise NotImplementedError
+
+
+class BasicSearchBackend(SearchBackend):
+    """Unindexed substring search, used where no native full-text index exists"""
+
+    def rebuild(self):
+        from .models import inventory
+        return inventory.objects.count()
+
+    def filter(self, queryset, query):
+        terms = WORD_RE.findall(query)
+        if not terms:
+            return self.empty(queryset)
+        for term in terms:
+            queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """SQLite FTS5 index ranked with bm25, name matches weigh more than description"""
+
+    table = 'ecomm_inventory_fts'
+    source = 'ecomm_inventory'
+    weights = (10.0, 1.0)
+
+    def _statements(self):
+        fts, src = self.table, self.source
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"name, description, content='{src}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {src} BEGIN "
+            f"INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {src} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name, description) "
+            f"VALUES ('delete', old.id, old.name, old.description); END",
+            # stock changes (restock, orders) do not touch the indexed columns
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name, description ON {src} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, name, description) "
+            f"VALUES ('delete', old.id, old.name, old.description); "
+            f"INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+        ]
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            for sql in self._statements():
+                cursor.execute(sql)
+            # index rows that existed before the triggers
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for suffix in ('_ai', '_ad', '_au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {self.table}{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def rebuild(self):
+        self.uninstall(connection)
+        self.install(connection)
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {self.source}')
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def match_expression(query):
+        """Turn free text into an FTS5 query: every word is a quoted prefix term"""
+        return ' '.join('"%s"*' % term for term in WORD_RE.findall(query))
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return self.empty(queryset)
+        weights = ', '.join(str(w) for w in self.weights)
+        # joins the FTS table through InventorySearchIndex, bm25 reads that join
+        return queryset.filter(search_index__name__match=match).annotate(
+            search_rank=RawSQL(f'bm25("{self.table}", {weights})', (), output_field=FloatField())
+        )
+
+
+def backend_for_vendor(vendor):
+    if vendor == 'sqlite':
+        return SQLiteFTSBackend()
+    return BasicSearchBackend()
+
+
+def get_search_backend():
+    path = getattr(settings, 'ECOMM_SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return backend_for_vendor(connection.vendor)
@@ -1,9 +1,24 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from .metrics import serializing
 from .models import User,inventory,Category,Order,OrderItem
 
-class UserSignupSerializer(serializers.ModelSerializer):
+class TimedMixin:
+    """Counts ``to_representation()`` as serializer time in ecomm.metrics, nested serializers once"""
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+class SparseFieldsMixin:
+    """``fields=`` keeps only the named fields, see ecomm.fieldsets (None keeps all)"""
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in [name for name in self.fields if name not in fields]:
+                self.fields.pop(name)
+
+class UserSignupSerializer(TimedMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, validators=[validate_password])
     password_confirm = serializers.CharField(write_only=True)
 
@@ -24,7 +39,7 @@ class UserSignupSerializer(serializers.ModelSerializer):
         )
         return user
 
-class LoginSerializer(serializers.Serializer):
+class LoginSerializer(TimedMixin, serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField()
 
@@ -52,19 +67,19 @@ class AdminLoginSerializer(LoginSerializer):
         
         return attrs
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'role', 'created_at')
         read_only_fields = ('id', 'role', 'created_at')
 
 #Inventory management
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'name', 'description', 'created_at']
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, TimedMixin, serializers.ModelSerializer):
     """Serializer for inventory list - shows essential info"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     
@@ -72,7 +87,7 @@ class ProductListSerializer(serializers.ModelSerializer):
         model = inventory
         fields = ['id', 'name', 'category_name', 'quantity', 'price', 'created_at', ]
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(TimedMixin, serializers.ModelSerializer):
     """Detailed serializer for single product operations"""
     category = CategorySerializer(read_only=True)
     category_id = serializers.IntegerField(write_only=True)
@@ -85,7 +100,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class ProductCreateSerializer(serializers.ModelSerializer):
+class ProductCreateSerializer(TimedMixin, serializers.ModelSerializer):
     """Serializer for creating new products"""
     class Meta:
         model = inventory
@@ -101,7 +116,7 @@ class ProductCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Quantity cannot be negative")
         return value
 
-class ProductUpdateSerializer(serializers.ModelSerializer):
+class ProductUpdateSerializer(TimedMixin, serializers.ModelSerializer):
     """Serializer for updating existing products"""
     class Meta:
         model = inventory
@@ -112,20 +127,34 @@ class ProductUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Price must be greater than 0")
         return value
 
-class ProductRestockSerializer(serializers.Serializer):
+class ProductRestockSerializer(TimedMixin, serializers.Serializer):
     """Serializer for restocking products"""
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
+
+class BatchRestockSerializer(TimedMixin, serializers.Serializer):
+    """Serializer for restocking many products at once"""
+    items = ProductRestockSerializer(many=True, allow_empty=False)
+
+class CartAddSerializer(TimedMixin, serializers.Serializer):
+    item_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+class CartLineSerializer(TimedMixin, serializers.Serializer):
+    item_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)  # 0 removes the line
+
+class CartUpdateSerializer(TimedMixin, serializers.Serializer):
+    items = CartLineSerializer(many=True, allow_empty=False)
+
+class CartRemoveSerializer(TimedMixin, serializers.Serializer):
+    item_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class CartCheckoutSerializer(TimedMixin, serializers.Serializer):
+    shipping_address = serializers.CharField(max_length=500)
+    phone_number = serializers.CharField(max_length=15)
     
-    def validate_product_id(self, value):
-        try:
-            inventory.objects.get(id=value)
-        except inventory.DoesNotExist:
-            raise serializers.ValidationError("Product not found")
-        
-        return value
-    
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     
@@ -133,7 +162,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product_name', 'quantity', 'price', 'subtotal']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, TimedMixin, serializers.ModelSerializer):
     """Serializer for viewing orders"""
     items = OrderItemSerializer(many=True, read_only=True)
     user_info = serializers.SerializerMethodField()
@@ -153,7 +182,7 @@ class OrderSerializer(serializers.ModelSerializer):
             'first_name': obj.user.first_name,
             'last_name': obj.user.last_name
         }
-class RevenueSerializer(serializers.Serializer):
+class RevenueSerializer(TimedMixin, serializers.Serializer):
     """Serializer for revenue statistics"""
     total_revenue = serializers.DecimalField(max_digits=15, decimal_places=2)
     total_orders = serializers.IntegerField()
@@ -163,29 +192,30 @@ class RevenueSerializer(serializers.Serializer):
     revenue_this_month = serializers.DecimalField(max_digits=15, decimal_places=2)
     revenue_this_year = serializers.DecimalField(max_digits=15, decimal_places=2)
 
-class ItemListSerializer(serializers.ModelSerializer):
+class ItemListSerializer(SparseFieldsMixin, TimedMixin, serializers.ModelSerializer):
     """Simplified serializer (excludes detailed description)"""
     class Meta:
         model = inventory
         fields = ['id', 'name', 'category', 'price']
 
-class ItemSerializer(serializers.ModelSerializer):
+class ItemSerializer(SparseFieldsMixin, TimedMixin, serializers.ModelSerializer):
+    # what buyers can still order, units held by reservations excluded
+    quantity = serializers.IntegerField(source='available_quantity', read_only=True)
     in_stock = serializers.ReadOnlyField()
     class Meta:
         model = inventory
         fields = ['id', 'name', 'description', 'category', 'price', 'quantity', 
                  'in_stock', 'created_at']
 
-class CreateOrderSerializer(serializers.Serializer):
+class OrderLinesSerializer(TimedMixin, serializers.Serializer):
     items = serializers.ListField(
         child=serializers.DictField(
             child=serializers.CharField()
         )
     )
-    shipping_address = serializers.CharField(max_length=500)
-    phone_number = serializers.CharField(max_length=15)
-    special_instructions = serializers.CharField(max_length=500, required=False, allow_blank=True)
     def validate_items(self, value):
+        # stock and product existence are checked by the checkout engine in
+        # one query, here only the shape of each line is validated
         if not value:
             raise serializers.ValidationError("At least one item is required")
         
@@ -194,17 +224,29 @@ class CreateOrderSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Each item must have 'item_id' and 'quantity'")
             
             try:
-                item_id = int(item_data['item_id'])
+                int(item_data['item_id'])
                 quantity = int(item_data['quantity'])
-                
-                if quantity <= 0:
-                    raise serializers.ValidationError("Quantity must be greater than 0")
-                
-                item = inventory.objects.get(id=item_id)
-                if item.quantity < quantity:
-                    raise serializers.ValidationError(f"Insufficient stock for {item.name}")
-                    
-            except (ValueError, inventory.DoesNotExist):
+            except ValueError:
                 raise serializers.ValidationError(f"Invalid item_id: {item_data.get('item_id')}")
+            
+            if quantity <= 0:
+                raise serializers.ValidationError("Quantity must be greater than 0")
         return value
-    
\ No newline at end of file
+
+class CreateOrderSerializer(OrderLinesSerializer):
+    """Either ``items`` or the ``reservation`` token from /orders/reserve/"""
+    items = serializers.ListField(
+        child=serializers.DictField(
+            child=serializers.CharField()
+        ),
+        required=False
+    )
+    reservation = serializers.UUIDField(required=False)
+    shipping_address = serializers.CharField(max_length=500)
+    phone_number = serializers.CharField(max_length=15)
+    special_instructions = serializers.CharField(max_length=500, required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if 'items' not in attrs and 'reservation' not in attrs:
+            raise serializers.ValidationError({'items': ["At least one item is required"]})
+        return attrs
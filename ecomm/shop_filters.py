@@ -0,0 +1,92 @@
+"""
+Price and stock range filters of shop/list.
+
+    ?min_price=10&max_price=24.99   price between the bounds, both included
+    ?min_quantity=5&max_quantity=50 available stock (quantity minus reserved
+                                    units, like shop/item's ``quantity``)
+    ?in_stock=1 | in_stock=0        available stock above zero, or zero
+
+Any of them combine with each other and with ``category`` and ``search``.
+The database answers them with the (category, price) index. The catalog
+snapshot (ecomm.snapshot) bisects its per-category price index to the
+price range and checks the stock bounds row by row.
+"""
+from collections import namedtuple
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal, InvalidOperation
+
+from django.db.models import F
+
+FILTERS = ('min_price', 'max_price', 'min_quantity', 'max_quantity', 'in_stock')
+CENT = Decimal('0.01')
+# above every price inventory.price (max_digits=10, decimal_places=2) can hold
+PRICE_CEILING = Decimal(10 ** 8)
+# above every stock level inventory.quantity can hold, and far from the database's integer limits
+QUANTITY_CEILING = 2 ** 31
+
+
+class FilterError(ValueError):
+    """Raised for a malformed filter value"""
+
+
+# None for an unbounded side
+RangeFilters = namedtuple('RangeFilters', 'min_price max_price min_quantity max_quantity', defaults=(None,) * 4)
+
+
+def price_cents(filters):
+    """``(low, high)`` price bounds of ``filters`` in whole cents, None when unbounded"""
+    low = None if filters.min_price is None else int(filters.min_price.quantize(CENT, ROUND_CEILING) * 100)
+    high = None if filters.max_price is None else int(filters.max_price.quantize(CENT, ROUND_FLOOR) * 100)
+    return low, high
+
+
+def _price(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise FilterError(f'{name} must be a number') from None
+    if not price.is_finite() or price < 0:
+        raise FilterError(f'{name} must be a non-negative number')
+    return min(price, PRICE_CEILING)
+
+
+def _quantity(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    # isdigit() alone accepts digits int() refuses, such as '²'
+    if not (value.isascii() and value.isdigit()):
+        raise FilterError(f'{name} must be a non-negative integer')
+    return min(int(value), QUANTITY_CEILING)
+
+
+def parse_filters(params):
+    """The RangeFilters of the query ``params``, None when there are none. Raises FilterError."""
+    min_quantity, max_quantity = _quantity(params, 'min_quantity'), _quantity(params, 'max_quantity')
+    in_stock = params.get('in_stock')
+    if in_stock in ('1', 'true'):
+        min_quantity = max(min_quantity or 0, 1)
+    elif in_stock in ('0', 'false'):
+        max_quantity = 0 if max_quantity is None else min(max_quantity, 0)
+    elif in_stock:
+        raise FilterError('in_stock must be 1 or 0')
+    filters = RangeFilters(_price(params, 'min_price'), _price(params, 'max_price'), min_quantity, max_quantity)
+    return filters if filters != RangeFilters() else None
+
+
+def filter_queryset(queryset, filters):
+    """``queryset`` of products restricted to ``filters``"""
+    if filters is None:
+        return queryset
+    if filters.min_price is not None:
+        queryset = queryset.filter(price__gte=filters.min_price)
+    if filters.max_price is not None:
+        queryset = queryset.filter(price__lte=filters.max_price)
+    # available stock is max(quantity - reserved_quantity, 0)
+    if filters.min_quantity:
+        queryset = queryset.filter(quantity__gte=F('reserved_quantity') + filters.min_quantity)
+    if filters.max_quantity is not None:
+        queryset = queryset.filter(quantity__lte=F('reserved_quantity') + filters.max_quantity)
+    return queryset
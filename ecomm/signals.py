@@ -0,0 +1,30 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import get_user_cache
+from .catalog_cache import bump_catalog_version
+from .models import Category, inventory, Order, User
+from .rollups import record_order_change
+
+
+@receiver([post_save, post_delete], sender=inventory)
+def product_changed(sender, instance, **kwargs):
+    bump_catalog_version([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Category)
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # role or is_active may have changed, see ecomm.authentication
+    get_user_cache().evict(instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # also sent for queryset deletes and cascades (e.g. deleting the user),
+    # inside the deleting transaction
+    record_order_change((instance.created_at, instance.status, instance.total_amount), None)
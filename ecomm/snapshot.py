@@ -0,0 +1,531 @@
+"""
+In-memory catalog snapshot for shop/list and shop/item.
+
+Shop reads far outnumber inventory writes, so every worker keeps the whole
+catalog in memory. It serves those two endpoints without the ORM or the
+serializers. A ``CatalogSnapshot`` is immutable and stored by column:
+
+- ids, category ids, prices (in cents), available stock and creation times
+  (in microseconds) are ``array('q')`` columns,
+- names and descriptions are tuples,
+- every sort key (price, created_at, name) has an ``array('I')`` of row
+  positions in ``(key, id)`` order, for the whole catalog and for each
+  category.
+
+Rows are stored in id order, so looking up an id is a bisect. A page is a
+bisect to the cursor followed by a slice of the sort index. The cursors are
+the same as ecomm.pagination's, so a client can page through the snapshot
+and the database interchangeably.
+
+A snapshot is tagged with the catalog version it was built at (see
+ecomm.catalog_cache). Every write to the inventory changes that version in
+the database, so every worker process sees it. ``get_snapshot`` compares
+the tag with the version the thread last read, at most ``POLL_SECONDS``
+old. When they differ, one thread builds the new snapshot and swaps it in
+with a single assignment; meanwhile other threads read the database.
+``settings.ECOMM_CATALOG_SNAPSHOT`` configures it:
+
+    ECOMM_CATALOG_SNAPSHOT = {'ENABLED': True, 'MIN_REBUILD_SECONDS': 5.0}
+
+``MIN_REBUILD_SECONDS`` bounds the rebuilds while orders keep changing stock;
+reads within that time of the last build go to the database.
+
+Writes log the products they changed (see ecomm.catalog_cache). When every
+change since the snapshot was built is logged, the new snapshot is a patch
+of the old one. Changes that had not committed when it was built are read
+again with the newer ones. The patch reads only the changed rows and moves their positions in
+the sort indexes with a bisect each. Deleted products, category changes and
+bulk writes rebuild it in full.
+
+The price and stock filters of shop/list (ecomm.shop_filters) bisect the
+price index of the category to the price range. Ordered by price, that
+range is the page; otherwise the sort index is scanned for matching rows,
+or the range is sorted when it is small. Full-text searches and streamed
+lists always read the database. The facet counts of shop/list
+(ecomm.facets) are totalled once per build.
+"""
+import copy
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import islice
+from math import log2
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .catalog_cache import acatalog_state, catalog_changes, catalog_pending, catalog_state
+from .facets import price_bounds, price_bucket
+from .fastpath import datetime_str
+from .pagination import decode_cursor, encode_cursor, parse_limit
+from .shop_filters import parse_filters, price_cents
+
+# shop/list orderings, besides search_rank for searches
+ORDERINGS = ('price', '-price', 'created_at', '-created_at', 'name', '-name')
+DEFAULT_ORDERING = '-created_at'
+
+PRODUCT_COLUMNS = ('id', 'name', 'description', 'category_id', 'price', 'quantity', 'reserved_quantity', 'created_at')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+NO_ROWS = array('I')
+# more changed products than this rebuild the snapshot instead of patching it
+MAX_PATCHED_ROWS = 10_000
+# relative cost of a sort key call and of a scanned row, in tuple comparisons
+SORT_COST, SCAN_COST = 8, 4
+
+
+def _cents_str(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def _moment(microseconds):
+    return EPOCH + timedelta(microseconds=microseconds)
+
+
+class CatalogSnapshot:
+    """Immutable column store of every product and category, see the module docstring"""
+
+    def __init__(self, version, products, categories, sequence=0, pending=frozenset()):
+        """
+        ``products`` are PRODUCT_COLUMNS tuples in id order, ``categories``
+        ``(id, name)`` tuples, ``sequence`` the last catalog change they
+        include, ``pending`` the earlier changes they may not include
+        """
+        self.version, self.sequence, self.pending = version, sequence, pending
+        ids, category_ids, prices, available, created = (array('q') for _ in range(5))
+        names, descriptions = [], []
+        for id, name, description, category_id, price, quantity, reserved, created_at in products:
+            ids.append(id)
+            names.append(name)
+            descriptions.append(description)
+            category_ids.append(category_id)
+            prices.append(int(price * 100))
+            available.append(max(quantity - reserved, 0))
+            created.append((created_at - EPOCH) // MICROSECOND)
+        self.ids, self.category_ids, self.prices, self.available, self.created = (
+            ids, category_ids, prices, available, created)
+        self.names, self.descriptions = tuple(names), tuple(descriptions)
+        self.categories = dict(categories)
+        self.category_names = {name.lower(): id for id, name in self.categories.items()}
+
+        # facet counts per (category_id, price bucket, in stock)
+        self.price_buckets = [int(bound * 100) for bound in price_bounds()]
+        self.facets = Counter(
+            (category_id, price_bucket(price, self.price_buckets), stock > 0)
+            for category_id, price, stock in zip(category_ids, prices, available)
+        )
+
+        # sorted() is stable and the rows are in id order, so ties stay in id order
+        self.columns = {'price': prices, 'created_at': created, 'name': self.names}
+        self.sort_index = {
+            key: array('I', sorted(range(len(ids)), key=column.__getitem__))
+            for key, column in self.columns.items()
+        }
+        in_category = {}
+        for position, category_id in enumerate(category_ids):
+            in_category.setdefault(category_id, array('I')).append(position)
+        self.category_sort_index = {
+            category_id: {
+                key: array('I', sorted(positions, key=column.__getitem__))
+                for key, column in self.columns.items()
+            }
+            for category_id, positions in in_category.items()
+        }
+
+    @classmethod
+    def build(cls, version, sequence=0, using=DEFAULT_DB_ALIAS):
+        """
+        Snapshot of the catalog in the database ``using``, always the primary
+        by default. ``sequence`` is the change ``version`` was read at: read
+        before the rows, changes logged later may or may not be in them.
+        """
+        from .models import Category, inventory
+        # before the rows, so a change committed meanwhile is read again by the next patch
+        pending = catalog_pending(sequence)
+        products = (inventory.objects.using(using).order_by('id')
+                    .values_list(*PRODUCT_COLUMNS).iterator(chunk_size=5000))
+        categories = Category.objects.using(using).values_list('id', 'name')
+        return cls(version, products, categories, sequence, pending)
+
+    def patched(self, version, sequence, product_ids, pending=frozenset(), using=DEFAULT_DB_ALIAS):
+        """
+        Copy of this snapshot with the rows of ``product_ids`` read again,
+        None when it has to be rebuilt in full. ``pending`` are the changes
+        up to ``sequence`` that are not committed yet.
+        """
+        from .models import inventory
+        if len(product_ids) > MAX_PATCHED_ROWS:
+            return None
+        rows = {row[0]: row for row in inventory.objects.using(using).filter(id__in=product_ids)
+                .order_by().values_list(*PRODUCT_COLUMNS)}
+        changed, added = [], []
+        for product_id in product_ids:
+            position = self._position(product_id)
+            row = rows.get(product_id)
+            if row is not None and row[3] not in self.categories:
+                return None
+            if position is not None:
+                if row is None:
+                    # deleted, later positions would shift
+                    return None
+                changed.append((position, row))
+            elif row is not None:
+                if self.ids and product_id < self.ids[-1]:
+                    return None
+                added.append(row)
+
+        # the old snapshot may still be read, everything changed is copied first;
+        # slicing copies an array with one memcpy
+        snapshot = copy.copy(self)
+        snapshot.version, snapshot.sequence, snapshot.pending = version, sequence, pending
+        snapshot.ids, snapshot.category_ids, snapshot.prices, snapshot.available, snapshot.created = (
+            column[:] for column in (self.ids, self.category_ids, self.prices, self.available, self.created))
+        snapshot.columns = {'price': snapshot.prices, 'created_at': snapshot.created, 'name': self.names}
+        snapshot.sort_index = dict(self.sort_index)
+        snapshot.category_sort_index = dict(self.category_sort_index)
+        snapshot.facets = Counter(self.facets)
+        copied_keys, copied_categories = set(), set()
+
+        def index(category_id, key):
+            if category_id is None:
+                if key not in copied_keys:
+                    snapshot.sort_index[key] = self.sort_index[key][:]
+                    copied_keys.add(key)
+                return snapshot.sort_index[key]
+            if category_id not in copied_categories:
+                indexes = self.category_sort_index.get(category_id, {})
+                snapshot.category_sort_index[category_id] = {
+                    key: indexes.get(key, NO_ROWS)[:] for key in snapshot.columns
+                }
+                copied_categories.add(category_id)
+            return snapshot.category_sort_index[category_id][key]
+
+        def place(position, keys, remove):
+            category_id, ids = snapshot.category_ids[position], snapshot.ids
+            for key in keys:
+                column = snapshot.columns[key]
+                for positions in (index(None, key), index(category_id, key)):
+                    at = bisect_left(positions, (column[position], ids[position]),
+                                     key=lambda p: (column[p], ids[p]))
+                    if remove:
+                        del positions[at]
+                    else:
+                        positions.insert(at, position)
+            snapshot.facets[category_id, price_bucket(snapshot.prices[position], self.price_buckets),
+                            snapshot.available[position] > 0] += -1 if remove else 1
+
+        def store(position, row):
+            _, _, _, category_id, price, quantity, reserved, created_at = row
+            snapshot.category_ids[position] = category_id
+            snapshot.prices[position] = int(price * 100)
+            snapshot.available[position] = max(quantity - reserved, 0)
+            snapshot.created[position] = (created_at - EPOCH) // MICROSECOND
+
+        # names and descriptions are copied only when one changes, stock and price updates are the usual patch
+        names, descriptions = self.names, self.descriptions
+        for position, row in changed:
+            category_id, price, created_at, name = row[3], int(row[4] * 100), row[7], row[1]
+            values = {'price': price, 'created_at': (created_at - EPOCH) // MICROSECOND, 'name': name}
+            moved = category_id != snapshot.category_ids[position]
+            keys = [key for key, value in values.items() if moved or snapshot.columns[key][position] != value]
+            place(position, keys, remove=True)
+            store(position, row)
+            if name != names[position] or row[2] != descriptions[position]:
+                if names is self.names:
+                    names, descriptions = list(names), list(descriptions)
+                    snapshot.columns['name'] = names
+                names[position], descriptions[position] = name, row[2]
+            place(position, keys, remove=False)
+
+        if names is not self.names:
+            names, descriptions = tuple(names), tuple(descriptions)
+        added.sort()
+        if added:
+            names += tuple(row[1] for row in added)
+            descriptions += tuple(row[2] for row in added)
+        snapshot.names, snapshot.descriptions = names, descriptions
+        snapshot.columns['name'] = names
+        for row in added:
+            # new ids are the highest, appended rows stay in id order
+            position = len(snapshot.ids)
+            snapshot.ids.append(row[0])
+            for column in (snapshot.category_ids, snapshot.prices, snapshot.available, snapshot.created):
+                column.append(0)
+            store(position, row)
+            place(position, snapshot.columns, remove=False)
+
+        snapshot.facets = +snapshot.facets
+        return snapshot
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _position(self, product_id):
+        position = bisect_left(self.ids, product_id)
+        if position < len(self.ids) and self.ids[position] == product_id:
+            return position
+        return None
+
+    def item(self, product_id, fields=None):
+        """ItemSerializer data of a product, or its ``fields``; None when there is no such product"""
+        position = self._position(product_id)
+        if position is None:
+            return None
+        available = self.available[position]
+        row = {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'description': self.descriptions[position],
+            'category': self.category_ids[position],
+            'price': _cents_str(self.prices[position]),
+            'quantity': available,
+            'in_stock': available > 0,
+            'created_at': datetime_str(_moment(self.created[position])),
+        }
+        return row if fields is None else {name: row[name] for name in fields}
+
+    def _list_row(self, position, fields):
+        row = {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'category': self.category_ids[position],
+            'price': _cents_str(self.prices[position]),
+        }
+        return row if fields is None else {name: row[name] for name in fields}
+
+    def _key(self, key, value):
+        """A cursor's value in the units of the ``key`` column"""
+        if key == 'price':
+            return int(Decimal(value) * 100)
+        if key == 'created_at':
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            return (value - EPOCH) // MICROSECOND
+        return value
+
+    def _cursor(self, ordering, key, position):
+        value = self.columns[key][position]
+        if key == 'price':
+            value = Decimal(value).scaleb(-2)
+        elif key == 'created_at':
+            value = _moment(value)
+        return encode_cursor(ordering, {'id': self.ids[position], key: value})
+
+    def _category(self, category):
+        """The category id of shop/list's ``category`` parameter, None when there is no such category"""
+        if category.isascii() and category.isdigit():
+            return int(category)
+        return self.category_names.get(category.lower())
+
+    def facet_counts(self, params):
+        """ecomm.facets.count_facets() of the products matching shop/list's ``params``"""
+        category = params.get('category')
+        category_id = self._category(category) if category else None
+        filters = parse_filters(params)
+        if category and category_id is None:
+            return Counter(), self.categories
+        if filters is not None:
+            # counted over the price range
+            index = self._index(category_id, 'price')
+            start, end = self._price_range(index, filters)
+            accept = self._accepts(filters, check_price=False)
+            positions = map(index.__getitem__, range(start, end))
+            counts = Counter(
+                (self.category_ids[position], price_bucket(self.prices[position], self.price_buckets),
+                 self.available[position] > 0)
+                for position in (positions if accept is None else filter(accept, positions))
+            )
+            return counts, self.categories
+        if category_id is None:
+            return self.facets, self.categories
+        counts = Counter({key: count for key, count in self.facets.items() if key[0] == category_id})
+        return counts, self.categories
+
+    def _index(self, category, key):
+        if category is None:
+            return self.sort_index[key]
+        return self.category_sort_index.get(category, {}).get(key, NO_ROWS)
+
+    def _price_range(self, index, filters):
+        """``(start, end)`` of the rows of the price sort ``index`` in the price range of ``filters``"""
+        low, high = price_cents(filters)
+        start = 0 if low is None else bisect_left(index, low, key=self.prices.__getitem__)
+        end = len(index) if high is None else bisect_right(index, high, key=self.prices.__getitem__)
+        return start, max(start, end)
+
+    def _accepts(self, filters, check_price):
+        """
+        Row check of the stock bounds of ``filters``, and of its price range
+        when ``check_price``; None when there is nothing to check
+        """
+        prices, available = self.prices, self.available
+        low, high = price_cents(filters) if check_price else (None, None)
+        check_price = low is not None or high is not None
+        check_stock = filters.min_quantity is not None or filters.max_quantity is not None
+        low = -1 if low is None else low
+        high = float('inf') if high is None else high
+        fewest = -1 if filters.min_quantity is None else filters.min_quantity
+        most = float('inf') if filters.max_quantity is None else filters.max_quantity
+        if check_price and check_stock:
+            return lambda position: low <= prices[position] <= high and fewest <= available[position] <= most
+        if check_price:
+            return lambda position: low <= prices[position] <= high
+        if check_stock:
+            return lambda position: fewest <= available[position] <= most
+        return None
+
+    def page(self, ordering, category=None, cursor=None, limit=50, filters=None):
+        """
+        ``(positions, next_cursor)`` of one page, like ecomm.pagination.paginate,
+        of the rows matching ``filters`` (ecomm.shop_filters.RangeFilters).
+        Raises PaginationError for a malformed cursor.
+        """
+        from .models import inventory
+        key, descending = ordering.lstrip('-'), ordering.startswith('-')
+        index = self._index(category, key)
+        column, ids = self.columns[key], self.ids
+
+        def sort_key(position):
+            return column[position], ids[position]
+
+        lo, hi, accept = 0, len(index), None
+        if filters is not None:
+            price_index = self._index(category, 'price')
+            price_lo, price_hi = self._price_range(price_index, filters)
+            matches = price_hi - price_lo
+            if key == 'price':
+                lo, hi = price_lo, price_hi
+                accept = self._accepts(filters, check_price=False)
+            elif matches * (SORT_COST + log2(matches + 2)) < SCAN_COST * (limit + 1) * len(index) / max(matches, 1):
+                # few rows in the price range: sorting them beats scanning the sort index for them
+                index = array('I', sorted(price_index[price_lo:price_hi], key=sort_key))
+                lo, hi = 0, len(index)
+                accept = self._accepts(filters, check_price=False)
+            else:
+                accept = self._accepts(filters, check_price=True)
+
+        if cursor:
+            value, last_id = decode_cursor(cursor, ordering, inventory)
+            after = (self._key(key, value), last_id)
+        if descending:
+            end = bisect_left(index, after, lo, hi, key=sort_key) if cursor else hi
+            if accept is None:
+                positions = index[max(end - limit - 1, lo):end][::-1]
+            else:
+                positions = array('I', islice(filter(accept, map(index.__getitem__, range(end - 1, lo - 1, -1))),
+                                              limit + 1))
+        else:
+            start = bisect_right(index, after, lo, hi, key=sort_key) if cursor else lo
+            if accept is None:
+                positions = index[start:min(start + limit + 1, hi)]
+            else:
+                positions = array('I', islice(filter(accept, map(index.__getitem__, range(start, hi))), limit + 1))
+        next_cursor = None
+        if len(positions) > limit:
+            positions = positions[:limit]
+            next_cursor = self._cursor(ordering, key, positions[-1])
+        return positions, next_cursor
+
+    def shop_list(self, params, ordering, fields=None):
+        """
+        shop/list response data for the query ``params`` sorted by ``ordering``,
+        rows trimmed to ``fields``. Raises PaginationError and FilterError.
+        """
+        limit = parse_limit(params.get('limit'))
+        category = params.get('category')
+        category_id = self._category(category) if category else None
+        if category and category_id is None:
+            positions, next_cursor = NO_ROWS, None
+        else:
+            positions, next_cursor = self.page(ordering, category_id, params.get('cursor'), limit,
+                                               parse_filters(params))
+        return {
+            'results': [self._list_row(position, fields) for position in positions],
+            'next_cursor': next_cursor,
+            'limit': limit,
+        }
+
+
+_current = None
+_built_at = float('-inf')
+_lock = threading.Lock()
+
+
+def _config():
+    return getattr(settings, 'ECOMM_CATALOG_SNAPSHOT', {})
+
+
+def _rebuild(sequence, version):
+    global _current, _built_at
+    if time.monotonic() - _built_at < _config().get('MIN_REBUILD_SECONDS', 0):
+        return None
+    if not _lock.acquire(blocking=False):
+        # another thread is building it
+        return None
+    try:
+        if _current is None or _current.version != version:
+            snapshot = None
+            if _current is not None:
+                changes = catalog_changes(_current.sequence, _current.pending, sequence)
+                if changes is not None:
+                    product_ids, pending = changes
+                    snapshot = _current.patched(version, sequence, sorted(product_ids), pending)
+            if snapshot is None:
+                snapshot = CatalogSnapshot.build(version, sequence)
+            _current, _built_at = snapshot, time.monotonic()
+        return _current
+    finally:
+        _lock.release()
+
+
+def get_snapshot():
+    """The snapshot of the current catalog version, None when the database has to answer"""
+    if not _config().get('ENABLED', False):
+        return None
+    sequence, version = catalog_state()
+    snapshot = _current
+    if snapshot is not None and snapshot.sequence > sequence:
+        # built by a thread that read the version after this one did
+        sequence, version = catalog_state(refresh=True)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    return _rebuild(sequence, version)
+
+
+async def aget_snapshot():
+    """Async version of get_snapshot(), the build runs in a thread"""
+    if not _config().get('ENABLED', False):
+        return None
+    sequence, version = await acatalog_state()
+    snapshot = _current
+    if snapshot is not None and snapshot.sequence > sequence:
+        sequence, version = await acatalog_state(refresh=True)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    return await sync_to_async(_rebuild)(sequence, version)
+
+
+def serves_list(params):
+    """Whether a shop/list request can be answered from the snapshot"""
+    return not params.get('search') and not params.get('stream')
+
+
+def reset_snapshot():
+    """Drop this worker's snapshot, the next read builds a new one"""
+    global _current, _built_at
+    with _lock:
+        _current, _built_at = None, float('-inf')
+
+
+@receiver(setting_changed)
+def _reset_snapshot(setting, **kwargs):
+    if setting in ('ECOMM_CATALOG_SNAPSHOT', 'ECOMM_PRICE_BUCKETS'):
+        reset_snapshot()
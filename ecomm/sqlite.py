@@ -0,0 +1,112 @@
+"""
+SQLite connection profiles for ``settings.DATABASES``.
+
+``database_settings`` builds a DATABASES entry whose connections run the
+profile's PRAGMAs when they open (Django's ``init_command``). Connections are
+kept for ``CONN_MAX_AGE`` seconds instead of being reopened per request, and
+write transactions start with ``BEGIN IMMEDIATE``. With IMMEDIATE a writer
+takes the write lock up front and waits up to ``busy_timeout`` for it. Under
+the default DEFERRED mode, a transaction that reads first and then tries to
+write fails at once with "database is locked".
+
+    'production'  WAL, synchronous=NORMAL, busy_timeout, mmap, a 64 MB page
+                  cache, temp tables in memory, persistent connections
+    'django'      Django's own defaults: rollback journal, one connection per
+                  request, deferred transactions
+
+Environment variables override the profile when the settings load:
+
+    ECOMM_SQLITE_PROFILE=django
+    ECOMM_SQLITE_PRAGMAS="synchronous=FULL,mmap_size=0"
+    ECOMM_SQLITE_CONN_MAX_AGE=60
+    ECOMM_SQLITE_TRANSACTION_MODE=DEFERRED
+
+WAL mode is stored in the database file, so it stays on after a switch back
+to the 'django' profile until ``PRAGMA journal_mode=DELETE`` is run.
+"""
+import os
+
+PROFILES = {
+    'production': {
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            # WAL makes NORMAL safe against corruption; only the last
+            # transactions before a power loss can be lost
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,  # ms
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,  # negative: KiB
+            'temp_store': 'MEMORY',
+        },
+        'CONN_MAX_AGE': 600,
+        'TRANSACTION_MODE': 'IMMEDIATE',
+    },
+    'django': {
+        'PRAGMAS': {},
+        'CONN_MAX_AGE': 0,
+        'TRANSACTION_MODE': None,
+    },
+}
+
+
+def parse_pragmas(value):
+    """``"a=1,b=WAL"`` -> ``{'a': '1', 'b': 'WAL'}``"""
+    pragmas = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, sep, setting = item.partition('=')
+        if not sep or not name.strip() or not setting.strip():
+            raise ValueError(f'Invalid SQLite pragma {item!r}, expected name=value')
+        pragmas[name.strip()] = setting.strip()
+    return pragmas
+
+
+def init_command(pragmas):
+    return ';'.join(f'PRAGMA {name}={value}' for name, value in pragmas.items())
+
+
+def database_settings(name, profile=None, environ=os.environ, **overrides):
+    """
+    DATABASES entry for the SQLite file ``name``.
+
+    ``profile`` defaults to ``$ECOMM_SQLITE_PROFILE`` or 'production';
+    ``overrides`` (PRAGMAS, CONN_MAX_AGE, TRANSACTION_MODE) take precedence
+    over the profile, the environment over both.
+    """
+    profile = profile or environ.get('ECOMM_SQLITE_PROFILE', 'production')
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown SQLite profile {profile!r}, expected one of {", ".join(PROFILES)}')
+    config = {**PROFILES[profile], **overrides}
+    pragmas = {**config['PRAGMAS'], **parse_pragmas(environ.get('ECOMM_SQLITE_PRAGMAS', ''))}
+    conn_max_age = int(environ.get('ECOMM_SQLITE_CONN_MAX_AGE', config['CONN_MAX_AGE']))
+    transaction_mode = environ.get('ECOMM_SQLITE_TRANSACTION_MODE', config['TRANSACTION_MODE']) or None
+
+    options = {}
+    if pragmas:
+        options['init_command'] = init_command(pragmas)
+    if 'busy_timeout' in pragmas:
+        # sqlite3.connect() installs its own busy handler, keep both the same
+        options['timeout'] = int(pragmas['busy_timeout']) / 1000
+    if transaction_mode:
+        options['transaction_mode'] = transaction_mode
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'OPTIONS': options,
+        'CONN_MAX_AGE': conn_max_age,
+        # a kept connection is checked before reuse instead of failing the request
+        'CONN_HEALTH_CHECKS': conn_max_age != 0,
+    }
+
+
+def copy_database(source, target):
+    """
+    Copy the database of the Django connection ``source`` into ``target``
+    with SQLite's online backup API.
+
+    Connections that read ``target`` meanwhile wait for the copy, up to their
+    busy timeout, and never see a half-copied file. With WAL the primary
+    keeps taking writes during the copy.
+    """
+    source.ensure_connection()
+    target.ensure_connection()
+    source.connection.backup(target.connection)
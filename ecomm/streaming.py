@@ -0,0 +1,86 @@
+"""
+Helpers for streamed (constant-memory) JSON responses.
+"""
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+
+from .fastpath import FastJSONRenderer
+
+STREAM_CHUNK_SIZE = 500
+
+_renderer = FastJSONRenderer()
+
+
+def dumps(data):
+    return _renderer.render(data)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(row) + b'\n'
+
+
+async def andjson_lines(rows):
+    async for row in rows:
+        yield dumps(row) + b'\n'
+
+
+def ndjson_response(rows, status=200):
+    """Stream ``rows`` (an iterable or async iterable of dicts) as newline-delimited JSON"""
+    return StreamingHttpResponse(
+        andjson_lines(rows) if hasattr(rows, '__aiter__') else ndjson_lines(rows),
+        status=status,
+        content_type='application/x-ndjson',
+    )
+
+
+def json_list_body(head, key, rows):
+    """
+    Yield ``{**head, key: [*rows], "count": n}`` piece by piece.
+
+    The count is only known once every row has been sent, so it comes last.
+    """
+    opening = dumps(head)[:-1]
+    yield opening + (b',' if head else b'') + dumps(key) + b':['
+    count = 0
+    for row in rows:
+        yield (b',' if count else b'') + dumps(row)
+        count += 1
+    yield b'],"count":' + str(count).encode() + b'}'
+
+
+def json_list_response(head, key, rows, status=200):
+    return StreamingHttpResponse(
+        json_list_body(head, key, rows),
+        status=status,
+        content_type='application/json',
+    )
+
+
+def serialize_iter(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+    """
+    Iterate ``queryset`` in chunks and yield one serialized dict per row.
+
+    A single serializer instance is reused for every row so fields are only
+    built once. Prefetches on ``queryset`` run once per chunk.
+    """
+    serializer = serializer_class(**kwargs)
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        yield serializer.to_representation(obj)
+
+
+async def aserialize_iter(queryset, serializer_class, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+    """Async version of serialize_iter()"""
+    serializer = serializer_class(**kwargs)
+    async for obj in queryset.aiterator(chunk_size=chunk_size):
+        yield serializer.to_representation(obj)
@@ -0,0 +1,31 @@
+"""
+Handlers of the background jobs (ecomm.jobs) the views queue.
+
+Jobs can run more than once, every handler must be safe to repeat.
+"""
+import logging
+
+from django.conf import settings
+
+from .jobs import handler
+from .models import Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+@handler('order-placed')
+def order_placed(order_id):
+    """Log a new order and warn about the products it left low on stock"""
+    order = Order.objects.filter(id=order_id).values_list('user__username', 'total_amount').first()
+    if order is None:
+        # deleted since
+        return
+    username, total_amount = order
+    lines = list(OrderItem.objects.filter(order_id=order_id).values_list(
+        'product_id', 'product__name', 'product__quantity', 'product__reserved_quantity'))
+    logger.info('Order %s placed by %s: %s lines, total %s', order_id, username, len(lines), total_amount)
+    threshold = getattr(settings, 'ECOMM_LOW_STOCK_THRESHOLD', 5)
+    for product_id, name, quantity, reserved in lines:
+        available = max(quantity - reserved, 0)
+        if available <= threshold:
+            logger.warning('Low stock: %s (#%s) has %s units left', name, product_id, available)
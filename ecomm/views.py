@@ -7,25 +7,49 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.http import HttpResponse
 from .models import User,inventory,Order,OrderItem,Category
-from .serializers import UserSignupSerializer, LoginSerializer, AdminLoginSerializer, UserSerializer,ProductCreateSerializer,ProductDetailSerializer,ProductListSerializer,ProductRestockSerializer,ProductUpdateSerializer,OrderItemSerializer,OrderSerializer,RevenueSerializer,CreateOrderSerializer,ItemSerializer,ItemListSerializer  
+from .serializers import UserSignupSerializer, LoginSerializer, AdminLoginSerializer, UserSerializer,ProductCreateSerializer,ProductDetailSerializer,ProductListSerializer,ProductRestockSerializer,BatchRestockSerializer,ProductUpdateSerializer,OrderItemSerializer,OrderSerializer,RevenueSerializer,CreateOrderSerializer,OrderLinesSerializer,ItemSerializer,ItemListSerializer,CartAddSerializer,CartUpdateSerializer,CartRemoveSerializer,CartCheckoutSerializer  
 import logging
 from django_filters.rest_framework import DjangoFilterBackend
 import django_filters
 from .permissions import IsShopkeeper
+from .search import get_search_backend
+from .checkout import CheckoutError, checkout_cart, normalize_lines, place_order
+from . import cart
+from .reservations import ReservationError, release, reserve
+from .stock import RestockError, normalize_restock, restock
+from .rollups import revenue_summary
+from .bulk_import import BulkImportError, import_inventory
+from . import jobs, metrics
+from .catalog_cache import cached_catalog_view
+from .pagination import PaginationError, keyset_filter, paginate, parse_limit
+from .streaming import STREAM_CHUNK_SIZE, chunked, json_list_response, ndjson_response, serialize_iter
+from .fastpath import (
+    FAST_RENDERERS, ITEM_FIELDS, ITEM_LIST_FIELDS, ORDER_FIELDS, PRODUCT_LIST_FIELDS,
+    fast_path_enabled, item_list_row, order_rows, order_summary_row, product_list_row,
+)
+from .facets import shop_facets, wants_facets
+from .fieldsets import FieldsetError
+from .shop_filters import FILTERS as RANGE_FILTERS, FilterError, filter_queryset, parse_filters
+from .snapshot import DEFAULT_ORDERING, ORDERINGS, get_snapshot, serves_list
 from django.utils import timezone
-from django.db.models import Sum, Q,Avg
+from django.utils.dateparse import parse_date, parse_datetime
+from django.db.models import Count, Prefetch, Q
 from django.db import transaction
 from datetime import datetime, timedelta
+from functools import partial
 from rest_framework.authentication import SessionAuthentication
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.decorators import authentication_classes
+from .authentication import ClaimsJWTAuthentication, add_user_claims
+from rest_framework.decorators import authentication_classes, renderer_classes
 
 logger = logging.getLogger(__name__)
+# high-volume read events, sampled by settings.LOGGING
+access_logger = logging.getLogger(f'{__name__}.access')
 
 def get_tokens_for_user(user):
     """Generate JWT tokens for user"""
-    refresh = RefreshToken.for_user(user)
+    refresh = add_user_claims(RefreshToken.for_user(user), user)
     return {
         'refresh': str(refresh),
         'access': str(refresh.access_token),
@@ -107,7 +131,7 @@ def admin_login(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
 def logout(request):
     """Logout endpoint - blacklist the refresh token"""
@@ -132,13 +156,15 @@ def logout(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
 def user_profile(request):
     """Get current user profile"""
     try:
+        # request.user may be built from token claims, the profile needs the full row
+        user = User.objects.get(pk=request.user.pk)
         return Response({
-            'user': UserSerializer(request.user).data
+            'user': UserSerializer(user).data
         }, status=status.HTTP_200_OK)
     
     except Exception as e:
@@ -148,35 +174,31 @@ def user_profile(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
-<<<<<<< HEAD
-=======
-@permission_classes([permissions.IsAuthenticated])
-def apiOverview(request):
-    api_urls={
-        'List':'task-list',
-        'Detail view': '/task-detail/<str:pk>/',
-        'create' : '/task-create/',
-        'Update':'/task-update/<str:pk>',
-        'Delete':'/task-delete/<str:pk>',
-    }
-    return Response(api_urls)
-
-
-@api_view(['GET'])
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@renderer_classes(FAST_RENDERERS)
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated,IsShopkeeper])
 def inventory_list(request):
+    """
+    GET /inventory/list - every product, fields/exclude pick the returned fields
+    """
     try:
+        try:
+            fields = PRODUCT_LIST_FIELDS.select(request.query_params)
+        except FieldsetError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         products = inventory.objects.select_related('category').all()
-        serializer = ProductListSerializer(products, many=True)
+        if fast_path_enabled('inventory_list'):
+            build = PRODUCT_LIST_FIELDS.builder(fields, product_list_row)
+            data = [build(row) for row in products.values(*PRODUCT_LIST_FIELDS.columns(fields))]
+        else:
+            data = ProductListSerializer(PRODUCT_LIST_FIELDS.only(products, fields), many=True, fields=fields).data
         
-        logger.info(f"Shopkeeper {request.user.username} accessed inventory list")
+        access_logger.info(f"Shopkeeper {request.user.username} accessed inventory list")
         
         return Response({
             'message': 'Inventory retrieved successfully',
-            'count': len(products),
-            'products': serializer.data
+            'count': len(data),
+            'products': data
         }, status=status.HTTP_200_OK)
     
     except Exception as e:
@@ -186,7 +208,7 @@ def inventory_list(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated,IsShopkeeper])
 def inventory_detail(request,pk):
     try:
@@ -201,7 +223,7 @@ def inventory_detail(request,pk):
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated,IsShopkeeper])
 def inventory_create(request):
     try:
@@ -209,25 +231,16 @@ def inventory_create(request):
         serializer = ProductCreateSerializer(data=request.data)
         
         if serializer.is_valid():
-<<<<<<< HEAD
-            print(" Serializer validation passed")
-=======
-            print("✅ Serializer validation passed")
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-            print(f"Validated data: {serializer.validated_data}")
+            # payloads only at DEBUG, formatted lazily so INFO does not pay for them
+            logger.debug("Validated product data: %s", serializer.validated_data)
             
             # Create the product
             try:
                 product = serializer.save()
-<<<<<<< HEAD
-                print(f" Product created with ID: {product.id}")
-=======
-                print(f"✅ Product created with ID: {product.id}")
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
                 
                 # Return success response
                 response_serializer = ProductListSerializer(product)
-                logger.info(f"Shopkeeper {request.user.username} created product: {product.name}")
+                logger.info(f"Shopkeeper {request.user.username} created product {product.id}: {product.name}")
                 
                 return Response({
                     'message': 'Product created successfully',
@@ -235,51 +248,25 @@ def inventory_create(request):
                 }, status=status.HTTP_201_CREATED)
                 
             except Exception as save_error:
-<<<<<<< HEAD
-                print(f" Error saving product: {save_error}")
-=======
-                print(f"❌ Error saving product: {save_error}")
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
+                logger.error(f"Error saving product: {save_error}", exc_info=True)
                 return Response({
                     'error': 'Failed to save product to database',
                     'details': str(save_error)
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         else:
-<<<<<<< HEAD
-            print(f" Serializer validation failed: {serializer.errors}")
-            
-            
-            
-    except Exception as e:
-        print(f" Unexpected error in create_item: {e}")
-=======
-            print(f"❌ Serializer validation failed: {serializer.errors}")
-            
-            # Return validation error response
+            logger.debug("Product validation failed: %s", serializer.errors)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
     except Exception as e:
-        print(f"❌ Unexpected error in create_item: {e}")
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
-        
         logger.error(f"Unexpected error in create_item: {str(e)}", exc_info=True)
-        
-<<<<<<< HEAD
-        
-=======
-        # ALWAYS return a response, even for unexpected errors
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
         return Response({
-            'error': 'Internal server error occurred',
-            'details': str(e),
-            'help': 'Check server logs for more details'
+            'error': 'Failed to create product'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated,IsShopkeeper])
 def inventory_update(request):
      try:
@@ -317,7 +304,45 @@ def inventory_update(request):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated, IsShopkeeper])
+def inventory_bulk_upsert(request):
+    """
+    POST /inventory/bulk/ (multipart)
+    file: CSV or JSONL upload, one product per row (see ecomm.bulk_import)
+    format: csv | jsonl, guessed from the file name when omitted
+    dry_run: validate only, nothing is written
+    """
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({
+            'error': 'file is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+    try:
+        report = import_inventory(upload, fmt=request.data.get('format'), dry_run=dry_run)
+    except BulkImportError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error importing inventory: {str(e)}", exc_info=True)
+        return Response({
+            'error': 'Failed to import inventory'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    logger.info(
+        f"Shopkeeper {request.user.username} imported inventory: "
+        f"{report.created} created, {report.updated} updated, {report.failed} failed"
+        + (" (dry run)" if dry_run else "")
+    )
+    return Response({
+        'message': 'Dry run completed' if dry_run else 'Inventory imported',
+        'dry_run': dry_run,
+        **report.as_dict(),
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated, IsShopkeeper])
 def restock_item(request):
     """
@@ -331,25 +356,22 @@ def restock_item(request):
             product_id = serializer.validated_data['product_id']
             quantity_to_add = serializer.validated_data['quantity']
             
-            product = inventory.objects.get(id=product_id)
-            old_quantity = product.quantity
-            product.quantity += quantity_to_add
-            product.last_restocked = timezone.now()
-            product.save()
+            new_quantity = restock({product_id: quantity_to_add})[product_id]
+            product = inventory.objects.select_related('category').get(id=product_id)
             
-            logger.info(f"Shopkeeper {request.user.username} restocked {product.name}: {old_quantity} -> {product.quantity}")
+            logger.info(f"Shopkeeper {request.user.username} restocked {product.name}: {new_quantity - quantity_to_add} -> {new_quantity}")
             
             response_serializer = ProductListSerializer(product)
             return Response({
                 'message': f'Product restocked successfully. Added {quantity_to_add} units.',
-                'previous_quantity': old_quantity,
-                'new_quantity': product.quantity,
+                'previous_quantity': new_quantity - quantity_to_add,
+                'new_quantity': new_quantity,
                 'product': response_serializer.data
             }, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    except inventory.DoesNotExist:
+    except (RestockError, inventory.DoesNotExist):
         return Response({
             'error': 'Product not found'
         }, status=status.HTTP_404_NOT_FOUND)
@@ -359,12 +381,60 @@ def restock_item(request):
             'error': 'Failed to restock product'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated, IsShopkeeper])
+def restock_batch(request):
+    """
+    POST /inventory/restock/batch/
+    Restock many products in one transaction
+    Expects: items: [{product_id, quantity}, ...]
+    """
+    serializer = BatchRestockSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    lines = normalize_restock(serializer.validated_data['items'])
+    try:
+        quantities = restock(lines)
+    except RestockError as e:
+        return Response({
+            'error': 'Products not found',
+            'missing': e.missing
+        }, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        logger.error(f"Error restocking products: {str(e)}")
+        return Response({
+            'error': 'Failed to restock products'
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    logger.info(f"Shopkeeper {request.user.username} restocked {len(lines)} products")
+    return Response({
+        'message': f'{len(lines)} products restocked successfully.',
+        'products': [
+            {'product_id': product_id, 'added': added, 'new_quantity': quantities[product_id]}
+            for product_id, added in lines.items()
+        ]
+    }, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated, IsShopkeeper])
 def view_orders(request):
+    """
+    GET /inventory/orders/
+    Streams every order as JSON ({message, orders, count}) or, with
+    stream=ndjson, one order per line. Orders are read in chunks so memory
+    stays flat whatever the table size.
+    Filters: status, user_id, created_after, created_before (ISO date/datetime)
+    fields/exclude pick the returned fields of each order.
+    """
     try:
-        orders = Order.objects.select_related('user').prefetch_related('items__product').all()
+        try:
+            fields = ORDER_FIELDS.select(request.query_params)
+        except FieldsetError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        orders = Order.objects.order_by('-created_at', '-id')
         
         # Apply filters
         status_filter = request.query_params.get('status')
@@ -375,15 +445,33 @@ def view_orders(request):
         if user_id_filter:
             orders = orders.filter(user_id=user_id_filter)
         
-        serializer = OrderSerializer(orders, many=True)
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            value = request.query_params.get(param)
+            if value:
+                moment = parse_moment(value)
+                if moment is None:
+                    return Response({
+                        'error': f'{param} must be an ISO date or datetime'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                orders = orders.filter(**{lookup: moment})
+        
+        if fast_path_enabled('view_orders'):
+            rows = (
+                row
+                for chunk in chunked(orders.values(*ORDER_FIELDS.columns(fields)).iterator(chunk_size=STREAM_CHUNK_SIZE),
+                                     STREAM_CHUNK_SIZE)
+                for row in order_rows(chunk, fields)
+            )
+        else:
+            rows = serialize_iter(
+                order_queryset(orders, fields), OrderSerializer, chunk_size=STREAM_CHUNK_SIZE, fields=fields,
+            )
         
-        logger.info(f"Shopkeeper {request.user.username} accessed orders list")
+        access_logger.info(f"Shopkeeper {request.user.username} accessed orders list")
         
-        return Response({
-            'message': 'Orders retrieved successfully',
-            'count': len(orders),
-            'orders': serializer.data
-        }, status=status.HTTP_200_OK)
+        if request.query_params.get('stream') == 'ndjson':
+            return ndjson_response(rows)
+        return json_list_response({'message': 'Orders retrieved successfully'}, 'orders', rows)
     
     except Exception as e:
         logger.error(f"Error retrieving orders: {str(e)}")
@@ -391,8 +479,23 @@ def view_orders(request):
             'error': 'Failed to retrieve orders'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def parse_moment(value):
+    """Parse an ISO datetime, or a date meaning midnight of that day"""
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day, datetime.min.time())
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated, IsShopkeeper])
 def revenue_stats(request):
     """
@@ -400,49 +503,12 @@ def revenue_stats(request):
     Display total revenue and statistics
     """
     try:
-        # Calculate various revenue metrics
-        all_orders = Order.objects.exclude(status='cancelled')
-        
-        # Total revenue (excluding cancelled orders)
-        total_revenue = all_orders.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0
-        
-        # Order counts
-        total_orders = all_orders.count()
-        pending_orders = all_orders.filter(status='pending').count()
-        completed_orders = all_orders.filter(status='delivered').count()
-        
-        # Average order value
-        avg_order_value = all_orders.aggregate(
-            avg=Avg('total_amount')
-        )['avg'] or 0
-        
-        # Revenue this month
-        current_month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        revenue_this_month = all_orders.filter(
-            created_at__gte=current_month_start
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        # Revenue this year
-        current_year_start = timezone.now().replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-        revenue_this_year = all_orders.filter(
-            created_at__gte=current_year_start
-        ).aggregate(total=Sum('total_amount'))['total'] or 0
-        
-        revenue_data = {
-            'total_revenue': total_revenue,
-            'total_orders': total_orders,
-            'pending_orders': pending_orders,
-            'completed_orders': completed_orders,
-            'average_order_value': round(avg_order_value, 2) if avg_order_value else 0,
-            'revenue_this_month': revenue_this_month,
-            'revenue_this_year': revenue_this_year
-        }
+        # read from the daily rollups, O(days) instead of O(orders)
+        revenue_data = revenue_summary()
         
         serializer = RevenueSerializer(revenue_data)
         
-        logger.info(f"Shopkeeper {request.user.username} accessed revenue stats")
+        access_logger.info(f"Shopkeeper {request.user.username} accessed revenue stats")
         
         return Response({
             'message': 'Revenue statistics retrieved successfully',
@@ -456,7 +522,7 @@ def revenue_stats(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsShopkeeper])
 def list_categories(request):
     """List all available categories"""
@@ -472,63 +538,193 @@ def list_categories(request):
         'count': len(categories_data)
     })
 
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsShopkeeper])
+def metrics_view(request):
+    """
+    GET /metrics/
+    Request counts, latency, SQL and serializer histograms, and the job queue
+    depth and lag, in the Prometheus text format
+    """
+    jobs.observe_queue()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 '''shop views'''
-@api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
-@permission_classes([IsAuthenticated])
-def shop_item_list(request):
-<<<<<<< HEAD
-    """GET /shop/list """
-    queryset = inventory.objects.filter()
-    
-=======
-    """GET /shop/list - Function-based version with manual filtering"""
-    queryset = inventory.objects.filter()
+def shop_item_queryset(params):
+    """
+    Filtered shop items for the shop/list query ``params``.
+
+    Returns ``(queryset, ordering, fast, fields)``; with the fast path the
+    queryset yields ``.values()`` rows for ``item_list_row``, ``fields`` are
+    the selected fields (None for all). Raises FieldsetError and FilterError.
+    Shared with ecomm.async_views.
+    """
+    fields = ITEM_LIST_FIELDS.select(params)
+    queryset = inventory.objects.all()
     
-    # Apply filters manually
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-    category = request.GET.get('category')
+    category = params.get('category')
     if category:
-        queryset = queryset.filter(category__iexact=category)
-    search = request.GET.get('search')
+        if category.isascii() and category.isdigit():
+            queryset = queryset.filter(category_id=category)
+        else:
+            queryset = queryset.filter(category__name__iexact=category)
+    queryset = filter_queryset(queryset, parse_filters(params))
+    search = params.get('search')
     if search:
-         name_matches = queryset.filter(name__icontains=search)
-         desc_matches = queryset.filter(description__icontains=search)
-         queryset = name_matches.union(desc_matches)
+        queryset = get_search_backend().filter(queryset, search)
     
-<<<<<<< HEAD
-    # ordering
-=======
-    # Apply ordering
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-    ordering = request.GET.get('ordering', '-created_at')
-    valid_orderings = ['price', '-price', 'created_at', '-created_at', 'name', '-name']
-    if ordering in valid_orderings:
-        queryset = queryset.order_by(ordering)
+    # ordering, search results default to most relevant first
+    ordering = params.get('ordering', 'search_rank' if search else DEFAULT_ORDERING)
+    valid_orderings = list(ORDERINGS)
+    if search:
+        valid_orderings.append('search_rank')
+    if ordering not in valid_orderings:
+        ordering = DEFAULT_ORDERING
+
+    # the ordering column is needed to build the next cursor
+    sort_column = ordering.lstrip('-')
+    fast = fast_path_enabled('shop-item-list')
+    if fast:
+        queryset = queryset.values(*ITEM_LIST_FIELDS.columns(fields, sort_column))
+    elif sort_column != 'search_rank':
+        queryset = ITEM_LIST_FIELDS.only(queryset, fields, sort_column)
     else:
-        queryset = queryset.order_by('-created_at')
+        # an annotation, always selected
+        queryset = ITEM_LIST_FIELDS.only(queryset, fields)
+    return queryset, ordering, fast, fields
+
+def category_names(categories, used_ids):
+    """Names of ``categories`` that have products"""
+    return [category.name for category in categories if category.id in used_ids]
+
+def user_orders(user):
+    """The orders of ``user``, newest first"""
+    return Order.objects.filter(user_id=user.pk).select_related('user').order_by('-created_at')
+
+def with_order_items(orders):
+    """``orders`` with their lines and the lines' products, in one extra query"""
+    return orders.prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id'))
+    )
+
+def order_queryset(orders, fields=None, *extra):
+    """
+    ``orders`` loading only ``fields`` and the ``extra`` columns, with the
+    user and the lines when those are returned
+    """
+    orders = ORDER_FIELDS.only(orders.select_related('user'), fields, *extra)
+    if fields is None or 'items' in fields:
+        orders = with_order_items(orders)
+    return orders
+
+def order_summaries(orders):
+    """id, status, total, creation time and number of lines of ``orders``, one query"""
+    return orders.select_related(None).annotate(item_count=Count('items')).values(
+        'id', 'status', 'total_amount', 'created_at', 'item_count'
+    )
 
-    ordering = request.GET.get('ordering', '-created_at')
-    queryset = queryset.order_by(ordering)
+def order_history(user, params):
+    """
+    ``(queryset, build)`` for a page of GET /orders/past: ``build`` turns the
+    page's rows into the response's orders with at most one more query.
+    Raises FieldsetError.
+    """
+    orders = user_orders(user)
+    if params.get('summary') in ('1', 'true'):
+        return order_summaries(orders), lambda rows: [order_summary_row(row) for row in rows]
+    fields = ORDER_FIELDS.select(params)
+    # created_at is needed to build the next cursor
+    if fast_path_enabled('order-list'):
+        return orders.values(*ORDER_FIELDS.columns(fields, 'created_at')), partial(order_rows, fields=fields)
+    return order_queryset(orders, fields, 'created_at'), lambda rows: OrderSerializer(rows, many=True, fields=fields).data
+
+@api_view(['GET'])
+@renderer_classes(FAST_RENDERERS)
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+@cached_catalog_view('shop-item-list',
+                     params=('category', 'search', 'ordering', 'cursor', 'limit', 'fields', 'exclude',
+                             'facets', *RANGE_FILTERS))
+def shop_item_list(request):
+    """
+    GET /shop/list - Cursor paginated shop items
+
+    Query params: category, search (full-text, prefix matching), ordering,
+    limit, cursor, fields/exclude, min_price/max_price, min_quantity/max_quantity
+    and in_stock (ecomm.shop_filters).
+    facets=1 adds the counts per category, price bucket and stock of every
+    matching product (ecomm.facets).
+    stream=1 streams every matching row (from cursor onwards) as NDJSON.
+    Served from the catalog snapshot (ecomm.snapshot) unless searching or
+    streaming.
+    """
+    try:
+        queryset, ordering, fast, fields = shop_item_queryset(request.GET)
+    except (FieldsetError, FilterError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    snapshot = get_snapshot() if serves_list(request.GET) else None
+    if snapshot is not None:
+        try:
+            data = snapshot.shop_list(request.GET, ordering, fields)
+        except PaginationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if wants_facets(request.GET):
+            data['facets'] = shop_facets(request.GET, queryset, snapshot)
+        return Response(data)
+    build = ITEM_LIST_FIELDS.builder(fields, item_list_row)
+
+    cursor = request.GET.get('cursor')
+    try:
+        if request.GET.get('stream'):
+            queryset = keyset_filter(queryset, ordering, cursor)
+            if request.GET.get('limit'):
+                queryset = queryset[:parse_limit(request.GET.get('limit'))]
+            if fast:
+                rows = map(build, queryset.iterator(chunk_size=STREAM_CHUNK_SIZE))
+            else:
+                rows = serialize_iter(queryset, ItemListSerializer, context={'request': request}, fields=fields)
+            return ndjson_response(rows)
+        limit = parse_limit(request.GET.get('limit'))
+        items, next_cursor = paginate(queryset, ordering, cursor, limit)
+    except PaginationError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = ItemListSerializer(queryset, many=True, context={'request': request})
-    return Response(serializer.data)
+    if fast:
+        results = [build(row) for row in items]
+    else:
+        results = ItemListSerializer(items, many=True, context={'request': request}, fields=fields).data
+    data = {
+        'results': results,
+        'next_cursor': next_cursor,
+        'limit': limit,
+    }
+    if wants_facets(request.GET):
+        data['facets'] = shop_facets(request.GET, queryset)
+    return Response(data)
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
+@cached_catalog_view('shop-item-detail', params=('fields', 'exclude'))
 def shop_item_detail(request, item_id):
     """
-<<<<<<< HEAD
     GET /shop/item/{id} - Detailed information about a specific item
-=======
-    GET /shop/item/{id} - Get detailed information about a specific item
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
     """
     try:
-        item = inventory.objects.get(id=item_id)
-        serializer = ItemSerializer(item, context={'request': request})
+        fields = ITEM_FIELDS.select(request.GET)
+    except FieldsetError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        data = snapshot.item(item_id, fields)
+        if data is None:
+            return Response({'error': 'Item not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
+    try:
+        item = ITEM_FIELDS.only(inventory.objects.all(), fields).get(id=item_id)
+        serializer = ItemSerializer(item, context={'request': request}, fields=fields)
         return Response(serializer.data)
     except inventory.DoesNotExist:
         return Response(
@@ -537,62 +733,43 @@ def shop_item_detail(request, item_id):
         )
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
+@cached_catalog_view('shop-categories')
 def shop_categories(request):
     """
-<<<<<<< HEAD
     GET /shop/categories - List of all available categories
-=======
-    GET /shop/categories - Get list of all available categories
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-    """
-    categories = inventory.objects.filter().values_list(
-        'category', flat=True
-    ).distinct().order_by('category')
-<<<<<<< HEAD
-    categories2 = Category.objects.all()
-    cat_list=list(categories)
-    categories_data = [
-        {'id': cat.id, 'name': cat.name}
-        for cat in categories2
-    ]
-    
-    category_list=[]
-    for j in categories_data:
-        for i in cat_list:
-            if j['id']==i:
-                category_list.append(j['name'])
-    return Response({'categories': category_list})
-=======
-    
-    
-    return Response({'categories': list(categories)})
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
+    """
+    used_ids = set(inventory.objects.values_list('category', flat=True).distinct().order_by('category'))
+    return Response({'categories': category_names(Category.objects.all(), used_ids)})
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@renderer_classes(FAST_RENDERERS)
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def order_list(request):
     """
-<<<<<<< HEAD
-    GET /orders/past -  user's past orders
-=======
-    GET /orders/past - Get user's past orders
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
+    GET /orders/past -  user's past orders, newest first, cursor paginated
+
+    Query params: limit, cursor, fields/exclude, summary=1 (only id, status,
+    total_amount and item_count of each order).
     """
-    orders = Order.objects.filter(user=request.user).prefetch_related(
-        'user'
-    ).order_by('-created_at')
-    
-    serializer = OrderSerializer(orders, many=True)
+    try:
+        queryset, build = order_history(request.user, request.GET)
+        limit = parse_limit(request.GET.get('limit'))
+        orders, next_cursor = paginate(queryset, '-created_at', request.GET.get('cursor'), limit)
+    except (FieldsetError, PaginationError) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    data = build(orders)
     return Response({
-        'orders': serializer.data,
-        'count': len(serializer.data)
+        'orders': data,
+        'count': len(data),
+        'next_cursor': next_cursor,
+        'limit': limit,
     })
 
 @api_view(['POST'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def create_order(request):
     """
@@ -600,7 +777,7 @@ def create_order(request):
     
     """
    
-    print("Parsed data:", request.data)
+    logger.debug("Order payload: %s", request.data)
     serializer = CreateOrderSerializer(data=request.data)
    
     
@@ -610,54 +787,16 @@ def create_order(request):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    with transaction.atomic():
-        # Calculate total amount and prepare order items
-        total_amount = 0
-        order_items_data = []
-        
-        for item_data in serializer.validated_data['items']:
-            item = inventory.objects.select_for_update().get(
-                id=int(item_data['item_id']), 
-                
-            )
-            quantity = int(item_data['quantity'])
-            
-            # Double-check stock (in case it changed since validation)
-            if item.quantity < quantity:
-                return Response(
-                    {'error': f'Insufficient stock for {item.name}'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Reduce item quantity
-            item.quantity -= quantity
-            item.save()
-            
-            item_total = item.price * quantity
-            total_amount += item_total
-            
-            order_items_data.append({
-                'item': item,
-                'quantity': quantity,
-                'price': item.price
-            })
-        
-        # Create order
-        order = Order.objects.create(
-            user=request.user,
-            total_amount=total_amount,
+    try:
+        order = place_order(
+            request.user,
+            serializer.validated_data.get('items'),
             shipping_address=serializer.validated_data['shipping_address'],
             phone_number=serializer.validated_data['phone_number'],
+            reservation=serializer.validated_data.get('reservation'),
         )
-        
-        # Create order items
-        for item_data in order_items_data:
-            OrderItem.objects.create(
-                order=order,
-                product=item_data['item'],
-                quantity=item_data['quantity'],
-                price=item_data['price']
-            )
+    except CheckoutError as e:
+        return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
     
     # Return created order
     order_serializer = OrderSerializer(order)
@@ -670,23 +809,149 @@ def create_order(request):
         status=status.HTTP_201_CREATED
     )
 
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def reserve_stock(request):
+    """
+    POST /orders/reserve - Hold stock for a checkout
+
+    Expects the items of /orders/new. The returned reservation token is
+    passed to /orders/new as ``reservation`` before ``expires_at``.
+    """
+    serializer = OrderLinesSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(
+            {'errors': serializer.errors},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        hold = reserve(request.user, normalize_lines(serializer.validated_data['items']))
+    except ReservationError as e:
+        return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {
+            'reservation': hold.token,
+            'expires_at': hold.expires_at,
+            'items': [{'item_id': product_id, 'quantity': quantity}
+                      for product_id, quantity in hold.lines.items()],
+        },
+        status=status.HTTP_201_CREATED
+    )
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def release_reservation(request, token):
+    """
+    POST /orders/reserve/{token}/release - Give held stock back
+    """
+    if not release(token, request.user):
+        return Response(
+            {'error': 'Reservation not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response({'message': 'Reservation released'})
+
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication, SessionAuthentication])
+@renderer_classes(FAST_RENDERERS)
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def cart_list(request):
+    """
+    GET /cart - the user's cart with current prices and available stock
+    """
+    return Response(cart.contents(request.user))
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def cart_add(request):
+    """
+    POST /cart/add - Add units of a product to the cart
+    Expects: item_id, quantity (default 1)
+    """
+    serializer = CartAddSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        quantity = cart.add(request.user, serializer.validated_data['item_id'],
+                            serializer.validated_data['quantity'])
+    except cart.CartError as e:
+        return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'item_id': serializer.validated_data['item_id'], 'quantity': quantity})
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def cart_update(request):
+    """
+    POST /cart/update - Set the quantities of cart lines, 0 removes a line
+    Expects: items: [{item_id, quantity}, ...]
+    """
+    serializer = CartUpdateSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    lines = {line['item_id']: line['quantity'] for line in serializer.validated_data['items']}
+    try:
+        cart.set_quantities(request.user, lines)
+    except cart.CartError as e:
+        return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(cart.contents(request.user))
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def cart_remove(request):
+    """
+    POST /cart/remove - Remove products from the cart
+    Expects: item_ids: [id, ...]
+    """
+    serializer = CartRemoveSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'removed': cart.remove(request.user, serializer.validated_data['item_ids'])})
+
+@api_view(['POST'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def cart_checkout(request):
+    """
+    POST /cart/checkout - Order everything in the cart and empty it
+    Expects: shipping_address, phone_number
+    """
+    serializer = CartCheckoutSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        order = checkout_cart(request.user, **serializer.validated_data)
+    except CheckoutError as e:
+        return Response({'error': e.message}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {
+            'message': 'Order created successfully',
+            'order_id': order.id,
+            'order': OrderSerializer(order).data
+        },
+        status=status.HTTP_201_CREATED
+    )
+
+@api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def order_detail(request, order_id):
     """
-    GET /orders/{id} - Get specific order details
+    GET /orders/{id} - Get specific order details, fields/exclude pick the returned fields
     """
     try:
-        order = Order.objects.prefetch_related(
-<<<<<<< HEAD
-            'items'
-=======
-            'items', 'items__item'
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
-        ).get(id=order_id, user=request.user)
+        fields = ORDER_FIELDS.select(request.GET)
+    except FieldsetError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        order = order_queryset(Order.objects.all(), fields).get(id=order_id, user_id=request.user.pk)
         
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(order, fields=fields)
         return Response(serializer.data)
     except Order.DoesNotExist:
         return Response(
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from ecomm.sqlite import database_settings
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -44,11 +47,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'ecomm.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecomm.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +81,24 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# WAL, busy timeout, persistent connections and BEGIN IMMEDIATE, see
+# ecomm/sqlite.py for the profiles and the ECOMM_SQLITE_* overrides
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_settings(BASE_DIR / 'db.sqlite3'),
 }
 
+# Read replicas, e.g. ECOMM_SQLITE_REPLICAS=db.replica1.sqlite3,db.replica2.sqlite3
+# (paths relative to BASE_DIR); manage.py sync_replicas copies the primary into them
+for number, path in enumerate(filter(None, os.environ.get('ECOMM_SQLITE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        **database_settings(BASE_DIR / path.strip()),
+        'TEST': {'MIRROR': 'default'},
+    }
+ECOMM_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# Writes go to default, reads of ECOMM_REPLICA_VIEWS to a replica (ecomm/routing.py)
+DATABASE_ROUTERS = ['ecomm.routing.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,13 +142,55 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'ecomm.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # DRF's defaults, JSON rendering counted as serializer time (ecomm/metrics.py)
+    'DEFAULT_RENDERER_CLASSES': [
+        'ecomm.fastpath.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
+# Views that build their rows with ecomm.fastpath instead of DRF serializers
+ECOMM_FAST_PATH_VIEWS = ['shop-item-list', 'inventory_list', 'order-list', 'view_orders']
+
+# Per-request SQL, serializer and total time as a Server-Timing header (ecomm.middleware)
+ECOMM_SERVER_TIMING = True
+
+# Views whose reads may go to a read replica, by URL name
+ECOMM_REPLICA_VIEWS = [
+    'shop-item-list', 'shop-item-detail', 'shop-categories', 'order-list', 'order-detail',
+    'async-shop-item-list', 'async-shop-item-detail', 'async-shop-categories',
+    'async-order-list', 'async-order-detail', 'view_orders', 'revenue_stats',
+]
+# Seconds a user's reads stay on the primary after they wrote
+ECOMM_REPLICA_PIN_SECONDS = 5
+
+# In-memory catalog snapshot serving shop/list and shop/item (ecomm/snapshot.py)
+ECOMM_CATALOG_SNAPSHOT = {'ENABLED': True, 'MIN_REBUILD_SECONDS': 5.0}
+
+# Price bucket bounds of the shop/list?facets=1 counts (ecomm/facets.py)
+ECOMM_PRICE_BUCKETS = [10, 25, 50, 100, 250]
+
+# Seconds /orders/reserve/ holds stock for a checkout (ecomm/reservations.py)
+ECOMM_RESERVATION_TTL = 600
+
+# Background job queue run by manage.py run_workers (ecomm/jobs.py)
+ECOMM_JOBS = {
+    'BATCH_SIZE': 10,
+    'LEASE_SECONDS': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_DELAY': 2.0,
+    'MAX_RETRY_DELAY': 600,
+    'CONCURRENCY': {'order-placed': 4},
+}
+
+# order-placed jobs warn when an order leaves a product with this many units or fewer (ecomm/tasks.py)
+ECOMM_LOW_STOCK_THRESHOLD = 5
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
@@ -164,25 +222,36 @@ SIMPLE_JWT = {
 AUTH_USER_MODEL = 'ecomm.User'  # Replace with your actual app name
 
 # Logging configuration
+# Views log from the request path, so records go through a bounded queue to a
+# writer thread (ecomm.logpipeline) instead of blocking on the file.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            # share of INFO and DEBUG records kept, per logger
+            '()': 'ecomm.logpipeline.SamplingFilter',
+            'rates': {'ecomm.views.access': 0.1},
+        },
+    },
     'handlers': {
-        'file': {
+        'pipeline': {
+            '()': 'ecomm.logpipeline.pipeline_handler',
             'level': 'INFO',
-            'class': 'logging.FileHandler',
             'filename': 'auth.log',
-        },
-        'console': {
-            'level': 'INFO',
-            'class': 'logging.StreamHandler',
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'rotate_interval': 24 * 60 * 60,
+            'queue_size': 10000,
+            'console': True,
+            'filters': ['sampling'],
         },
     },
     'loggers': {
         'ecomm': {  # Replace with your actual app name
-            'handlers': ['file', 'console'],
+            'handlers': ['pipeline'],
             'level': 'INFO',
             'propagate': True,
         },
     },
-}
\ No newline at end of file
+}
@@ -16,7 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
-from ecomm import views
+from ecomm import async_views, views
 urlpatterns = [
     # User authentication
     path('auth/user/signup/', views.user_signup, name='user_signup'),
@@ -33,22 +33,37 @@ urlpatterns = [
     # Order endpoints
     path('orders/past/', views.order_list, name='order-list'),
     path('orders/new/', views.create_order, name='create-order'),
+    path('orders/reserve/', views.reserve_stock, name='reserve-stock'),
+    path('orders/reserve/<uuid:token>/release/', views.release_reservation, name='release-reservation'),
     path('orders/<int:order_id>/', views.order_detail, name='order-detail'),
 
+    # Cart endpoints
+    path('cart/', views.cart_list, name='cart'),
+    path('cart/add/', views.cart_add, name='cart-add'),
+    path('cart/update/', views.cart_update, name='cart-update'),
+    path('cart/remove/', views.cart_remove, name='cart-remove'),
+    path('cart/checkout/', views.cart_checkout, name='cart-checkout'),
+
+    # Async read endpoints, for ASGI deployments
+    path('async/shop/list/', async_views.shop_item_list, name='async-shop-item-list'),
+    path('async/shop/item/<int:item_id>/', async_views.shop_item_detail, name='async-shop-item-detail'),
+    path('async/shop/categories/', async_views.shop_categories, name='async-shop-categories'),
+    path('async/orders/past/', async_views.order_list, name='async-order-list'),
+    path('async/orders/<int:order_id>/', async_views.order_detail, name='async-order-detail'),
+
     # Common endpoints
     path('auth/logout/', views.logout, name='logout'),
     path('auth/profile/', views.user_profile, name='user_profile'),
     path('inventory/list/', views.inventory_list, name='inventory_list'),
     path('inventory/new/', views.inventory_create, name='create_item'),
     path('inventory/update/', views.inventory_update, name='update_item'),
+    path('inventory/bulk/', views.inventory_bulk_upsert, name='bulk_upsert_items'),
     path('inventory/restock/', views.restock_item, name='restock_item'),
+    path('inventory/restock/batch/', views.restock_batch, name='restock_batch'),
     path('inventory/orders/', views.view_orders, name='view_orders'),
     path('inventory/revenue/', views.revenue_stats, name='revenue_stats'),
     path('categories/', views.list_categories, name='list_categories'),
-<<<<<<< HEAD
-=======
-
->>>>>>> 519818360dee6caac26d031b0e1f580103c5fb5a
+    path('metrics/', views.metrics_view, name='metrics'),
     path('api-auth/', include('rest_framework.urls')),
     path('admin/', admin.site.urls),
 ]